@@ -0,0 +1,52 @@
+"""
+Rebuild time after adding one system dependency, flat vs layered Dockerfile.
+
+Needs a running docker daemon with BuildKit.
+
+    python benchmarks/bench_layered_build.py --base-image ubuntu:22.04 --extra htop
+"""
+import argparse, subprocess, time
+from dockipy import utils
+
+
+def build(dockerfile, tag):
+    start = time.time()
+    result = subprocess.run(
+        ["docker", "builder", "build", "--progress=plain", "-t", tag, "-"],
+        input=dockerfile, text=True, capture_output=True,
+    )
+    if result.returncode != 0:
+        print(result.stdout[-2000:])
+        print(result.stderr[-2000:])
+        raise SystemExit(f"build of {tag} failed")
+    return time.time() - start
+
+
+def bench(mode, base_image, packages, extra):
+    layered = mode == "layered"
+    tag = f"docki-bench-{mode}"
+    before = utils.build_dockerfile(base_image, packages, [], "/bench", layered=layered)
+    after = utils.build_dockerfile(base_image, packages + [extra], [], "/bench", layered=layered)
+    # make sure the starting point is fully cached
+    build(before, tag)
+    warm = build(before, tag)
+    rebuild = build(after, tag)
+    subprocess.run(["docker", "image", "rm", "-f", tag], capture_output=True)
+    return warm, rebuild
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-image", default="ubuntu:22.04")
+    parser.add_argument("--packages", nargs="+", default=["python3", "python3-pip", "python3-dev", "python3-venv", "git", "curl", "build-essential"])
+    parser.add_argument("--extra", default="htop", help="package added to trigger the rebuild")
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'no change':>10} {'+' + args.extra:>12}")
+    for mode in ["flat", "layered"]:
+        warm, rebuild = bench(mode, args.base_image, args.packages, args.extra)
+        print(f"{mode:<8} {warm:>9.1f}s {rebuild:>11.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Time the real entry points against a fake docker daemon (fake_docker.py), so
+the numbers are what docki adds on top of docker.
+
+Every scenario runs once to warm up and then --repeat times in a fresh
+interpreter. The median of each is reported:
+
+    wall        start to exit of the command
+    first api   start to the first docker API request
+    api calls   docker API requests made by the command
+    overhead    wall minus the time spent streaming the container output
+    log MB/s    container output printed per second by print_logs
+    peak rss    maximum resident memory of the process
+
+Results are appended to ~/.docki/bench/orchestration.jsonl and compared with
+the last run with the same parameters.
+
+    python benchmarks/bench_orchestration.py --latency 2 --log-mb 20
+"""
+import argparse, json, os, platform, shutil, statistics, subprocess, sys, tempfile, time
+from fake_docker import FakeDocker, LOG_LINE
+from dockipy.state import state_path
+
+ENTRY_POINT = "import sys; sys.argv[0] = {name!r}; from dockipy.{name} import {name}; {name}()"
+# the fake daemon builds through the API, there is no docker CLI to build with
+PROJECTS = {
+    "plain": "base_image: ubuntu:22.04\ntag: docki-bench\nsystem_dep:\n  - python3\nbuilder: api\n",
+    "venv": "base_image: ubuntu:22.04\ntag: docki-bench-venv\nsystem_dep:\n  - python3\n  - python3-venv\npython_dep:\n  - numpy\npip_cache: false\nbuilder: api\n",
+}
+METRICS = [("wall", "s"), ("first_api", "s"), ("api_calls", ""), ("overhead", "s"), ("log_mb_s", "MB/s"), ("peak_rss_mb", "MB")]
+# higher is better for these, lower for the rest
+HIGHER_BETTER = {"log_mb_s"}
+
+
+class Scenario:
+    def __init__(self, name, program, project, command, prepare=None):
+        self.name = name
+        self.program = program
+        self.project = project
+        self.command = command
+        self.prepare = prepare
+
+
+def run_once(scenario, docker, work, trace_file):
+    if scenario.prepare is not None:
+        scenario.prepare(docker, work)
+    docker.reset(images=False)
+    env = dict(os.environ, DOCKER_HOST=f"unix://{docker.socket_path}", DOCKI_HOME=os.path.join(work, "home"), DOCKI_PROFILE=trace_file)
+    env.pop("DOCKI_API_STATS", None)
+    code = ENTRY_POINT.format(name=scenario.program)
+    with open(os.path.join(work, "stderr.txt"), "w+") as stderr:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, "-c", code] + scenario.command, cwd=os.path.join(work, scenario.project),
+            env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr,
+        )
+        _pid, status, usage = os.wait4(process.pid, 0)
+        wall = time.time() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise SystemExit(f"{scenario.name} exited with {process.returncode}:\n{stderr.read()[-3000:]}")
+    with open(trace_file) as f:
+        trace = json.load(f)["traceEvents"]
+    logs = sum(event["dur"] for event in trace if event.get("cat") == "phase" and event["name"] == "logs") / 1e6
+    log_bytes = len(LOG_LINE) * max(docker.log_bytes // len(LOG_LINE), 1)
+    calls = docker.calls
+    return {
+        "wall": wall,
+        "first_api": calls[0][1] - start if len(calls) > 0 else None,
+        "api_calls": len(calls),
+        "overhead": wall - logs,
+        "log_mb_s": log_bytes / 1024**2 / logs if logs > 0 else None,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "endpoints": sorted(set(endpoint for endpoint, _time in calls)),
+    }
+
+
+def median(runs, metric):
+    values = [run[metric] for run in runs if run[metric] is not None]
+    return statistics.median(values) if len(values) > 0 else None
+
+
+def cold_image(docker, work):
+    docker.reset(images=True)
+    shutil.rmtree(os.path.join(work, "home"), ignore_errors=True)
+
+
+def cold_venv(docker, work):
+    shutil.rmtree(os.path.join(work, "venv", "venv"), ignore_errors=True)
+
+
+SCENARIOS = [
+    Scenario("dockipy cold build", "dockipy", "plain", ["bench.py"], prepare=cold_image),
+    Scenario("dockipy cached", "dockipy", "plain", ["bench.py"]),
+    Scenario("dockipy venv install", "dockipy", "venv", ["bench.py"], prepare=cold_venv),
+    Scenario("dockipy venv cached", "dockipy", "venv", ["bench.py"]),
+    Scenario("dockishell cached", "dockishell", "plain", ["cat", "train.log"]),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_record(history, params):
+    if not os.path.exists(history):
+        return None
+    previous = None
+    with open(history) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("params") == params:
+                previous = record
+    return previous
+
+
+def change(metric, value, old):
+    if value is None or old is None or old == 0:
+        return ""
+    delta = (value - old) / old * 100
+    better = delta > 0 if metric in HIGHER_BETTER else delta < 0
+    return f" ({delta:+.0f}%{'' if abs(delta) < 10 else ' better' if better else ' worse'})"
+
+
+def print_results(results, previous):
+    old_results = previous["results"] if previous is not None else {}
+    width = max(len(name) for name in results)
+    print(f"{'scenario':<{width}}  " + "  ".join(f"{metric:>22}" for metric, _unit in METRICS))
+    for name, result in results.items():
+        cells = []
+        for metric, unit in METRICS:
+            value = result[metric]
+            text = "-" if value is None else (f"{value:.0f}" if metric == "api_calls" else f"{value:.3f}{unit}")
+            cells.append(f"{text + change(metric, value, old_results.get(name, {}).get(metric)):>22}")
+        print(f"{name:<{width}}  " + "  ".join(cells))
+    if previous is not None:
+        print(f"\ncompared with {previous['commit']} at {previous['time']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=1.0, help="ms the fake daemon waits before every response")
+    parser.add_argument("--log-mb", type=float, default=10.0, help="MB printed by the container")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--history", default=str(state_path("bench", "orchestration.jsonl")), help="jsonl file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="only compare, do not append the results")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the API endpoints every scenario uses")
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in SCENARIOS if args.only is None or scenario.name in args.only.split(",")]
+    work = tempfile.mkdtemp(prefix="docki-bench-")
+    docker = FakeDocker(os.path.join(work, "docker.sock"), args.latency / 1000, int(args.log_mb * 1024**2)).start()
+    results = {}
+    try:
+        for project, config in PROJECTS.items():
+            os.makedirs(os.path.join(work, project))
+            with open(os.path.join(work, project, "docki.yaml"), "w") as f:
+                f.write(config)
+            with open(os.path.join(work, project, "bench.py"), "w") as f:
+                f.write("print('hello')\n")
+        for scenario in scenarios:
+            trace_file = os.path.join(work, "trace.json")
+            run_once(scenario, docker, work, trace_file)
+            runs = [run_once(scenario, docker, work, trace_file) for _ in range(args.repeat)]
+            results[scenario.name] = {metric: median(runs, metric) for metric, _unit in METRICS}
+            if args.verbose:
+                print(f"{scenario.name}: {', '.join(runs[-1]['endpoints'])}")
+    finally:
+        docker.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    params = {"latency_ms": args.latency, "log_mb": args.log_mb, "repeat": args.repeat, "scenarios": [scenario.name for scenario in scenarios]}
+    previous = previous_record(args.history, params)
+    print_results(results, previous)
+    if not args.no_save:
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": git_commit(),
+            "python": platform.python_version(), "params": params, "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"results appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold start of a project with heavy python_dep, with and without prefetch.
+
+Both modes start from the same state: the project venv was built for a small
+python_dep, the heavy requirements were just added and the image is rebuilt
+with --clean. Without prefetch pip downloads the wheels in the container once
+the image is built, with it they are downloaded on the host during the build.
+The shared pip cache is off and every run gets an empty ~/.docki, so every run
+downloads everything.
+
+Needs a running docker daemon and network access.
+
+    python benchmarks/bench_prefetch.py --packages numpy scipy pandas scikit-learn --repeat 3
+"""
+import argparse, json, os, shutil, statistics, subprocess, sys, tempfile, time
+
+ENTRY_POINT = "import sys; sys.argv[0] = 'dockipy'; from dockipy.dockipy import dockipy; dockipy()"
+CONFIG = """base_image: {base_image}
+tag: docki-bench-prefetch
+system_dep:
+  - python3
+  - python3-venv
+  - python3-pip
+  - build-essential
+  - git
+python_dep:
+{python_dep}
+pip_cache: false
+prefetch: {prefetch}
+"""
+
+
+def write_config(project, base_image, packages, prefetch):
+    python_dep = "\n".join(f"  - {package}" for package in packages)
+    with open(os.path.join(project, "docki.yaml"), "w") as f:
+        f.write(CONFIG.format(base_image=base_image, python_dep=python_dep, prefetch="true" if prefetch else "false"))
+
+
+def run(project, home, clean=True):
+    trace_file = os.path.join(home, "trace.json")
+    env = dict(os.environ, DOCKI_HOME=home, DOCKI_PROFILE=trace_file)
+    command = [sys.executable, "-c", ENTRY_POINT] + (["--clean"] if clean else []) + ["bench.py"]
+    start = time.time()
+    result = subprocess.run(command, cwd=project, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    wall = time.time() - start
+    if result.returncode != 0:
+        raise SystemExit(f"dockipy exited with {result.returncode}:\n{result.stdout[-3000:]}{result.stderr[-3000:]}")
+    with open(trace_file) as f:
+        trace = json.load(f)["traceEvents"]
+    phases = {}
+    for event in trace:
+        if event.get("cat") == "phase" and "dur" in event:
+            phases[event["name"]] = phases.get(event["name"], 0.0) + event["dur"] / 1e6
+    return {"wall": wall, "build": phases.get("build"), "prefetch": phases.get("prefetch"), "venv": phases.get("venv")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-image", default="ubuntu:22.04")
+    parser.add_argument("--packages", nargs="+", default=["numpy", "scipy", "pandas", "scikit-learn", "matplotlib", "pyarrow"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="docki-bench-prefetch-")
+    project = os.path.join(work, "project")
+    os.makedirs(project)
+    results = {"sequential": [], "prefetch": []}
+    try:
+        # the starting point: the venv of a small python_dep, which records the python of the image
+        write_config(project, args.base_image, ["six"], False)
+        with open(os.path.join(project, "bench.py"), "w") as f:
+            f.write("import six\n")
+        run(project, os.path.join(work, "home-start"), clean=False)
+        with open(os.path.join(project, "bench.py"), "w") as f:
+            f.write("print('hello')\n")
+        shutil.copytree(os.path.join(project, "venv"), os.path.join(work, "venv-start"), symlinks=True)
+        for i in range(args.repeat):
+            # alternate so both modes see the same network and disk conditions
+            for mode in ["sequential", "prefetch"]:
+                shutil.rmtree(os.path.join(project, "venv"))
+                shutil.copytree(os.path.join(work, "venv-start"), os.path.join(project, "venv"), symlinks=True)
+                write_config(project, args.base_image, args.packages, mode == "prefetch")
+                home = os.path.join(work, f"home-{mode}-{i}")
+                results[mode].append(run(project, home))
+                print(f"{mode:<11} run {i + 1}: {results[mode][-1]['wall']:.1f}s", flush=True)
+    finally:
+        subprocess.run(["docker", "image", "rm", "-f", "docki-bench-prefetch:latest"], capture_output=True)
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(f"\n{'mode':<11} {'wall':>8} {'build':>8} {'prefetch':>9} {'venv':>8}")
+    medians = {}
+    for mode, runs in results.items():
+        medians[mode] = {key: statistics.median(run[key] for run in runs) if all(run[key] is not None for run in runs) else None for key in runs[0]}
+        cells = [f"{value:>7.1f}s" if value is not None else f"{'-':>8}" for value in medians[mode].values()]
+        print(f"{mode:<11} {cells[0]} {cells[1]} {cells[2]:>9} {cells[3]}")
+    saving = medians["sequential"]["wall"] - medians["prefetch"]["wall"]
+    print(f"\nprefetch saves {saving:.1f}s ({saving / medians['sequential']['wall'] * 100:.0f}%) of the cold start with {', '.join(args.packages)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Log throughput of print_logs in MB/s, without a docker daemon.
+
+Compares the old path (one byte per chunk from docker-py, decoded and printed
+one chunk at a time) with the chunked incremental decoder used by print_logs,
+and with the compressed log that the run history writes on the side.
+
+    python benchmarks/bench_print_logs.py --size 64
+"""
+import argparse, io, os, tempfile, time
+from dockipy import history, utils
+
+LINE = "epoch 1 step 42 loss 0.1234 lr 3e-4 ✓ ümlaut\n".encode("utf-8")
+
+
+def chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def old_print(chunks, out):
+    for line in chunks:
+        try:
+            print(line.decode("utf-8"), end="", file=out)
+        except:
+            pass
+
+
+def history_print(chunks, out):
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = history.LogWriter(tmp, out, segment_size=1024**3 // history.SEGMENTS)
+        utils.write_chunks(chunks, writer)
+        writer.close()
+
+
+def measure(name, write, data, chunk_size):
+    with open(os.devnull, "w", encoding="utf-8") as out:
+        start = time.perf_counter()
+        write(chunks(data, chunk_size), out)
+        elapsed = time.perf_counter() - start
+    mb = len(data) / 1024**2
+    print(f"{name:<28} {mb / elapsed:>10.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=16, help="MB of log output")
+    args = parser.parse_args()
+    data = LINE * (args.size * 1024**2 // len(LINE))
+    # the old path is too slow to run on the full size
+    measure("old (1 byte chunks)", old_print, data[:len(data) // 64], 1)
+    measure("print_logs (64 KiB chunks)", utils.write_chunks, data, 64 * 1024)
+    measure("print_logs (4 KiB chunks)", utils.write_chunks, data, 4 * 1024)
+    measure("print_logs + history", history_print, data, 64 * 1024)
+
+
+if __name__ == "__main__":
+    main()
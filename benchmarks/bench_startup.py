@@ -0,0 +1,53 @@
+"""
+Cold start budget of every console entry point, based on python -X importtime.
+
+Each module behind a console script is imported in a fresh interpreter, the
+best of --repeat runs is compared with its budget and the heavy optional
+modules (docker, libtmux, readline) must not be loaded at import time.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse, subprocess, sys
+
+# module: budget in milliseconds for the cumulative import time
+BUDGETS = {
+    "dockipy.dockipy": 120,
+    "dockipy.dockishell": 120,
+    "dockipy.dockibook": 120,
+    "dockipy.envipy": 100,
+    "dockipy.envibook": 100,
+    "dockipy.utils": 100,
+}
+LAZY_MODULES = ["docker", "libtmux", "readline", "requests", "yaml"]
+
+
+def import_time(module):
+    code = f"import {module}, sys; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000, result.stdout.strip()
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<22} {'import':>9} {'budget':>9}  loaded")
+    for module, budget in BUDGETS.items():
+        results = [import_time(module) for _ in range(args.repeat)]
+        best = min(elapsed for elapsed, _loaded in results)
+        loaded = results[0][1]
+        ok = best <= budget * args.scale and loaded == ""
+        failed |= not ok
+        print(f"{module:<22} {best:>7.1f}ms {budget * args.scale:>7.0f}ms  {loaded or '-'}{'' if ok else '  FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
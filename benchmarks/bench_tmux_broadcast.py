@@ -0,0 +1,51 @@
+"""
+Latency of typing one command into every host pane, for 1 to 64 panes.
+
+Compares one libtmux send_keys per pane (the old HostManager path) with the
+batched TmuxFleet.broadcast. Needs tmux, the panes only run a local shell.
+
+    python benchmarks/bench_tmux_broadcast.py --repeat 20
+"""
+import argparse, statistics, time
+import libtmux
+from dockipy import utils
+
+
+def per_pane(fleet, command):
+    for pane in fleet.panes:
+        fleet.server.cmd("send-keys", "-t", pane, command)
+        fleet.server.cmd("send-keys", "-t", pane, "Enter")
+
+
+def measure(send, fleet, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        send(fleet, "true")
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--panes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    server = libtmux.Server()
+    print(f"{'panes':>5} {'create':>10} {'per pane':>10} {'batched':>10}")
+    for count in args.panes:
+        hosts = [{"name": f"host{i}"} for i in range(count)]
+        start = time.perf_counter()
+        fleet = utils.TmuxFleet(utils.unique_session_name("docki_bench", server), hosts, connect="true", server=server)
+        create = (time.perf_counter() - start) * 1000
+        try:
+            old = measure(per_pane, fleet, args.repeat)
+            new = measure(lambda fleet, command: fleet.broadcast(command), fleet, args.repeat)
+        finally:
+            fleet.close()
+        print(f"{count:>5} {create:>8.1f}ms {old:>8.1f}ms {new:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+A fake Docker Engine API on a Unix socket, enough for dockipy and dockishell
+to build an image, set up the venv and run a command without a docker daemon,
+and for docki to save and load the image of a bundle.
+
+Every request waits --latency ms before it is answered, containers print
+--log-mb MB of output. Used by bench_orchestration.py, or standalone:
+
+    python benchmarks/fake_docker.py --socket /tmp/docker.sock --latency 2
+    DOCKER_HOST=unix:///tmp/docker.sock dockipy train.py
+"""
+import argparse, gzip, hashlib, io, json, os, re, socketserver, struct, tarfile, threading, time, uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+API_VERSION = "1.45"
+VENV = re.compile(r"-m venv (?:--clear )?([^\s;&]+)")
+LOG_LINE = b"epoch 1 step 42 loss 0.1234 lr 3e-4 \xe2\x9c\x93\n"
+
+
+class FakeDocker:
+    def __init__(self, socket_path, latency=0.0, log_bytes=1024 * 1024, build_steps=6, chunk_size=64 * 1024):
+        self.socket_path = socket_path
+        self.latency = latency
+        self.log_bytes = log_bytes
+        self.build_steps = build_steps
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.images = {}
+        self.containers = {}
+        self.calls = []
+        self.server = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        handler = type("Handler", (Handler,), {"docker": self})
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.socket_path)
+
+    def reset(self, images=True):
+        with self.lock:
+            self.calls = []
+            if images:
+                self.images = {}
+            self.containers = {}
+
+    def record(self, endpoint):
+        with self.lock:
+            self.calls.append((endpoint, time.time()))
+
+    def output(self, container):
+        command = " ".join(container["Cmd"] or [])
+        if "platform.python_version" in command:
+            return b"3.11.7\n"
+        if "pip" in command:
+            return b"Collecting numpy\nSuccessfully installed numpy-2.0.0\n"
+        return LOG_LINE * max(self.log_bytes // len(LOG_LINE), 1)
+
+
+def image_key(name):
+    name = unquote(name)
+    if name.startswith("sha256:"):
+        return name
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+def endpoint_name(method, path):
+    if path not in ("/containers/create", "/containers/json"):
+        path = re.sub(r"^/(containers|exec)/[^/]+", r"/\1/{id}", path)
+        path = re.sub(r"^/images/.+/(\w+)$", r"/images/{name}/\1", path)
+    return f"{method} {path}"
+
+
+def save_image(image, layer_bytes, chunk_size):
+    """
+    A docker save stream of the image, the image json and a layer of layer_bytes.
+    """
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w") as tar:
+        for name, data in (("image.json", json.dumps(image).encode("utf-8")), ("layer.tar", LOG_LINE * max(layer_bytes // len(LOG_LINE), 1))):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = out.getvalue()
+    return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    docker = None
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return "unix"
+
+    def body(self):
+        if self.headers.get("Transfer-Encoding", "") == "chunked":
+            data = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                data += self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    return data
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_json(self, status, content):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_stream(self, chunks, content_type="application/octet-stream"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if len(chunk) > 0:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def container(self, name_or_id):
+        docker = self.docker
+        with docker.lock:
+            for container in docker.containers.values():
+                if name_or_id in (container["Id"], container["Name"]) or container["Id"].startswith(name_or_id):
+                    return container
+        return None
+
+    def handle_request(self, method):
+        docker = self.docker
+        url = urlsplit(self.path)
+        path = re.sub(r"^/v[\d.]+", "", url.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.body() if method in ("POST", "PUT") else b""
+        if docker.latency > 0:
+            time.sleep(docker.latency)
+        docker.record(endpoint_name(method, path))
+
+        if path == "/_ping":
+            return self.send_json(200, "OK")
+        if path == "/version":
+            return self.send_json(200, {"ApiVersion": API_VERSION, "MinAPIVersion": "1.24", "Version": "fake", "Os": "linux", "Arch": "amd64"})
+        match = re.match(r"^/images/(.+)/json$", path)
+        if match and method == "GET":
+            image = docker.images.get(image_key(match.group(1)))
+            if image is None:
+                return self.send_json(404, {"message": f"No such image: {match.group(1)}"})
+            return self.send_json(200, image)
+        match = re.match(r"^/images/(.+)/get$", path)
+        if match and method == "GET":
+            image = docker.images.get(image_key(match.group(1)))
+            if image is None:
+                return self.send_json(404, {"message": f"No such image: {match.group(1)}"})
+            return self.send_stream(save_image(image, docker.log_bytes, docker.chunk_size), "application/x-tar")
+        if path == "/images/load" and method == "POST":
+            return self.load(body)
+        if path == "/build" and method == "POST":
+            return self.build(query)
+        if path == "/containers/create" and method == "POST":
+            return self.create(query, json.loads(body or b"{}"))
+        if path == "/containers/json":
+            return self.send_json(200, [])
+        match = re.match(r"^/containers/([^/]+)(?:/(\w+))?$", path)
+        if match:
+            container = self.container(match.group(1))
+            if container is None:
+                return self.send_json(404, {"message": f"No such container: {match.group(1)}"})
+            return self.container_action(method, match.group(2), container, query)
+        return self.send_json(404, {"message": f"{method} {path} is not implemented by the fake daemon"})
+
+    def build(self, query):
+        docker = self.docker
+        tag = image_key(query.get("t", "fake"))
+        labels = json.loads(query.get("labels", "{}"))
+        image_id = "sha256:" + hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+        def lines():
+            for step in range(1, docker.build_steps + 1):
+                yield json.dumps({"stream": f"Step {step}/{docker.build_steps} : RUN step {step}\n"}).encode("utf-8") + b"\r\n"
+                yield json.dumps({"stream": f" ---> {uuid.uuid4().hex[:12]}\n"}).encode("utf-8") + b"\r\n"
+            yield json.dumps({"aux": {"ID": image_id}}).encode("utf-8") + b"\r\n"
+            yield json.dumps({"stream": f"Successfully built {image_id[7:19]}\n"}).encode("utf-8") + b"\r\n"
+            with docker.lock:
+                docker.images[tag] = {"Id": image_id, "RepoTags": [tag], "Config": {"Labels": labels}, "RootFS": {"Layers": []}}
+        self.send_stream(lines(), "application/json")
+
+    def load(self, body):
+        docker = self.docker
+        try:
+            if body[:2] == b"\x1f\x8b":
+                body = gzip.decompress(body)
+            with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                image = json.load(tar.extractfile("image.json"))
+        except (OSError, EOFError, ValueError, KeyError, tarfile.TarError) as e:
+            return self.send_json(500, {"message": f"Error processing tar file: {e}"})
+        with docker.lock:
+            for tag in image["RepoTags"]:
+                docker.images[tag] = image
+        self.send_stream([json.dumps({"stream": f"Loaded image: {tag}\n"}).encode("utf-8") + b"\r\n" for tag in image["RepoTags"]], "application/json")
+
+    def create(self, query, config):
+        docker = self.docker
+        name = query.get("name", uuid.uuid4().hex[:12])
+        if self.container(name) is not None:
+            return self.send_json(409, {"message": f"Conflict. The container name \"/{name}\" is already in use"})
+        image = docker.images.get(image_key(config.get("Image", "")))
+        if image is None:
+            return self.send_json(404, {"message": f"No such image: {config.get('Image')}"})
+        container_id = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+        cmd = config.get("Cmd") or []
+        with docker.lock:
+            docker.containers[container_id] = {
+                "Id": container_id, "Name": name, "Cmd": cmd if isinstance(cmd, list) else [cmd],
+                "Tty": bool(config.get("Tty")), "Image": image["Id"], "Labels": config.get("Labels") or {},
+                "Running": False, "Binds": (config.get("HostConfig") or {}).get("Binds") or [],
+            }
+        return self.send_json(201, {"Id": container_id, "Warnings": []})
+
+    def container_action(self, method, action, container, query):
+        docker = self.docker
+        if action == "json" and method == "GET":
+            return self.send_json(200, {
+                "Id": container["Id"], "Name": "/" + container["Name"], "Image": container["Image"],
+                "State": {"Status": "running" if container["Running"] else "exited", "Running": container["Running"], "ExitCode": 0},
+                "Config": {"Tty": container["Tty"], "Labels": container["Labels"], "Cmd": container["Cmd"]},
+                "HostConfig": {"LogConfig": {"Type": "json-file"}},
+            })
+        if action == "start":
+            container["Running"] = True
+            self.create_venv(container)
+            return self.send_empty()
+        if action in ("stop", "kill"):
+            container["Running"] = False
+            return self.send_empty()
+        if action == "wait":
+            container["Running"] = False
+            return self.send_json(200, {"StatusCode": 0})
+        if action == "logs":
+            return self.send_stream(self.logs(container, query.get("follow") in ("1", "true", "True")))
+        if action == "stats":
+            return self.send_stream(self.stats(), "application/json")
+        if action is None and method == "DELETE":
+            with docker.lock:
+                docker.containers.pop(container["Id"], None)
+            return self.send_empty()
+        return self.send_json(404, {"message": f"{method} /containers/{{id}}/{action} is not implemented by the fake daemon"})
+
+    def create_venv(self, container):
+        # the venv is the only thing dockipy expects a container to leave in the project
+        match = VENV.search(" ".join(container["Cmd"]))
+        if match is None:
+            return
+        for bind in container["Binds"]:
+            host, target = bind.split(":")[:2]
+            if match.group(1).startswith(target.rstrip("/") + "/"):
+                os.makedirs(host + match.group(1)[len(target.rstrip("/")):], exist_ok=True)
+
+    def logs(self, container, follow):
+        data = self.docker.output(container)
+        size = self.docker.chunk_size
+        for i in range(0, len(data), size):
+            chunk = data[i:i + size]
+            # without a tty docker multiplexes stdout and stderr in frames
+            yield chunk if container["Tty"] else struct.pack(">BxxxL", 1, len(chunk)) + chunk
+
+    def stats(self):
+        # two samples of a container using one and a half cpus and 256M
+        for sample in range(2):
+            yield json.dumps({
+                "cpu_stats": {"cpu_usage": {"total_usage": (sample + 1) * 1.5e9}, "system_cpu_usage": (sample + 1) * 4e9, "online_cpus": 4},
+                "precpu_stats": {"cpu_usage": {"total_usage": sample * 1.5e9}, "system_cpu_usage": sample * 4e9, "online_cpus": 4},
+                "memory_stats": {"usage": 300 * 1024**2, "stats": {"inactive_file": 44 * 1024**2}},
+            }).encode("utf-8") + b"\n"
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default="/tmp/docki-fake-docker.sock")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms before every response")
+    parser.add_argument("--log-mb", type=float, default=1.0, help="MB printed by every container")
+    args = parser.parse_args()
+    docker = FakeDocker(args.socket, args.latency / 1000, int(args.log_mb * 1024**2)).start()
+    print(f"fake docker daemon on unix://{args.socket}, ctrl+c to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        docker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import re, sys, time, shutil
+from collections import deque
+
+# BuildKit --progress=plain: "#5 [2/6] RUN ...", "#5 0.512 output", "#5 DONE 1.2s", "#5 CACHED"
+BUILDKIT_LINE = re.compile(r"^#(\d+) (.*)$")
+BUILDKIT_STEP = re.compile(r"^\[([^\]]+)\] (.*)$")
+BUILDKIT_OUTPUT = re.compile(r"^\d+\.\d+ (.*)$")
+# Classic builder: "Step 2/6 : RUN ..."
+CLASSIC_STEP = re.compile(r"^Step (\d+/\d+) : (.*)$")
+
+
+class BuildStep:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.start = time.time()
+        self.end = None
+        self.cached = False
+        self.error = None
+
+    @property
+    def wall_time(self):
+        end = self.end if self.end is not None else time.time()
+        return end - self.start
+
+
+class BuildProgress:
+    """
+    Parse docker build output line by line into steps with wall times.
+
+    Only the last `tail_size` lines of raw output are kept so that they can be
+    shown when the build fails, the rest is dropped as it streams by.
+    """
+    def __init__(self, tail_size=200, out=None, live=None):
+        self.out = out if out is not None else sys.stdout
+        self.live = live if live is not None else self.out.isatty()
+        self.tail = deque(maxlen=tail_size)
+        self.steps = {}
+        self.order = []
+        self.current = None
+        self.last_output = ""
+        self.start = time.time()
+        self.last_render = 0.0
+
+    def _begin(self, key, name, description, close_current=False):
+        # classic builder steps have no DONE line, they end when the next one starts
+        if close_current and self.current is not None and self.current.end is None:
+            self.current.end = time.time()
+        step = BuildStep(name, description)
+        self.steps[key] = step
+        self.order.append(step)
+        self.current = step
+        self.last_output = ""
+        if not self.live:
+            self.out.write(f"[{name}] {description}\n")
+            self.out.flush()
+
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        self.tail.append(line)
+        buildkit = BUILDKIT_LINE.match(line)
+        if buildkit is not None:
+            self._feed_buildkit(buildkit.group(1), buildkit.group(2))
+        else:
+            classic = CLASSIC_STEP.match(line)
+            if classic is not None:
+                self._begin(classic.group(1), classic.group(1), classic.group(2), close_current=True)
+            elif line.strip() != "":
+                self.last_output = line.strip()
+                if line.strip() == "---> Using cache" and self.current is not None:
+                    self.current.cached = True
+        self.render()
+
+    def _feed_buildkit(self, key, text):
+        step = self.steps.get(key)
+        match = BUILDKIT_STEP.match(text)
+        if step is None:
+            if match is None:
+                return
+            self._begin(key, match.group(1), match.group(2))
+            return
+        self.current = step
+        if text.startswith("DONE"):
+            step.end = time.time()
+        elif text == "CACHED":
+            step.cached = True
+            step.end = time.time()
+        elif text.startswith("ERROR"):
+            step.error = text
+            step.end = time.time()
+        else:
+            output = BUILDKIT_OUTPUT.match(text)
+            self.last_output = (output.group(1) if output is not None else text).strip()
+
+    def render(self, interval=0.1):
+        if not self.live or self.current is None:
+            return
+        # chatty steps (apt, pip) print thousands of lines, redraw at most every interval
+        now = time.time()
+        if now - self.last_render < interval:
+            return
+        self.last_render = now
+        step = self.current
+        width = shutil.get_terminal_size((100, 20)).columns
+        status = f"[{step.name}] {step.wall_time:5.1f}s {step.description}"
+        if self.last_output != "":
+            status += f" | {self.last_output}"
+        self.out.write("\r\x1b[K" + status[:width - 1])
+        self.out.flush()
+
+    def finish(self):
+        now = time.time()
+        for step in self.order:
+            if step.end is None:
+                step.end = now
+        if self.live:
+            self.out.write("\r\x1b[K")
+        self.print_summary()
+
+    def print_summary(self, top=5):
+        slowest = sorted(
+            [step for step in self.order if not step.cached and not step.name.startswith("internal")],
+            key=lambda step: step.wall_time,
+            reverse=True,
+        )[:top]
+        cached = sum(step.cached for step in self.order)
+        self.out.write(f"Build took {time.time() - self.start:.1f}s, {len(self.order)} steps ({cached} cached)\n")
+        for step in slowest:
+            self.out.write(f"  {step.wall_time:7.1f}s [{step.name}] {step.description[:80]}\n")
+        self.out.flush()
+
+    def print_tail(self):
+        for line in self.tail:
+            self.out.write(line + "\n")
+        self.out.flush()
@@ -0,0 +1,313 @@
+import gzip, hashlib, io, json, pathlib, tarfile, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+import dockipy.utils as utils
+from dockipy import image_cache, pip_cache, venv_lock
+from dockipy.__about__ import __version__ as dockipy_version
+from dockipy.sizes import format_size
+from dockipy.client import get_client
+
+BUNDLE_VERSION = 1
+MANIFEST = "manifest.json"
+IMAGE_MEMBER = "image.tar.gz"
+WHEELHOUSE = "wheels"
+REQUIREMENTS = "requirements.txt"
+# Where the wheelhouse is mounted inside the container.
+CONTAINER_WHEELHOUSE = "/docki-wheelhouse"
+CHUNK_SIZE = 1024 * 1024
+# The image is compressed while docker save streams it, a low level keeps up with the stream.
+COMPRESS_LEVEL = 1
+
+
+class HashingWriter:
+    def __init__(self, out):
+        self.out = out
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.out.write(data)
+
+    def flush(self):
+        self.out.flush()
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_streamed_member(out, name, chunks):
+    """
+    Gzip chunks into a tar member of the seekable file out without knowing the
+    size up front, the header is written once the data is. Leaves out a
+    complete tar. Returns the sha256 and size of the member.
+    """
+    header_offset = out.tell()
+    out.write(b"\0" * tarfile.BLOCKSIZE)
+    writer = HashingWriter(out)
+    with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=COMPRESS_LEVEL, mtime=0) as compressed:
+        for chunk in chunks:
+            compressed.write(chunk)
+    out.write(b"\0" * (-writer.size % tarfile.BLOCKSIZE))
+    end = out.tell()
+    info = tarfile.TarInfo(name)
+    info.size = writer.size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    out.seek(header_offset)
+    out.write(info.tobuf(tarfile.GNU_FORMAT))
+    out.seek(end)
+    # end of archive, files are appended over it
+    out.write(b"\0" * (2 * tarfile.BLOCKSIZE))
+    return writer.sha.hexdigest(), writer.size
+
+
+def append_files(path, files, manifest, written):
+    """
+    Append files, a list of (name in the bundle, path), and then the manifest
+    with the hash of every member to the bundle. written holds the hashes of
+    the members that are already in it.
+    """
+    manifest = dict(manifest, files=dict(written))
+    with tarfile.open(path, "a") as tar:
+        for name, file in files:
+            tar.add(file, arcname=name)
+            manifest["files"][name] = {"sha256": file_sha256(file), "size": pathlib.Path(file).stat().st_size}
+        data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+    return manifest
+
+
+def read_manifest(tar):
+    try:
+        manifest = json.load(tar.extractfile(MANIFEST))
+    except KeyError:
+        raise ValueError(f"{tar.name} is not a docki bundle, it has no {MANIFEST}")
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"{tar.name} is a version {manifest.get('version')} bundle, this docki reads version {BUNDLE_VERSION}")
+    return manifest
+
+
+class HashingReader:
+    """
+    The chunks of a bundle member, hashed as they are read.
+    """
+    def __init__(self, tar, name):
+        try:
+            self.file = tar.extractfile(name)
+        except KeyError:
+            self.file = None
+        if self.file is None:
+            raise ValueError(f"{name} is missing from the bundle")
+        self.sha = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in iter(lambda: self.file.read(CHUNK_SIZE), b""):
+            self.sha.update(chunk)
+            yield chunk
+
+
+def extract_verified(tar, manifest, names, dest):
+    """
+    Extract names to dest and check them against the manifest. Names that
+    would end up outside of dest are refused.
+    """
+    dest = pathlib.Path(dest).resolve()
+    for name in names:
+        expected = manifest["files"].get(name)
+        if expected is None:
+            raise ValueError(f"{name} is not in the manifest")
+        target = (dest / name).resolve()
+        if pathlib.PurePosixPath(name).is_absolute() or ".." in pathlib.PurePosixPath(name).parts or dest not in target.parents:
+            raise ValueError(f"{name} is not a valid file name in a bundle")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        reader = HashingReader(tar, name)
+        with open(target, "wb") as f:
+            for chunk in reader:
+                f.write(chunk)
+        if reader.sha.hexdigest() != expected["sha256"]:
+            raise ValueError(f"{name} is corrupt, its hash does not match the manifest")
+
+
+def run_in_image(client, tag, config, project_root, target_root, script, wheelhouse, network=True):
+    """
+    Run script in a container of the image with the project and the wheelhouse
+    mounted, and return its exit code.
+    """
+    volumes = utils.get_volumes(project_root, target_root)
+    volumes[str(wheelhouse)] = {"bind": CONTAINER_WHEELHOUSE, "mode": "rw"}
+    environment = {}
+    if network:
+        cache_volumes, environment = pip_cache.cache_mount(client, config, tag)
+        volumes.update(cache_volumes)
+    container = client.containers.run(tag,
+                                      ["bash", "-c", script],
+                                      tty=True,
+                                      detach=True,
+                                      user=utils.get_user(),
+                                      volumes=volumes,
+                                      environment=environment,
+                                      working_dir=target_root,
+                                      runtime=utils.get_runtime(config["base_image"]),
+                                      # the import proves it needs no network
+                                      **({} if network else {"network_mode": "none"}),
+                                      )
+    try:
+        return utils.print_logs(container)
+    finally:
+        container.remove(force=True)
+
+
+def build_wheelhouse(client, tag, config, project_root, target_root, wheelhouse):
+    """
+    Build a wheel of every requirement with the python of the image, so they
+    install without an index. Returns the python version of the image.
+    """
+    script = (
+        f"python3 -c 'import platform; print(platform.python_version())' > {CONTAINER_WHEELHOUSE}/.interpreter && "
+        f"python3 -m venv /tmp/docki-wheels && "
+        f"/tmp/docki-wheels/bin/pip wheel --wheel-dir {CONTAINER_WHEELHOUSE}/{WHEELHOUSE} -r {CONTAINER_WHEELHOUSE}/{REQUIREMENTS}"
+    )
+    if run_in_image(client, tag, config, project_root, target_root, script, wheelhouse) != 0:
+        raise RuntimeError("Building the wheelhouse failed.")
+    return (pathlib.Path(wheelhouse) / ".interpreter").read_text().strip()
+
+
+def export_bundle(path, config, project_root, target_root):
+    """
+    Build the image and write it, a wheelhouse of python_dep and a manifest to
+    the bundle at path.
+    """
+    start = time.time()
+    tag = utils.build_docker_image(target_root, config)
+    _tag, dockerfile = utils.image_dockerfile(target_root, config)
+    client = get_client()
+    image = client.images.get(tag)
+    python_dep = None
+    if "python_dep" in config:
+        python_dep = venv_lock.normalize(utils.requirement_lines(project_root, config))
+    with tempfile.TemporaryDirectory(prefix="docki-bundle-") as wheelhouse, ThreadPoolExecutor(max_workers=1) as pool:
+        wheels = None
+        if python_dep is not None:
+            (pathlib.Path(wheelhouse) / REQUIREMENTS).write_text("\n".join(python_dep) + "\n")
+            (pathlib.Path(wheelhouse) / WHEELHOUSE).mkdir()
+            # pip downloads while docker save streams the image
+            wheels = pool.submit(build_wheelhouse, client, tag, config, project_root, target_root, wheelhouse)
+        print(f"Saving {tag} to {path}...")
+        with open(path, "wb") as out:
+            image_sha, image_size = write_streamed_member(out, IMAGE_MEMBER, client.api.get_image(tag, chunk_size=CHUNK_SIZE))
+        files, interpreter = [], None
+        if wheels is not None:
+            interpreter = wheels.result()
+            files.append((REQUIREMENTS, pathlib.Path(wheelhouse) / REQUIREMENTS))
+            for wheel in sorted((pathlib.Path(wheelhouse) / WHEELHOUSE).iterdir()):
+                files.append((f"{WHEELHOUSE}/{wheel.name}", wheel))
+        manifest = {
+            "version": BUNDLE_VERSION,
+            "dockipy": dockipy_version,
+            "created": time.time(),
+            "tag": tag,
+            "image_id": image.id,
+            "fingerprint": (image.labels or {}).get(image_cache.FINGERPRINT_LABEL),
+            "dockerfile_sha256": hashlib.sha256(dockerfile.encode("utf-8")).hexdigest(),
+            "base_image": config["base_image"],
+            "interpreter": interpreter,
+            "python_dep": python_dep,
+            "requirements_hash": venv_lock.requirements_hash(python_dep) if python_dep is not None else None,
+        }
+        manifest = append_files(path, files, manifest, {IMAGE_MEMBER: {"sha256": image_sha, "size": image_size}})
+    size = pathlib.Path(path).stat().st_size
+    print(f"Bundle {path}: {format_size(size)}, {len(files)} files and the image, in {time.time() - start:.1f}s.")
+    return manifest
+
+
+def load_image(client, tar, manifest):
+    """
+    Load the image of the bundle, unless it is already there. Returns its id.
+    """
+    import docker
+    tag = manifest["tag"]
+    try:
+        if client.images.get(tag).id == manifest["image_id"]:
+            print(f"Image {tag} is already loaded.")
+            return manifest["image_id"]
+    except docker.errors.ImageNotFound:
+        pass
+    print(f"Loading {tag}...")
+    # the image is hashed while docker load reads it, it reads the gzip stream itself
+    reader = HashingReader(tar, IMAGE_MEMBER)
+    chunks = iter(reader)
+    error = None
+    try:
+        for line in client.api.load_image(chunks):
+            if "error" in line:
+                error = line["error"]
+    except (docker.errors.APIError, OSError) as e:
+        error = str(e)
+    # a corrupt image usually makes docker load fail, read the rest to tell
+    for _chunk in chunks:
+        pass
+    if reader.sha.hexdigest() != manifest["files"][IMAGE_MEMBER]["sha256"]:
+        if error is None:
+            client.images.remove(manifest["image_id"], force=True)
+        raise ValueError(f"{IMAGE_MEMBER} is corrupt, its hash does not match the manifest")
+    if error is not None:
+        raise RuntimeError(f"Loading the image failed: {error}")
+    return manifest["image_id"]
+
+
+def import_bundle(path, config, project_root, target_root):
+    """
+    Load a bundle without network access: the image, then the venv from the
+    wheelhouse. Steps whose result is already there are skipped. After it,
+    dockipy finds the image and the venv up to date.
+    """
+    start = time.time()
+    client = get_client()
+    with tarfile.open(path) as tar:
+        manifest = read_manifest(tar)
+        tag, dockerfile = utils.image_dockerfile(target_root, config)
+        if tag != manifest["tag"]:
+            print(f"Warning: the bundle holds {manifest['tag']}, docki.yaml builds {tag}.")
+        image_id = load_image(client, tar, manifest)
+        if hashlib.sha256(dockerfile.encode("utf-8")).hexdigest() == manifest["dockerfile_sha256"]:
+            base_digest = image_cache.base_image_digest(client, config["base_image"])
+            image_cache.record_import(manifest["tag"], image_cache.image_fingerprint(dockerfile, base_digest), image_id)
+        else:
+            print("Warning: docki.yaml changed since the bundle was made, dockipy will build the image again.")
+        if manifest["python_dep"] is not None and "python_dep" in config:
+            setup_venv(client, tar, manifest, config, project_root, target_root, image_id)
+    print(f"Imported {path} in {time.time() - start:.1f}s.")
+
+
+def setup_venv(client, tar, manifest, config, project_root, target_root, image_id):
+    python_dep = venv_lock.normalize(utils.requirement_lines(project_root, config))
+    if venv_lock.requirements_hash(python_dep) != manifest["requirements_hash"]:
+        print("Warning: python_dep changed since the bundle was made, dockipy will install the difference from the index.")
+    venv = utils.venv_dir(config)
+    lock_file = pathlib.Path(project_root) / venv / "docki.lock"
+    lock = venv_lock.load_lock(lock_file)
+    if lock.get("image_id") == image_id and lock.get("requirements_hash") == manifest["requirements_hash"]:
+        print("Requirements already installed.")
+        return
+    names = [name for name in manifest["files"] if name == REQUIREMENTS or name.startswith(f"{WHEELHOUSE}/")]
+    with tempfile.TemporaryDirectory(prefix="docki-bundle-") as wheelhouse:
+        extract_verified(tar, manifest, names, wheelhouse)
+        print(f"Installing {len(names) - 1} wheels into {venv} without network...")
+        pip = f"{target_root}/{venv}/bin/pip"
+        script = (
+            f"python3 -m venv --clear {target_root}/{venv} && "
+            f"{pip} install --no-index --find-links {CONTAINER_WHEELHOUSE}/{WHEELHOUSE} -r {CONTAINER_WHEELHOUSE}/{REQUIREMENTS}"
+        )
+        if run_in_image(client, manifest["tag"], config, project_root, target_root, script, wheelhouse, network=False) != 0:
+            raise RuntimeError("Installing the wheelhouse failed.")
+    base_digest = image_cache.base_image_digest(client, config["base_image"])
+    venv_lock.write_lock(lock_file, config, manifest["python_dep"], manifest["interpreter"], base_digest, image_id)
@@ -0,0 +1,48 @@
+import os, re, sys, time, atexit
+from dockipy import tracing
+
+# One docker client per process, shared by build, venv, run and logs so the API
+# version negotiation and the socket setup happen once.
+_client = None
+# ("METHOD /path", seconds) of every API call, seconds is the time to the response headers
+api_calls = []
+
+API_PATH = re.compile(r"^/v[\d.]+")
+API_RESOURCE = re.compile(r"^/(containers|images|exec|volumes|networks)/(.+)/(\w+)$")
+
+
+def api_endpoint(method, path_url):
+    path = API_PATH.sub("", path_url.split("?", 1)[0])
+    path = API_RESOURCE.sub(r"/\1/{id}/\3", path)
+    return f"{method} {path}"
+
+
+def record_api_call(response, *args, **kwargs):
+    endpoint = api_endpoint(response.request.method, response.request.path_url)
+    api_calls.append((endpoint, response.elapsed.total_seconds()))
+    if tracing.enabled():
+        elapsed = int(response.elapsed.total_seconds() * 1e9)
+        tracing.add(endpoint, "docker", time.perf_counter_ns() - elapsed, elapsed)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        import docker
+        _client = docker.from_env()
+        _client.api.hooks["response"].append(record_api_call)
+        if os.environ.get("DOCKI_API_STATS", "") not in ("", "0"):
+            atexit.register(api_report)
+    return _client
+
+
+def api_report(out=None):
+    out = out if out is not None else sys.stderr
+    endpoints = {}
+    for endpoint, elapsed in api_calls:
+        count, total, worst = endpoints.get(endpoint, (0, 0.0, 0.0))
+        endpoints[endpoint] = (count + 1, total + elapsed, max(worst, elapsed))
+    out.write(f"docker API: {len(api_calls)} calls, {sum(elapsed for _endpoint, elapsed in api_calls) * 1000:.1f}ms\n")
+    for endpoint, (count, total, worst) in sorted(endpoints.items(), key=lambda item: -item[1][1]):
+        out.write(f"  {count:>4} x {endpoint:<40} {total / count * 1000:>8.1f}ms avg {worst * 1000:>8.1f}ms max\n")
+    out.flush()
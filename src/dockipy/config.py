@@ -0,0 +1,328 @@
+import os, json, hashlib, pathlib
+from dockipy.state import state_path, load_json, save_json
+from dockipy.tracing import traced
+
+# Bump when the compiled form or the schema changes, old cache entries are then ignored.
+CACHE_VERSION = 8
+PROJECT_MARKERS = ["docki.yaml", "requirements.txt", "pyproject.toml", ".git"]
+
+
+class ConfigError(Exception):
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+class ListOf:
+    def __init__(self, *items):
+        self.items = items
+
+    def describe(self):
+        return f"a list of {' or '.join(describe(item) for item in self.items)}"
+
+
+class OneOf:
+    def __init__(self, *specs):
+        self.specs = specs
+
+    def describe(self):
+        return " or ".join(describe(spec) for spec in self.specs)
+
+
+class Choice:
+    def __init__(self, *values):
+        self.values = values
+
+    def describe(self):
+        return "one of " + ", ".join(repr(value) for value in self.values)
+
+
+class Mapping:
+    def __init__(self, fields, required=()):
+        self.fields = fields
+        self.required = required
+
+    def describe(self):
+        return "a mapping with " + ", ".join(self.fields)
+
+
+class MapOf:
+    def __init__(self, values):
+        self.values = values
+
+    def describe(self):
+        return "a mapping of names to " + describe(self.values)
+
+
+NUMBER = (int, float)
+HOST = Mapping({"name": str, "workspace": str, "slots": int}, required=["name"])
+SCHEMA = Mapping({
+    "extends": OneOf(str, ListOf(str)),
+    "base_image": str,
+    "tag": str,
+    "system_dep": ListOf(str, ListOf(str)),
+    "system_commands": ListOf(str),
+    "python_dep": OneOf(ListOf(str), Mapping({"file": str}, required=["file"])),
+    "init_commands": ListOf(str),
+    "shm_size": OneOf(str, int),
+    "cpuset": OneOf(str, int),
+    "memory": OneOf(str, int),
+    "throughput_pattern": str,
+    "layered": bool,
+    "layer_size": int,
+    "builder": Choice("api", "cli"),
+    "persistent": bool,
+    "idle_timeout": NUMBER,
+    "pip_cache": OneOf(bool, str, Mapping({"dir": str}, required=["dir"]), Mapping({"volume": str}, required=["volume"])),
+    "notebook_token": OneOf(str, int),
+    "notebook_password": OneOf(str, int),
+    "notebook_args": str,
+    "notebook_port": int,
+    "notebook_prewarm": OneOf(bool, str),
+    "remote": Mapping({
+        "hosts": ListOf(HOST),
+        "ssh": OneOf(str, ListOf(str)),
+        "timeout": NUMBER,
+        "retries": int,
+        "sync_concurrency": int,
+        "push_concurrency": int,
+        "load_command": str,
+        "inventory_command": str,
+    }, required=["hosts"]),
+    "venv_dir": str,
+    "venv_store": bool,
+    "prefetch": bool,
+    "matrix_jobs": int,
+    "gc_budget": OneOf(str, int),
+    "history": bool,
+    "history_runs": int,
+    "history_log_size": OneOf(str, int),
+})
+# a matrix variant overrides any other key of docki.yaml
+SCHEMA.fields["matrix"] = MapOf(Mapping({key: spec for key, spec in SCHEMA.fields.items() if key != "extends"}))
+
+TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "true or false"}
+
+
+def describe(spec):
+    if isinstance(spec, tuple):
+        return "a number"
+    if isinstance(spec, type):
+        return TYPE_NAMES.get(spec, spec.__name__)
+    return spec.describe()
+
+
+def type_name(value):
+    if value is None:
+        return "nothing"
+    return {dict: "a mapping", list: "a list"}.get(type(value), describe(type(value)))
+
+
+def is_instance(value, types):
+    # yaml true is an int for isinstance, but never a valid count
+    if isinstance(value, bool):
+        return bool in (types if isinstance(types, tuple) else (types,))
+    return isinstance(value, types)
+
+
+def check(value, spec, path, problems, warnings):
+    """
+    Append (path, message) to problems for every place value does not match spec.
+    """
+    if isinstance(spec, (type, tuple)):
+        if not is_instance(value, spec):
+            problems.append((path, f"expected {describe(spec)}, got {type_name(value)}"))
+    elif isinstance(spec, Choice):
+        if value not in spec.values:
+            problems.append((path, f"expected {spec.describe()}, got {value!r}"))
+    elif isinstance(spec, ListOf):
+        if not isinstance(value, list):
+            problems.append((path, f"expected {spec.describe()}, got {type_name(value)}"))
+            return
+        for i, item in enumerate(value):
+            check(item, OneOf(*spec.items) if len(spec.items) > 1 else spec.items[0], path + (i,), problems, warnings)
+    elif isinstance(spec, OneOf):
+        for option in spec.specs:
+            option_problems = []
+            check(value, option, path, option_problems, [])
+            if len(option_problems) == 0:
+                check(value, option, path, [], warnings)
+                return
+        problems.append((path, f"expected {spec.describe()}, got {type_name(value)}"))
+    elif isinstance(spec, MapOf):
+        if not isinstance(value, dict):
+            problems.append((path, f"expected {spec.describe()}, got {type_name(value)}"))
+            return
+        for key, item in value.items():
+            check(item, spec.values, path + (key,), problems, warnings)
+    elif isinstance(spec, Mapping):
+        if not isinstance(value, dict):
+            problems.append((path, f"expected {spec.describe()}, got {type_name(value)}"))
+            return
+        for key in spec.required:
+            if key not in value:
+                problems.append((path, f"missing {key}"))
+        for key, item in value.items():
+            if key not in spec.fields:
+                warnings.append((path + (key,), "unknown key, it is ignored"))
+            else:
+                check(item, spec.fields[key], path + (key,), problems, warnings)
+
+
+def path_name(path):
+    name = ""
+    for part in path:
+        name += f"[{part}]" if isinstance(part, int) else (f".{part}" if name != "" else str(part))
+    return name or "docki.yaml"
+
+
+def locate(path, marks):
+    # the closest parent that has a position, keys that are missing have none
+    for end in range(len(path), -1, -1):
+        if path[:end] in marks:
+            file, line, column = marks[path[:end]]
+            return f"{file}:{line}:{column}"
+    return "docki.yaml"
+
+
+def node_marks(node, file, path=(), marks=None):
+    marks = {} if marks is None else marks
+    marks[path] = (file, node.start_mark.line + 1, node.start_mark.column + 1)
+    if node.id == "mapping":
+        for key_node, value_node in node.value:
+            node_marks(value_node, file, path + (key_node.value,), marks)
+    elif node.id == "sequence":
+        for i, item in enumerate(node.value):
+            node_marks(item, file, path + (i,), marks)
+    return marks
+
+
+def parse_file(file):
+    """
+    Parse one yaml file, return its content and the position of every value.
+    """
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)(pathlib.Path(file).read_text())
+    try:
+        node = loader.get_single_node()
+        content = loader.construct_document(node) if node is not None else None
+    except yaml.YAMLError as e:
+        raise ConfigError([f"{file}: {e}"])
+    finally:
+        loader.dispose()
+    if content is None:
+        return {}, {}
+    if not isinstance(content, dict):
+        raise ConfigError([f"{file}:1:1: expected a mapping, got {type_name(content)}"])
+    return content, node_marks(node, str(file))
+
+
+def merge(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_tree(file, files, stack=()):
+    """
+    Load file with everything it extends. Later files win, mappings are merged
+    key by key and lists are replaced.
+    """
+    file = pathlib.Path(os.path.abspath(os.path.expanduser(str(file))))
+    if file in stack:
+        raise ConfigError([f"{file}: extends itself through {' -> '.join(str(parent) for parent in stack + (file,))}"])
+    if not file.exists():
+        parent = f"{stack[-1]}: " if len(stack) > 0 else ""
+        raise ConfigError([f"{parent}extends {file}, which does not exist"])
+    files.append(file)
+    content, marks = parse_file(file)
+    extends = content.pop("extends", [])
+    problems = []
+    check(extends, SCHEMA.fields["extends"], ("extends",), problems, [])
+    if len(problems) > 0:
+        raise ConfigError([f"{locate(path, marks)}: {path_name(path)}: {message}" for path, message in problems])
+    config, config_marks = {}, {}
+    for base in [extends] if isinstance(extends, str) else extends:
+        base_config, base_marks = load_tree(file.parent / os.path.expanduser(base), files, stack + (file,))
+        config = merge(config, base_config)
+        config_marks.update(base_marks)
+    config_marks.update(marks)
+    return merge(config, content), config_marks
+
+
+def file_signature(file):
+    stat = os.stat(file)
+    return [str(file), stat.st_mtime_ns, stat.st_size]
+
+
+def cache_file(file):
+    return state_path("config", hashlib.sha256(str(file).encode("utf-8")).hexdigest()[:16] + ".json")
+
+
+def cached_config(file):
+    cache = load_json(cache_file(file))
+    if cache is None or cache.get("version") != CACHE_VERSION:
+        return None
+    try:
+        if any(file_signature(signature[0]) != signature for signature in cache["files"]):
+            return None
+    except OSError:
+        return None
+    return cache
+
+
+@traced("config")
+def load_config(file, use_cache=True):
+    """
+    Load and validate a docki.yaml with the files it extends.
+
+    Returns (config, warnings). Valid configs are cached by the path, mtime and
+    size of every file involved, so an unchanged config is read without yaml.
+    Raises ConfigError with file:line:column for every invalid value.
+    """
+    file = os.path.abspath(str(file))
+    if use_cache:
+        cache = cached_config(file)
+        if cache is not None:
+            return cache["config"], cache["warnings"]
+    files = []
+    config, marks = load_tree(file, files)
+    problems, warnings = [], []
+    check(config, SCHEMA, (), problems, warnings)
+    if len(problems) > 0:
+        raise ConfigError([f"{locate(path, marks)}: {path_name(path)}: {message}" for path, message in problems])
+    warnings = [f"{locate(path, marks)}: {path_name(path)}: {message}" for path, message in warnings]
+    if use_cache and json.loads(json.dumps(config, default=str)) == config:
+        save_json(cache_file(file), {
+            "version": CACHE_VERSION,
+            "files": [file_signature(included) for included in files],
+            "config": config,
+            "warnings": warnings,
+        })
+    return config, warnings
+
+
+@traced("project root")
+def find_project_root():
+    """
+    Walk up from the working directory to the first directory with a project marker.
+
+    Returns (work_dir, project_root, target_root), work_dir and target_root are
+    the paths inside the container.
+    """
+    current_dir = os.path.realpath(os.getcwd())
+    path = []
+    while True:
+        parent = os.path.dirname(current_dir)
+        if parent == current_dir:
+            return None, None, None
+        name = os.path.basename(current_dir)
+        path.insert(0, name)
+        for marker in PROJECT_MARKERS:
+            if os.path.exists(f"{current_dir}/{marker}"):
+                return "/" + "/".join(path), current_dir, f"/{name}"
+        current_dir = parent
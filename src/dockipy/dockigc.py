@@ -0,0 +1,219 @@
+import argparse, calendar, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from dockipy import image_cache, venv_store, prefetch
+from dockipy.state import load_json
+from dockipy.sizes import parse_size, format_size
+from dockipy.client import get_client
+
+KINDS = ("image", "venv", "wheel", "build cache")
+
+
+class Item:
+    """
+    Something docki can remove to free disk space. size is what removing it
+    frees, not counting layers or files shared with items that are kept.
+    """
+    def __init__(self, kind, name, size, last_used, in_use=False, key=None):
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.last_used = last_used
+        self.in_use = in_use
+        self.key = key
+
+
+def parse_time(text):
+    """
+    Seconds since the epoch for the RFC 3339 times of the docker API.
+    """
+    if not text:
+        return 0.0
+    date, _, rest = str(text).partition("T")
+    clock = rest[:8]
+    try:
+        return float(calendar.timegm(time.strptime(f"{date}T{clock}", "%Y-%m-%dT%H:%M:%S")))
+    except ValueError:
+        return 0.0
+
+
+def image_items(df, index):
+    """
+    The images docki built, known by their fingerprint label. An image is last
+    used when docki last ran or built it, images that lost their tag to a newer
+    build count from when they were created.
+    """
+    images = index.get("images", {})
+    items = []
+    for image in df.get("Images") or []:
+        if image_cache.FINGERPRINT_LABEL not in (image.get("Labels") or {}):
+            continue
+        tags = [tag for tag in image.get("RepoTags") or [] if tag != "<none>:<none>"]
+        last_used = max([images.get(tag, {}).get("last_used", 0) for tag in tags] + [image.get("Created", 0)])
+        shared = max(image.get("SharedSize", 0), 0)
+        items.append(Item("image", ", ".join(tags) or image["Id"][7:19], image.get("Size", 0) - shared, last_used,
+                          in_use=image.get("Containers", 0) > 0, key=image["Id"]))
+    return items
+
+
+def build_cache_items(df):
+    items = []
+    for record in df.get("BuildCache") or []:
+        description = record.get("Description") or record.get("Type", "")
+        items.append(Item("build cache", f"{record['ID'][:12]} {description[:40]}", record.get("Size", 0),
+                          parse_time(record.get("LastUsedAt") or record.get("CreatedAt")),
+                          in_use=record.get("InUse", False), key=record["ID"]))
+    return items
+
+
+def venv_items():
+    """
+    The entries of the venv store. Entries a project venv still links to are in
+    use, removing them would free nothing.
+    """
+    items = []
+    for env in venv_store.entries():
+        meta = venv_store.load_meta(env)
+        seen, size = set(), 0
+        for file in venv_store.walk_files(env):
+            stat = os.lstat(file)
+            # linked from the entry and its object only
+            if stat.st_ino not in seen and stat.st_nlink <= 2:
+                seen.add(stat.st_ino)
+                size += stat.st_size
+        last_used = meta.get("last_used", meta.get("created", 0))
+        items.append(Item("venv", f"{env.name[:12]} ({len(meta.get('requirements', []))} packages)", size, last_used,
+                          in_use=len(venv_store.references(env)) > 0, key=env))
+    return items
+
+
+def wheel_items():
+    """
+    The wheels prefetch downloaded, pip reads them when it installs from them.
+    """
+    items = []
+    for wheel in prefetch.wheelhouse_dir().iterdir():
+        stat = wheel.stat()
+        items.append(Item("wheel", wheel.name, stat.st_size, max(stat.st_atime, stat.st_mtime), key=wheel))
+    return items
+
+
+def plan_eviction(items, budget):
+    """
+    The least recently used items that have to go to bring the total size under
+    budget. Items in use are never picked. Returns (victims, usage after).
+    """
+    usage = sum(item.size for item in items)
+    victims = []
+    for item in sorted(items, key=lambda item: item.last_used):
+        if usage <= budget:
+            break
+        if item.in_use or item.size <= 0:
+            continue
+        victims.append(item)
+        usage -= item.size
+    return victims, usage
+
+
+def remove_image(client, item):
+    import docker
+    try:
+        client.images.remove(item.key, noprune=False)
+        return item.size
+    except docker.errors.APIError as e:
+        print(f"Could not remove {item.name}: {e.explanation if hasattr(e, 'explanation') else e}")
+        return 0
+
+
+def remove_venvs(victims):
+    _entries, _objects, freed = venv_store.collect(only=[item.key for item in victims])
+    return freed
+
+
+def remove_wheels(victims):
+    for item in victims:
+        item.key.unlink()
+    return sum(item.size for item in victims)
+
+
+def prune_build_cache(client, keep_storage):
+    return client.api.prune_builds(keep_storage=keep_storage, all=True).get("SpaceReclaimed", 0)
+
+
+def evict(client, items, victims, jobs=4):
+    """
+    Remove the victims. Images, venvs, wheels and the build cache do not depend
+    on each other, so they are removed at the same time. Returns the bytes freed per kind.
+    """
+    kinds = {kind: [item for item in victims if item.kind == kind] for kind in KINDS}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1) + 2) as pool:
+        futures = {"image": [pool.submit(remove_image, client, item) for item in kinds["image"]]}
+        if len(kinds["venv"]) > 0:
+            futures["venv"] = [pool.submit(remove_venvs, kinds["venv"])]
+        if len(kinds["wheel"]) > 0:
+            futures["wheel"] = [pool.submit(remove_wheels, kinds["wheel"])]
+        if len(kinds["build cache"]) > 0:
+            # BuildKit prunes its least recently used records down to keep_storage,
+            # the same records plan_eviction picked
+            selected = set(item.key for item in kinds["build cache"])
+            keep = sum(item.size for item in items if item.kind == "build cache" and item.key not in selected)
+            futures["build cache"] = [pool.submit(prune_build_cache, client, keep)]
+        return {kind: sum(future.result() for future in kind_futures) for kind, kind_futures in futures.items()}
+
+
+def print_plan(items, victims, budget, out=None):
+    out = out if out is not None else sys.stdout
+    chosen = set(id(item) for item in victims)
+    now = time.time()
+    out.write(f"{'kind':<12} {'item':<48} {'last used':>10} {'size':>9}  action\n")
+    for item in sorted(items, key=lambda item: item.last_used):
+        age = f"{(now - item.last_used) / 86400:.1f}d ago" if item.last_used > 0 else "never"
+        action = "remove" if id(item) in chosen else ("in use" if item.in_use else "keep")
+        out.write(f"{item.kind:<12} {item.name[:48]:<48} {age:>10} {format_size(item.size):>9}  {action}\n")
+    usage = sum(item.size for item in items)
+    reclaim = sum(item.size for item in victims)
+    for kind in KINDS:
+        kind_items = [item for item in items if item.kind == kind]
+        kind_victims = [item for item in victims if item.kind == kind]
+        out.write(f"{kind}: {len(kind_items)} using {format_size(sum(item.size for item in kind_items))}, "
+                  f"{len(kind_victims)} to remove freeing {format_size(sum(item.size for item in kind_victims))}\n")
+    out.write(f"docki uses {format_size(usage)} of the {format_size(budget)} budget, removing {format_size(reclaim)} leaves {format_size(usage - reclaim)}.\n")
+    out.flush()
+
+
+def dockigc():
+    argparser = argparse.ArgumentParser(
+        prog="dockigc",
+        description="Remove the least recently used docki images, stored venvs and prefetched wheels until they fit in a disk budget",
+        )
+    argparser.add_argument("--budget", help="Disk space docki may use, e.g. 200G (default gc_budget in docki.yaml)")
+    argparser.add_argument("--dry-run", action="store_true", help="Only show what would be removed and how much it frees")
+    argparser.add_argument("--jobs", "-j", type=int, default=4, help="Images removed at the same time")
+    argparser.add_argument("--build-cache", action="store_true",
+                           help="Also count and prune the build cache, all of it on the daemon, also what other tools built")
+    args = argparser.parse_args()
+    budget = args.budget
+    if budget is None:
+        import dockipy.utils as utils
+        _work_dir, project_root, _target_root = utils.find_project_root()
+        if project_root is not None and os.path.exists(os.path.join(project_root, "docki.yaml")):
+            budget = utils.get_docki_config(project_root).get("gc_budget")
+    if budget is None:
+        print("No budget given, use --budget SIZE or set gc_budget in docki.yaml.")
+        sys.exit(1)
+    budget = parse_size(budget)
+    client = get_client()
+    df = client.df()
+    items = image_items(df, load_json(image_cache.index_file(), {})) + venv_items() + wheel_items()
+    # BuildKit does not record which build a cache record is from, docki can not tell its own apart
+    if args.build_cache:
+        items += build_cache_items(df)
+    victims, _usage = plan_eviction(items, budget)
+    print_plan(items, victims, budget)
+    if args.build_cache:
+        print("The build cache counted is that of the whole docker daemon, also what other tools built.")
+    else:
+        print("The build cache is not counted, --build-cache adds all of it on the docker daemon.")
+    if args.dry_run or len(victims) == 0:
+        return
+    freed = evict(client, items, victims, args.jobs)
+    print("Freed " + ", ".join(f"{format_size(size)} of {kind}" for kind, size in freed.items()) + ".")
@@ -1,27 +1,43 @@
 import dockipy.utils as utils
+import dockipy.tracing as tracing
+import dockipy.warm as warm
+import dockipy.prefetch as prefetch
+import sys, time
 import pathlib, platform, subprocess
 
 def dockishell():
-    work_dir, project_root, target_root = utils.find_project_root()
+    command, remote, clean, output, replica_count = utils.argsparse()
 
-    command, remote, clean, output = utils.argsparse()
+    work_dir, project_root, target_root = utils.find_project_root()
 
     docki_config = utils.get_docki_config(project_root, remote)
 
-    tag = utils.build_docker_image(target_root, docki_config, clean, output)
-
+    container = None
+    exit_code = 0
     try:
-        if "python_dep" in docki_config:
-            utils.setup_venv(project_root, target_root, tag, docki_config, clean, output)
-        container = utils.run_container(tag, command, docki_config, work_dir, project_root, target_root, output)
-        if output:
-            return
-        utils.print_logs(container)
+        tag = prefetch.build_and_setup_venv(project_root, target_root, docki_config, clean, output)
+        if replica_count > 1 and not output:
+            import dockipy.replicas as replicas
+            start = time.time()
+            all_replicas = replicas.run_replicas(tag, command, docki_config, work_dir, project_root, target_root, replica_count)
+            replicas.print_report(all_replicas, time.time() - start)
+            exit_code = replicas.exit_code(all_replicas)
+        elif warm.is_persistent(docki_config, output):
+            exit_code = warm.exec_command(tag, command, docki_config, work_dir, project_root, target_root)
+        else:
+            container = utils.run_container(tag, command, docki_config, work_dir, project_root, target_root, output)
+            if output:
+                return
+            exit_code = utils.print_logs(container, first_output=True)
     except KeyboardInterrupt:
         print("Shutting down the container")
+        exit_code = 130
     except Exception as e:
         print(e)
+        exit_code = 1
     finally:
-        if not output:
-            container.stop()
-            container.remove(force=True)
\ No newline at end of file
+        if container is not None:
+            with tracing.span("teardown"):
+                container.stop()
+                container.remove(force=True)
+    sys.exit(exit_code)
\ No newline at end of file
@@ -0,0 +1,441 @@
+import argparse, codecs, contextlib, hashlib, json, os, pathlib, re, shlex, shutil, sys, threading, time
+from collections import deque
+from dockipy import state
+from dockipy.sizes import parse_size, format_size
+
+# A run keeps at most this many log segments: the first one, with the start of
+# the run, and the newest ones.
+SEGMENTS = 8
+# The last lines of a run are kept in the index, dockilog tail reads them from there.
+TAIL_LINES = 100
+# Longer lines, like a progress bar that never prints a newline, are cut in the tail.
+LINE_LIMIT = 4096
+# Compressed output reaches the file at least this often, so a running run can be read.
+FLUSH_INTERVAL = 1.0
+READ_SIZE = 256 * 1024
+# Fast enough to keep up with a chatty run, training logs still shrink about 10x.
+COMPRESS_LEVEL = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    tag TEXT,
+    command TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL,
+    exit_code INTEGER,
+    peak_cpu REAL,
+    peak_memory INTEGER,
+    log_bytes INTEGER NOT NULL DEFAULT 0,
+    log_stored INTEGER NOT NULL DEFAULT 0,
+    log_lines INTEGER NOT NULL DEFAULT 0,
+    tail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_project ON runs (project, id);
+"""
+
+
+def index_file():
+    return state.state_path("history.sqlite")
+
+
+def run_dir(run_id):
+    return state.DOCKI_HOME / "runs" / str(run_id)
+
+
+@contextlib.contextmanager
+def connect():
+    """
+    The index of the runs, the changes are committed when the block ends.
+    """
+    import sqlite3
+    connection = sqlite3.connect(str(index_file()), timeout=30)
+    try:
+        connection.row_factory = sqlite3.Row
+        # readers do not wait for the runs that are writing
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def enabled(config, output=False):
+    return config.get("history", True) and not output
+
+
+def config_fingerprint(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def segment_name(number):
+    return f"{number:05d}.log.gz"
+
+
+def segments(directory):
+    return sorted(pathlib.Path(directory).glob("*.log.gz"))
+
+
+def visible(line):
+    """
+    What a terminal shows of a line, a carriage return starts it over.
+    """
+    line = line.rstrip("\r")
+    return line[line.rfind("\r") + 1:]
+
+
+class LogWriter:
+    """
+    Passes the output of a run on to out and streams it, gzip compressed, into
+    segments of about segment_size bytes of output. Only the first and the
+    newest segments are kept, and only the last lines are held in memory.
+    """
+    def __init__(self, directory, out, segment_size, keep=SEGMENTS, tail_lines=TAIL_LINES):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.out = out
+        self.segment_size = segment_size
+        self.keep = keep
+        self.tail = deque(maxlen=tail_lines)
+        self.line = ""
+        self.lines = 0
+        self.size = 0
+        self.segment = -1
+        self.segment_bytes = 0
+        self.file = None
+        self.last_flush = time.time()
+        self.open_segment()
+
+    def open_segment(self):
+        import gzip
+        if self.file is not None:
+            self.file.close()
+        self.segment += 1
+        self.segment_bytes = 0
+        self.file = gzip.open(self.directory / segment_name(self.segment), "wb", compresslevel=COMPRESS_LEVEL)
+        dropped = self.segment - self.keep + 1
+        if dropped >= 1:
+            try:
+                os.remove(self.directory / segment_name(dropped))
+            except FileNotFoundError:
+                pass
+
+    def write(self, text):
+        self.out.write(text)
+        self.keep_tail(text)
+        if self.file is None:
+            return
+        try:
+            self.store(text)
+        except OSError as e:
+            # a full disk stops the log, not the run
+            print(f"\nThe log of the run is not written anymore: {e}", file=sys.stderr)
+            self.file = None
+
+    def store(self, text):
+        data = text.encode("utf-8", errors="replace")
+        self.size += len(data)
+        if self.segment_bytes + len(data) > self.segment_size:
+            # segments end at a line, so every one of them reads on its own
+            end = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+            if end > 0:
+                self.file.write(data[:end])
+                self.open_segment()
+                data = data[end:]
+        self.file.write(data)
+        self.segment_bytes += len(data)
+        if time.time() - self.last_flush > FLUSH_INTERVAL:
+            self.file.flush()
+            self.last_flush = time.time()
+
+    def keep_tail(self, text):
+        self.lines += text.count("\n")
+        # only the lines that fit in the tail are split off
+        lines = (self.line + text).rsplit("\n", self.tail.maxlen + 1)
+        self.line = visible(lines.pop())[-LINE_LIMIT:]
+        for line in lines[-self.tail.maxlen:]:
+            self.tail.append(visible(line)[:LINE_LIMIT])
+
+    def flush(self):
+        self.out.flush()
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.line != "":
+            self.tail.append(self.line)
+            self.lines += 1
+            self.line = ""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stored(self):
+        return sum(path.stat().st_size for path in segments(self.directory))
+
+
+class PeakStats:
+    """
+    Follows docker stats of a container in a thread and keeps the peak cpu use,
+    in percent of one cpu, and the peak memory use without the page cache.
+    """
+    def __init__(self, container):
+        self.container = container
+        self.cpu = None
+        self.memory = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            for sample in self.container.stats(stream=True, decode=True):
+                self.add(sample)
+        except Exception:
+            # the peaks stay empty when the daemon has no stats for the container
+            return
+
+    def add(self, sample):
+        memory = sample.get("memory_stats") or {}
+        if "usage" in memory:
+            stats = memory.get("stats") or {}
+            usage = memory["usage"] - stats.get("inactive_file", stats.get("total_inactive_file", 0))
+            self.memory = max(self.memory or 0, usage)
+        cpu = sample.get("cpu_stats") or {}
+        previous = sample.get("precpu_stats") or {}
+        if "system_cpu_usage" not in previous:
+            return
+        cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - previous.get("cpu_usage", {}).get("total_usage", 0)
+        system_delta = cpu.get("system_cpu_usage", 0) - previous["system_cpu_usage"]
+        cpus = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or []) or 1
+        if cpu_delta >= 0 and system_delta > 0:
+            self.cpu = max(self.cpu or 0.0, cpu_delta / system_delta * cpus * 100)
+
+    def stop(self, timeout=1.0):
+        # the stats stream ends with the container
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+class Run:
+    """
+    A run being recorded. Its row is in the index from the start, so dockilog
+    shows it while it runs, and out is the output to print it to.
+    """
+    def __init__(self, run_id, out, stats=None):
+        self.id = run_id
+        self.out = out
+        self.stats = stats
+
+    def finish(self, exit_code):
+        import sqlite3
+        self.out.close()
+        if self.stats is not None:
+            self.stats.stop()
+        try:
+            with connect() as connection:
+                connection.execute(
+                    "UPDATE runs SET ended = ?, exit_code = ?, peak_cpu = ?, peak_memory = ?, "
+                    "log_bytes = ?, log_stored = ?, log_lines = ?, tail = ? WHERE id = ?",
+                    (time.time(), exit_code,
+                     self.stats.cpu if self.stats is not None else None,
+                     self.stats.memory if self.stats is not None else None,
+                     self.out.size, self.out.stored(), self.out.lines, "\n".join(self.out.tail), self.id))
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not record the run in the history: {e}")
+
+
+def start(project_root, config, command, container=None, out=None):
+    """
+    Start recording a run of command, returns None when the history is off or
+    cannot be written. The runs beyond history_runs are removed, oldest first.
+    """
+    import sqlite3
+    try:
+        with connect() as connection:
+            run_id = connection.execute(
+                "INSERT INTO runs (project, tag, command, fingerprint, started) VALUES (?, ?, ?, ?, ?)",
+                (str(project_root), config.get("tag"), shlex.join(command), config_fingerprint(config), time.time())).lastrowid
+            prune(connection, config.get("history_runs", 200))
+        log_size = parse_size(config.get("history_log_size", "1G"))
+        writer = LogWriter(run_dir(run_id), out if out is not None else sys.stdout, max(log_size // SEGMENTS, 1))
+    except (sqlite3.Error, OSError) as e:
+        print(f"The run is not recorded in the history: {e}")
+        return None
+    stats = PeakStats(container).start() if container is not None else None
+    return Run(run_id, writer, stats)
+
+
+def prune(connection, keep):
+    old = [row["id"] for row in connection.execute("SELECT id FROM runs ORDER BY id DESC LIMIT -1 OFFSET ?", (keep,))]
+    for run_id in old:
+        shutil.rmtree(run_dir(run_id), ignore_errors=True)
+    connection.executemany("DELETE FROM runs WHERE id = ?", [(run_id,) for run_id in old])
+
+
+def read_lines(path):
+    """
+    The lines of a log segment, decompressed a block at a time. A segment that
+    is still written, or of a run that was killed, is read as far as it goes.
+    """
+    import zlib
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    rest = ""
+    with open(path, "rb") as file:
+        data = b""
+        while not decompressor.eof:
+            if len(data) == 0:
+                data = file.read(READ_SIZE)
+                if len(data) == 0:
+                    break
+            try:
+                text = decoder.decode(decompressor.decompress(data, READ_SIZE))
+            except zlib.error:
+                break
+            data = decompressor.unconsumed_tail
+            lines = (rest + text).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                yield visible(line)
+    rest += decoder.decode(b"", final=True)
+    if rest != "":
+        yield visible(rest)
+
+
+def log_lines(run_id):
+    """
+    The lines of a run, a marker shows where rotated segments were removed.
+    """
+    expected = 0
+    for path in segments(run_dir(run_id)):
+        number = int(path.name.split(".")[0])
+        if number != expected:
+            yield f"[dockilog: {number - expected} rotated log segments removed]"
+        expected = number + 1
+        yield from read_lines(path)
+
+
+def tail_lines(run, count):
+    """
+    The last count lines of a run. They come from the index when it has them,
+    else only the newest segments are read.
+    """
+    if run["ended"] is not None and run["tail"] is not None and (count <= TAIL_LINES or run["log_lines"] <= TAIL_LINES):
+        lines = run["tail"].split("\n") if run["tail"] != "" else []
+        return lines[max(len(lines) - count, 0):]
+    lines = deque(maxlen=count)
+    for path in reversed(segments(run_dir(run["id"]))):
+        newer = list(lines)
+        lines = deque(read_lines(path), maxlen=count)
+        lines.extend(newer)
+        if len(lines) >= count:
+            break
+    return list(lines)
+
+
+def grep(runs, pattern, out):
+    """
+    Print the lines of runs that match pattern as run:line:text, returns how many matched.
+    """
+    matches = 0
+    for run in runs:
+        for number, line in enumerate(log_lines(run["id"]), start=1):
+            if pattern.search(line):
+                out.write(f"{run['id']}:{number}:{line}\n")
+                matches += 1
+    return matches
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+
+def print_runs(runs, out, show_tag=False):
+    tag = f" {'tag':<16}" if show_tag else ""
+    out.write(f"{'run':>5}  {'started':<19} {'took':>8} {'exit':>5} {'cpu':>6} {'memory':>7} {'log':>7}{tag}  command\n")
+    for run in runs:
+        took = format_duration(run["ended"] - run["started"]) if run["ended"] is not None else "running"
+        exit_code = run["exit_code"] if run["exit_code"] is not None else "-"
+        cpu = f"{run['peak_cpu']:.0f}%" if run["peak_cpu"] is not None else "-"
+        memory = format_size(run["peak_memory"]) if run["peak_memory"] is not None else "-"
+        log = format_size(run["log_stored"]) if run["ended"] is not None else "-"
+        tag = f" {run['tag'] or '-':<16}" if show_tag else ""
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"]))
+        out.write(f"{run['id']:>5}  {started:<19} {took:>8} {exit_code:>5} {cpu:>6} {memory:>7} {log:>7}{tag}  {run['command']}\n")
+
+
+def find_runs(connection, project=None, run_ids=None, limit=None):
+    query, params = "SELECT * FROM runs", []
+    conditions = []
+    if project is not None:
+        conditions.append("project = ?")
+        params.append(str(project))
+    if run_ids:
+        conditions.append(f"id IN ({', '.join('?' for _ in run_ids)})")
+        params += run_ids
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return connection.execute(query, params).fetchall()
+
+
+def dockilog():
+    argparser = argparse.ArgumentParser(
+        prog="dockilog",
+        description="List, tail or grep the past runs of dockipy, of the current project unless --all is given",
+        )
+    scope = argparse.ArgumentParser(add_help=False)
+    # also after the command, without resetting one given before it
+    scope.add_argument("--all", action="store_true", default=argparse.SUPPRESS, help="Runs of every project")
+    argparser.add_argument("--all", action="store_true", help="Runs of every project")
+    commands = argparser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", parents=[scope], help="The last runs with their exit code, duration and peak cpu and memory")
+    list_parser.add_argument("-n", type=int, default=20, help="Number of runs")
+    tail_parser = commands.add_parser("tail", parents=[scope], help="The last lines of a run")
+    tail_parser.add_argument("run", type=int, nargs="?", help="Run id (default the last run)")
+    tail_parser.add_argument("-n", type=int, default=20, help="Number of lines")
+    grep_parser = commands.add_parser("grep", parents=[scope], help="The lines of past runs that match a regular expression")
+    grep_parser.add_argument("pattern")
+    grep_parser.add_argument("runs", type=int, nargs="*", help="Run ids (default every run)")
+    grep_parser.add_argument("-i", "--ignore-case", action="store_true")
+    args = argparser.parse_args()
+    project = None
+    # runs asked for by id are found in any project
+    if not args.all and not getattr(args, "run", None) and not getattr(args, "runs", None):
+        import dockipy.utils as utils
+        _work_dir, project, _target_root = utils.find_project_root()
+    with connect() as connection:
+        if args.command in (None, "list"):
+            runs = find_runs(connection, project, limit=args.n if args.command == "list" else 20)
+            print_runs(reversed(runs), sys.stdout, show_tag=project is None)
+        elif args.command == "tail":
+            runs = find_runs(connection, project, run_ids=[args.run] if args.run is not None else None, limit=1)
+            if len(runs) == 0:
+                print("No such run." if args.run is not None else "No runs recorded yet.")
+                sys.exit(1)
+            for line in tail_lines(runs[0], args.n):
+                print(line)
+        else:
+            pattern = re.compile(args.pattern, re.IGNORECASE if args.ignore_case else 0)
+            runs = find_runs(connection, project, run_ids=args.runs)
+            try:
+                matched = grep(reversed(runs), pattern, sys.stdout)
+            except BrokenPipeError:
+                return
+            sys.exit(0 if matched > 0 else 1)
@@ -0,0 +1,110 @@
+import hashlib, threading, time
+from dockipy.state import state_path, load_json, save_json
+
+FINGERPRINT_LABEL = "docki.fingerprint"
+# Bump when the fingerprint inputs change so old images are rebuilt once.
+FINGERPRINT_VERSION = "1"
+# matrix builds record from several threads at once
+_index_lock = threading.Lock()
+
+
+def index_file():
+    return state_path("image_index.json")
+
+
+def base_image_digest(client, base_image):
+    """
+    Resolve the base image to its local image id. Images that are not in the
+    local store (BuildKit keeps pulled bases in its own cache) fall back to the
+    reference itself, pin the base with @sha256:... to make it exact.
+    """
+    import docker
+    try:
+        return client.images.get(base_image).id
+    except docker.errors.ImageNotFound:
+        return base_image
+    except docker.errors.APIError:
+        return base_image
+
+
+def image_fingerprint(dockerfile, base_digest):
+    sha = hashlib.sha256()
+    for part in (FINGERPRINT_VERSION, base_digest, dockerfile):
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def find_cached_image(client, tag, fingerprint):
+    """
+    Return the image for tag if it was built from the same fingerprint, else None.
+    """
+    import docker
+    index = load_json(index_file(), {})
+    entry = index.get("images", {}).get(tag)
+    if entry is None or entry.get("fingerprint") != fingerprint:
+        return None
+    try:
+        image = client.images.get(tag)
+    except docker.errors.ImageNotFound:
+        return None
+    except docker.errors.APIError:
+        return None
+    # an imported image was built elsewhere, the index vouches for it by id
+    if (image.labels or {}).get(FINGERPRINT_LABEL) != fingerprint and entry.get("image_id") != image.id:
+        return None
+    return image
+
+
+def record_import(tag, fingerprint, image_id):
+    """
+    Let the image loaded from a bundle stand in for a build of fingerprint.
+    """
+    with _index_lock:
+        index = load_json(index_file(), {})
+        index.setdefault("images", {})[tag] = {"fingerprint": fingerprint, "image_id": image_id,
+                                               "built": time.time(), "last_used": time.time()}
+        save_json(index_file(), index)
+
+
+def record_build(tag, fingerprint, hit, build_time=0.0):
+    with _index_lock:
+        _record_build(tag, fingerprint, hit, build_time)
+
+
+def _record_build(tag, fingerprint, hit, build_time):
+    index = load_json(index_file(), {})
+    images = index.setdefault("images", {})
+    stats = index.setdefault("stats", {})
+    tag_stats = stats.setdefault(tag, {"hits": 0, "misses": 0, "build_time": 0.0})
+    entry = images.get(tag, {})
+    if hit:
+        tag_stats["hits"] += 1
+    else:
+        tag_stats["misses"] += 1
+        tag_stats["build_time"] += build_time
+        entry["fingerprint"] = fingerprint
+        entry["built"] = time.time()
+        entry.pop("image_id", None)
+    entry["last_used"] = time.time()
+    images[tag] = entry
+    save_json(index_file(), index)
+
+
+def cache_report():
+    index = load_json(index_file(), {})
+    stats = index.get("stats", {})
+    if len(stats) == 0:
+        print("No docki builds recorded yet.")
+        return
+    total_hits = total_misses = total_time = 0
+    print(f"{'image':<40} {'hits':>6} {'misses':>7} {'hit rate':>9} {'build time':>11}")
+    for tag, tag_stats in sorted(stats.items()):
+        hits, misses, build_time = tag_stats["hits"], tag_stats["misses"], tag_stats["build_time"]
+        total_hits += hits
+        total_misses += misses
+        total_time += build_time
+        rate = hits / max(hits + misses, 1)
+        print(f"{tag:<40} {hits:>6} {misses:>7} {rate:>9.0%} {build_time:>10.1f}s")
+    rate = total_hits / max(total_hits + total_misses, 1)
+    print(f"{'total':<40} {total_hits:>6} {total_misses:>7} {rate:>9.0%} {total_time:>10.1f}s")
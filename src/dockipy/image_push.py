@@ -0,0 +1,316 @@
+import asyncio, hashlib, re, sys, tarfile, tempfile, time
+from dockipy import remote
+from dockipy.sizes import format_size
+
+# Lists the layers of every image on the host, one image per line.
+INVENTORY_COMMAND = (
+    "docker image ls -q --no-trunc | sort -u | "
+    "xargs -r docker image inspect --format '{{range .RootFS.Layers}}{{.}} {{end}}'"
+)
+LOAD_COMMAND = "docker load"
+CHUNK_SIZE = 1024 * 1024
+# Layers of the OCI layout are named after their digest, which docker save
+# writes uncompressed, so the file name is the diff id.
+OCI_BLOB = re.compile(r"^blobs/sha256/([0-9a-f]{64})$")
+
+
+def chain_ids(diff_ids):
+    """
+    The chain id of a layer identifies it together with all layers below it,
+    docker load skips a layer when its chain id already exists.
+    """
+    chain = []
+    for diff_id in diff_ids:
+        if len(chain) == 0:
+            chain.append(diff_id)
+        else:
+            chain.append("sha256:" + hashlib.sha256(f"{chain[-1]} {diff_id}".encode("utf-8")).hexdigest())
+    return chain
+
+
+def present_chain_ids(inventory_lines):
+    present = set()
+    for line in inventory_lines:
+        present.update(chain_ids(line.split()))
+    return present
+
+
+def skippable_layers(diff_ids, present):
+    """
+    Diff ids that can be left out of the stream because every place the layer is
+    used in the image is already on the host.
+    """
+    needed = set()
+    for diff_id, chain_id in zip(diff_ids, chain_ids(diff_ids)):
+        if chain_id not in present:
+            needed.add(diff_id)
+    return set(diff_ids) - needed
+
+
+class PushResult:
+    def __init__(self, host, layers_sent=0, layers_skipped=0, sent=0, saved=0, duration=0.0, error=None):
+        self.host = host
+        self.layers_sent = layers_sent
+        self.layers_skipped = layers_skipped
+        self.sent = sent
+        self.saved = saved
+        self.duration = duration
+        self.error = error
+
+
+class HostStream:
+    """
+    The part of the docker save stream that goes to one host. Chunks are queued
+    so a slow host only holds back the save once its queue is full.
+    """
+    def __init__(self, host, skip):
+        self.host = host
+        self.skip = skip
+        self.queue = asyncio.Queue(maxsize=32)
+        self.alive = True
+        self.result = PushResult(host["name"])
+
+    async def put(self, chunk):
+        if self.alive:
+            await self.queue.put(chunk)
+
+    async def finish(self):
+        await self.put(None)
+
+    def close(self):
+        """
+        The host stopped reading. Its queue is emptied, which wakes a put
+        waiting on it, and its chunks are dropped from now on so the other
+        hosts are not blocked.
+        """
+        self.alive = False
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def feed(self, writer):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                break
+            try:
+                writer.write(chunk)
+                await writer.drain()
+                self.result.sent += len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close()
+                return
+        writer.close()
+
+
+def pax_path(data):
+    for record in data.split(b"\n"):
+        _length, _, field = record.partition(b" ")
+        key, _, value = field.partition(b"=")
+        if key == b"path":
+            return value.decode("utf-8", errors="surrogateescape")
+    return None
+
+
+async def read_member(reader, size, on_chunk):
+    left = size + (-size % tarfile.BLOCKSIZE)
+    while left > 0:
+        chunk = await reader.readexactly(min(CHUNK_SIZE, left))
+        left -= len(chunk)
+        await on_chunk(chunk)
+
+
+async def filter_stream(reader, streams, diff_ids):
+    """
+    Copy a docker save tar from reader to every host stream, leaving out the
+    layers a host already has.
+    """
+    layers = set(diff_ids)
+    pending = b""  # pax and long name headers that belong to the next member
+    name = None
+    while True:
+        header = await reader.readexactly(tarfile.BLOCKSIZE)
+        if header == b"\0" * tarfile.BLOCKSIZE:
+            rest = header + await reader.read()
+            for stream in streams:
+                await stream.put(pending + rest)
+            return
+        info = tarfile.TarInfo.frombuf(header, tarfile.ENCODING, "surrogateescape")
+        if info.type in (tarfile.XHDTYPE, tarfile.GNUTYPE_LONGNAME):
+            data = b""
+
+            async def collect(chunk):
+                nonlocal data
+                data += chunk
+            await read_member(reader, info.size, collect)
+            pending += header + data
+            name = pax_path(data) if info.type == tarfile.XHDTYPE else data.split(b"\0", 1)[0].decode("utf-8", errors="surrogateescape")
+            continue
+        name = name or info.name
+        member_header, pending = pending + header, b""
+        match = OCI_BLOB.match(name)
+        if match is not None and f"sha256:{match.group(1)}" in layers:
+            await send_layer(reader, info.size, f"sha256:{match.group(1)}", member_header, streams)
+        elif name.endswith("/layer.tar") and info.isfile():
+            await send_legacy_layer(reader, info.size, member_header, streams)
+        else:
+            for stream in streams:
+                await stream.put(member_header)
+
+            async def to_all(chunk):
+                for stream in streams:
+                    await stream.put(chunk)
+            await read_member(reader, info.size, to_all)
+        name = None
+
+
+async def send_layer(reader, size, diff_id, member_header, streams):
+    receivers = [stream for stream in streams if diff_id not in stream.skip]
+    for stream in streams:
+        if diff_id in stream.skip:
+            stream.result.layers_skipped += 1
+            stream.result.saved += size
+        else:
+            stream.result.layers_sent += 1
+            await stream.put(member_header)
+
+    async def to_receivers(chunk):
+        for stream in receivers:
+            await stream.put(chunk)
+    await read_member(reader, size, to_receivers)
+
+
+async def send_legacy_layer(reader, size, member_header, streams):
+    # the legacy layout names layers by a v1 id, hash the layer to find its diff id
+    sha = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as spool:
+        left = size
+
+        async def spool_chunk(chunk):
+            nonlocal left
+            sha.update(chunk[:max(left, 0)])
+            left -= len(chunk)
+            spool.write(chunk)
+        await read_member(reader, size, spool_chunk)
+        spool.seek(0)
+
+        class Spooled:
+            async def readexactly(self, n):
+                return spool.read(n)
+        await send_layer(Spooled(), size, f"sha256:{sha.hexdigest()}", member_header, streams)
+
+
+async def host_inventory(host, transport, inventory_command, timeout=None):
+    lines = []
+    result = await transport.run(host["name"], inventory_command, timeout, lambda _name, line: lines.append(line))
+    if not result.ok:
+        return None
+    return present_chain_ids(lines)
+
+
+async def push_group(hosts, save_command, diff_ids, transport, load_command=LOAD_COMMAND,
+                     inventory_command=INVENTORY_COMMAND, timeout=None, on_progress=None, progress_interval=2.0):
+    """
+    Stream one docker save to all hosts at once, every host gets the layers it is missing.
+    """
+    start = time.monotonic()
+    inventories = await asyncio.gather(*[host_inventory(host, transport, inventory_command, timeout) for host in hosts])
+    streams = []
+    failed = []
+    for host, present in zip(hosts, inventories):
+        if present is None:
+            failed.append(PushResult(host["name"], error="could not list the images on the host"))
+        else:
+            streams.append(HostStream(host, skippable_layers(diff_ids, present)))
+    if len(streams) == 0:
+        return failed
+
+    save = await asyncio.create_subprocess_exec(*save_command, stdout=asyncio.subprocess.PIPE, limit=CHUNK_SIZE, start_new_session=True)
+    output = {stream.host["name"]: [] for stream in streams}
+
+    async def produce():
+        try:
+            await filter_stream(save.stdout, streams, diff_ids)
+        except asyncio.IncompleteReadError:
+            pass  # the save failed, its exit code is reported below
+        except tarfile.HeaderError:
+            remote.kill(save)
+        finally:
+            for stream in streams:
+                await stream.finish()
+        return await save.wait()
+
+    async def load(stream):
+        try:
+            return await transport.run(stream.host["name"], load_command, timeout,
+                                       lambda name, line: output[name].append(line), stdin=stream.feed)
+        finally:
+            # a host that timed out or could not be reached no longer reads its queue
+            stream.close()
+
+    async def report():
+        while True:
+            await asyncio.sleep(progress_interval)
+            on_progress([stream.result for stream in streams])
+
+    reporter = asyncio.create_task(report()) if on_progress is not None else None
+    results = await asyncio.gather(produce(), *[load(stream) for stream in streams])
+    if reporter is not None:
+        reporter.cancel()
+    save_code, loads = results[0], results[1:]
+    for stream, load in zip(streams, loads):
+        stream.result.duration = time.monotonic() - start
+        if save_code != 0:
+            stream.result.error = f"{' '.join(save_command)} failed ({save_code})"
+        elif not load.ok:
+            stream.result.error = f"load failed ({load.status}) {' '.join(output[stream.host['name']][-3:])}"
+    return [stream.result for stream in streams] + failed
+
+
+async def push_hosts(hosts, save_command, diff_ids, transport, concurrency=8, **kwargs):
+    results = []
+    for i in range(0, len(hosts), concurrency):
+        results += await push_group(hosts[i:i + concurrency], save_command, diff_ids, transport, **kwargs)
+    return results
+
+
+def print_progress(results, out=None):
+    out = out if out is not None else sys.stdout
+    out.write("  " + "  ".join(f"{result.host} {format_size(result.sent)}" for result in results) + "\n")
+    out.flush()
+
+
+def print_push_summary(results, out=None):
+    out = out if out is not None else sys.stdout
+    width = max([len(result.host) for result in results] + [4])
+    out.write(f"\n{'host':<{width}} {'layers':>13} {'sent':>9} {'saved':>9} {'time':>8}\n")
+    for result in results:
+        if result.error is not None:
+            out.write(f"{result.host:<{width}} failed, {result.error}\n")
+            continue
+        layers = f"{result.layers_sent}/{result.layers_sent + result.layers_skipped}"
+        out.write(f"{result.host:<{width}} {layers:>13} {format_size(result.sent):>9} {format_size(result.saved):>9} {result.duration:>7.1f}s\n")
+    ok = [result for result in results if result.error is None]
+    out.write(f"{len(ok)}/{len(results)} hosts loaded the image, {format_size(sum(result.sent for result in ok))} sent, "
+              f"{format_size(sum(result.saved for result in ok))} saved by skipping layers the hosts already had\n")
+    out.flush()
+
+
+def docki_push(docki_config, tag, diff_ids):
+    """
+    Load the local image tag on every host in remote.hosts.
+    Returns the number of hosts that failed.
+    """
+    hosts = docki_config["remote"]["hosts"]
+    transport = remote.SSHTransport.from_config(docki_config)
+    remote_config = docki_config["remote"]
+    print(f"Sending {tag} ({len(diff_ids)} layers) to {len(hosts)} hosts...")
+    results = asyncio.run(push_hosts(
+        hosts, ["docker", "save", tag], diff_ids, transport,
+        concurrency=remote_config.get("push_concurrency", 8),
+        load_command=remote_config.get("load_command", LOAD_COMMAND),
+        inventory_command=remote_config.get("inventory_command", INVENTORY_COMMAND),
+        timeout=remote_config.get("timeout"),
+        on_progress=print_progress,
+    ))
+    print_push_summary(results)
+    return sum(result.error is not None for result in results)
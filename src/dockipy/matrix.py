@@ -0,0 +1,215 @@
+import argparse, io, re, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import dockipy.utils as utils
+from dockipy.config import merge
+from dockipy.client import get_client
+
+
+class PrefixedWriter:
+    """
+    File-like object that writes complete lines prefixed with the variant name,
+    so the output of variants running at once does not interleave mid-line.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, prefix, out=None):
+        self.prefix = prefix
+        self.out = out if out is not None else sys.stdout
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text.replace("\r\n", "\n")
+        *lines, self.buffer = self.buffer.split("\n")
+        if len(lines) > 0:
+            with self.lock:
+                self.out.write("".join(f"{self.prefix} {line}\n" for line in lines))
+                self.out.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer != "":
+            self.write("\n")
+
+    def isatty(self):
+        return False
+
+
+class Variant:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.tag = None
+        self.build_time = 0.0
+        self.venv_time = 0.0
+        self.run_time = 0.0
+        self.exit_code = None
+        self.error = None
+        self.log = io.StringIO()
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_code == 0
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return self.error
+        if self.exit_code is None:
+            return "not run"
+        return "pass" if self.exit_code == 0 else f"fail ({self.exit_code})"
+
+
+def tag_name(name):
+    return re.sub(r"[^a-z0-9_.-]+", "-", str(name).lower()).strip("-.")
+
+
+def variants(docki_config, only=None):
+    """
+    One config per entry of the matrix section, the entry overrides the rest of docki.yaml.
+    Every variant gets its own image tag and venv.
+    """
+    base = {key: value for key, value in docki_config.items() if key != "matrix"}
+    result = []
+    for name, overrides in docki_config["matrix"].items():
+        if only is not None and str(name) not in only:
+            continue
+        overrides = overrides or {}
+        config = merge(base, overrides)
+        config["tag"] = f"{base['tag']}-{tag_name(name)}"
+        if "venv_dir" not in overrides:
+            config["venv_dir"] = f"{utils.venv_dir(base)}-{tag_name(name)}"
+        result.append(Variant(str(name), config))
+    return result
+
+
+def build(variant, target_root, clean):
+    start = time.time()
+    try:
+        variant.tag = utils.build_docker_image(target_root, variant.config, clean, out=variant.log)
+    except SystemExit:
+        variant.error = "build failed"
+    except Exception as e:
+        # a lost daemon or missing file fails this variant, the others keep going
+        variant.error = f"build failed: {e}"
+    if variant.error is not None:
+        writer = PrefixedWriter(f"[{variant.name}]")
+        writer.write(variant.log.getvalue()[-4000:])
+        writer.close()
+    variant.build_time = time.time() - start
+
+
+def run(variant, command, work_dir, project_root, target_root, clean):
+    out = PrefixedWriter(f"[{variant.name}]")
+    config = variant.config
+    start = time.time()
+    try:
+        if "python_dep" in config:
+            utils.setup_venv(project_root, target_root, variant.tag, config, clean, out=out)
+            command = [f"{target_root}/{utils.venv_dir(config)}/bin/python3"] + command
+        else:
+            command = ["python3"] + command
+    except SystemExit:
+        variant.error = "venv failed"
+        return
+    finally:
+        variant.venv_time = time.time() - start
+    start = time.time()
+    container = utils.run_container(variant.tag, command, config, work_dir, project_root, target_root)
+    try:
+        variant.exit_code = utils.print_logs(container, out)
+    finally:
+        out.close()
+        container.remove(force=True)
+        variant.run_time = time.time() - start
+
+
+def run_matrix(all_variants, command, work_dir, project_root, target_root, jobs=2, clean=False):
+    """
+    Build and run every variant, at most jobs at a time. Variants with the same
+    base image wait for the first one to be built, so the layers they share are
+    built once and taken from the cache by the others.
+    """
+    first_built = {}
+    for variant in all_variants:
+        first_built.setdefault(variant.config.get("base_image"), (variant, threading.Event()))
+
+    def pipeline(variant):
+        leader, built = first_built[variant.config.get("base_image")]
+        if variant is not leader:
+            built.wait()
+        try:
+            build(variant, target_root, clean)
+        finally:
+            if variant is leader:
+                built.set()
+        if variant.error is None:
+            try:
+                run(variant, command, work_dir, project_root, target_root, clean)
+            except Exception as e:
+                variant.error = f"error: {e}"
+
+    # leaders are submitted first so a waiting variant never holds the slot its leader needs
+    leaders = [leader for leader, _built in first_built.values()]
+    ordered = leaders + [variant for variant in all_variants if variant not in leaders]
+    pool = ThreadPoolExecutor(max_workers=max(jobs, 1))
+    futures = [pool.submit(pipeline, variant) for variant in ordered]
+    try:
+        for future in futures:
+            future.result()
+    finally:
+        # on ctrl+c do not start the variants that are still waiting
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+    return all_variants
+
+
+def print_report(all_variants, duration, out=None):
+    out = out if out is not None else sys.stdout
+    width = max([len(variant.name) for variant in all_variants] + [7])
+    out.write(f"\n{'variant':<{width}} {'build':>8} {'venv':>8} {'run':>8}  result\n")
+    for variant in all_variants:
+        out.write(f"{variant.name:<{width}} {variant.build_time:>7.1f}s {variant.venv_time:>7.1f}s {variant.run_time:>7.1f}s  {variant.status}\n")
+    passed = sum(variant.ok for variant in all_variants)
+    out.write(f"{passed}/{len(all_variants)} variants passed in {duration:.1f}s\n")
+    out.flush()
+
+
+def dockimatrix():
+    argparser = argparse.ArgumentParser(
+        prog="dockimatrix",
+        description="Run a python script in every variant of the matrix section of docki.yaml",
+        )
+    argparser.add_argument("--jobs", "-j", type=int, help="Variants built and run at the same time (default matrix_jobs in docki.yaml or 2)")
+    argparser.add_argument("--only", help="Comma separated variants to run")
+    argparser.add_argument("--clean", action="store_true", help="Rebuild the images and venvs")
+    argparser.add_argument("command", nargs=argparse.REMAINDER, help="The script and its arguments")
+    args = argparser.parse_args()
+    if len(args.command) == 0:
+        argparser.print_help()
+        sys.exit(1)
+    work_dir, project_root, target_root = utils.find_project_root()
+    docki_config = utils.get_docki_config(project_root)
+    if len(docki_config.get("matrix") or {}) == 0:
+        print("No matrix section in docki.yaml, add one variant per base image to run.")
+        sys.exit(1)
+    all_variants = variants(docki_config, args.only.split(",") if args.only else None)
+    jobs = args.jobs if args.jobs is not None else docki_config.get("matrix_jobs", 2)
+    # create the shared client before the threads need it
+    get_client()
+    start = time.time()
+    try:
+        run_matrix(all_variants, args.command, work_dir, project_root, target_root, jobs, args.clean)
+    except KeyboardInterrupt:
+        print("Stopping the variants...")
+        for variant in all_variants:
+            for name in utils.docki_containers(variant.config["tag"]):
+                try:
+                    get_client().containers.get(name).remove(force=True)
+                except Exception:
+                    pass
+        sys.exit(130)
+    print_report(all_variants, time.time() - start)
+    sys.exit(0 if all(variant.ok for variant in all_variants) else 1)
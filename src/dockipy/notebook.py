@@ -0,0 +1,176 @@
+import hashlib, json, sys, time
+import dockipy.utils as utils
+from dockipy import resources, tracing, venv_lock
+from dockipy.image_cache import FINGERPRINT_LABEL
+from dockipy.client import get_client
+
+# jupyter gets this long to answer before a new container is given up on
+START_TIMEOUT = 120
+
+
+def server_url(config):
+    return f"http://localhost:{config.get('notebook_port', 8888)}"
+
+
+def notebook_command(config, work_dir, target_root, command):
+    token = config.get("notebook_token", "docki")
+    password = config.get("notebook_password", "docki")
+    notebook_args = config.get("notebook_args", "")
+    if config.get("persistent", False):
+        # a kept notebook stops by itself like the warm containers
+        notebook_args += f" --ServerApp.shutdown_no_activity_timeout={int(config.get('idle_timeout', 600))}"
+    jupyter = "jupyter"
+    if "python_dep" in config:
+        jupyter = f"{target_root}/{utils.venv_dir(config)}/bin/jupyter"
+    # a fixed port, so a reused container is found at the same url
+    return [f"{jupyter} notebook --no-browser {notebook_args} --ServerApp.allow_origin='*' "+\
+        f" --ServerApp.port={config.get('notebook_port', 8888)} --ServerApp.port_retries=0"+\
+        f" --ServerApp.token='{token}'"+\
+        f" --ServerApp.password='{password}'"+\
+        f" --ServerApp.root_dir='{work_dir}/'"] + command
+
+
+def config_fingerprint(config, command, project_root, target_root):
+    """
+    Everything the notebook container is created from. It is known from
+    docki.yaml and the requirements alone, so a running container is matched
+    without building, and changed requirements start a new one with an
+    updated venv.
+    """
+    lines = utils.requirement_lines(project_root, config) if "python_dep" in config else None
+    run_config = {
+        "config": config,
+        "command": command,
+        "volumes": utils.get_volumes(project_root, target_root),
+        "user": utils.get_user(),
+        "limits": resources.plan(config)[0],
+        "requirements": venv_lock.requirements_hash(lines) if lines is not None else None,
+    }
+    return hashlib.sha256(json.dumps(run_config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def api(config, method, path, body=None, timeout=1.0):
+    """
+    Call the jupyter server API, returns the decoded answer or None when the
+    server does not answer.
+    """
+    import http.client
+    port = int(config.get("notebook_port", 8888))
+    headers = {"Authorization": f"token {config.get('notebook_token', 'docki')}", "Content-Type": "application/json"}
+    connection = http.client.HTTPConnection("localhost", port, timeout=timeout)
+    try:
+        connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        if response.status >= 300:
+            return None
+        return json.loads(data) if len(data) > 0 else {}
+    except (OSError, ValueError):
+        return None
+    finally:
+        connection.close()
+
+
+def healthy(config):
+    return api(config, "GET", "/api/status") is not None
+
+
+@tracing.traced("reuse")
+def find_running(client, name, fingerprint, config, reuse=True):
+    """
+    The running notebook container of the project if it was started from the
+    same config and jupyter answers. A container that does not match, or any
+    container when reuse is off, is removed.
+    """
+    import docker
+    try:
+        container = client.containers.get(name)
+    except docker.errors.NotFound:
+        return None
+    if reuse and container.status == "running" and container.labels.get(FINGERPRINT_LABEL) == fingerprint and healthy(config):
+        return container
+    print(f"Replacing the notebook container {name}...")
+    container.remove(force=True)
+    return None
+
+
+def wait_until_healthy(container, config, timeout=START_TIMEOUT):
+    start = time.time()
+    while time.time() - start < timeout:
+        if healthy(config):
+            return True
+        container.reload()
+        if container.status != "running":
+            return False
+        time.sleep(0.2)
+    return False
+
+
+def prewarm(config):
+    """
+    Start a kernel so the first cell does not wait for it, unless one runs.
+    """
+    kernel = config.get("notebook_prewarm", False)
+    if kernel is False:
+        return
+    kernels = api(config, "GET", "/api/kernels")
+    if kernels is None or len(kernels) > 0:
+        return
+    started = api(config, "POST", "/api/kernels", {} if kernel is True else {"name": kernel}, timeout=30.0)
+    if started is not None:
+        print(f"Kernel {started.get('name')} is ready.")
+
+
+def print_url(config):
+    print(f"Notebook: {server_url(config)}/?token={config.get('notebook_token', 'docki')}")
+    sys.stdout.flush()
+    tracing.instant("url")
+
+
+def run_notebook(command, config, work_dir, project_root, target_root, build, clean=False, output=False):
+    """
+    Attach to the notebook container of the project and return the exit code.
+
+    A running container started from the same config is reused, which only
+    takes a docker call and a request to jupyter. Otherwise build() is called
+    to build the image and set up the venv, it returns the tag of the image,
+    and a new container is started.
+    Without persistent the container is removed again on exit, with it the
+    notebook keeps running and the next dockibook reattaches to its kernels.
+    """
+    command = notebook_command(config, work_dir, target_root, command)
+    if output:
+        utils.run_container(build(), command, config, work_dir, project_root, target_root, output)
+        return 0
+    name = utils.notebook_name(config["tag"])
+    fingerprint = config_fingerprint(config, command, project_root, target_root)
+    container = find_running(get_client(), name, fingerprint, config, reuse=not clean)
+    started = container is None
+    persistent = config.get("persistent", False)
+    if started:
+        container = utils.run_container(build(), command, config, work_dir, project_root, target_root,
+                                        name=name,
+                                        labels={FINGERPRINT_LABEL: fingerprint, "docki.role": "notebook", "docki.project": str(project_root)})
+    else:
+        print(f"Reusing the running notebook container {name}.")
+    try:
+        if started and not wait_until_healthy(container, config):
+            print("The notebook server did not start:")
+            utils.write_chunks([container.logs(tail=20)], sys.stdout)
+            persistent = False
+            return 1
+        print_url(config)
+        prewarm(config)
+        # a reused container only prints what is new, the banner was printed when it started
+        return utils.print_logs(container, since=None if started else int(time.time()))
+    except KeyboardInterrupt:
+        if persistent or not started:
+            print(f"\nDetached, the notebook keeps running in {name}. dockistop stops it.")
+            return 0
+        print("Shutting down the container")
+        return 130
+    finally:
+        if started and not persistent:
+            with tracing.span("teardown"):
+                container.stop()
+                container.remove(force=True)
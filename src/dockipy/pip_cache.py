@@ -0,0 +1,138 @@
+import os, pathlib
+from dockipy import state
+from dockipy.sizes import format_size
+from dockipy.client import get_client
+
+# Where the shared cache is mounted inside the container.
+CONTAINER_CACHE_DIR = "/docki-cache/pip"
+
+
+def cache_location(config):
+    """
+    Resolve the pip_cache entry of docki.yaml.
+
+    Returns ("dir", path), ("volume", name) or (None, None) when disabled.
+    The default is a host directory shared by every docki project.
+    """
+    pip_cache = config.get("pip_cache", True)
+    if pip_cache is False or pip_cache is None:
+        return None, None
+    if pip_cache is True:
+        return "dir", state.DOCKI_HOME / "pip-cache"
+    if isinstance(pip_cache, dict) and "volume" in pip_cache:
+        return "volume", pip_cache["volume"]
+    if isinstance(pip_cache, dict) and "dir" in pip_cache:
+        pip_cache = pip_cache["dir"]
+    return "dir", pathlib.Path(os.path.expanduser(str(pip_cache)))
+
+
+def ensure_volume(client, name, tag):
+    import docker
+    try:
+        client.volumes.get(name)
+        return
+    except docker.errors.NotFound:
+        pass
+    client.volumes.create(name, labels={"docki.role": "pip-cache"})
+    # new volumes are owned by root, the venv container runs as the host user
+    client.containers.run(tag, "chmod 1777 /cache", user="root", volumes={name: {"bind": "/cache", "mode": "rw"}}, remove=True)
+
+
+def cache_mount(client, config, tag):
+    """
+    Volumes and environment for a container that should use the shared pip cache.
+    """
+    kind, location = cache_location(config)
+    if kind is None:
+        return {}, {}
+    if kind == "volume":
+        ensure_volume(client, location, tag)
+        source = location
+    else:
+        location.mkdir(parents=True, exist_ok=True)
+        source = str(location)
+    volumes = {source: {"bind": CONTAINER_CACHE_DIR, "mode": "rw"}}
+    return volumes, {"PIP_CACHE_DIR": CONTAINER_CACHE_DIR}
+
+
+def cache_files(path):
+    files = []
+    for root, _dirs, names in os.walk(path):
+        for name in names:
+            file = os.path.join(root, name)
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, file))
+    return files
+
+
+def dir_size(path):
+    return sum(size for _used, size, _file in cache_files(path))
+
+
+def evict_dir(path, budget):
+    """
+    Remove least recently used files until the cache is at most budget bytes.
+    """
+    files = sorted(cache_files(path))
+    total = sum(size for _used, size, _file in files)
+    freed = 0
+    for _used, size, file in files:
+        if total <= budget:
+            break
+        try:
+            os.remove(file)
+        except OSError:
+            continue
+        total -= size
+        freed += size
+    return freed, total
+
+
+def volume_size(client, name):
+    for volume in client.df().get("Volumes") or []:
+        if volume["Name"] == name:
+            return volume.get("UsageData", {}).get("Size", 0)
+    return 0
+
+
+def evict_volume(client, name, tag, budget):
+    before = volume_size(client, name)
+    script = (
+        "find /cache -type f -printf '%A@ %s %p\\n' | sort -n | "
+        f"awk -v budget={budget} '{{size[NR]=$2; path[NR]=substr($0, index($0, $3)); total+=$2}} "
+        "END {for (i = 1; i <= NR && total > budget; i++) {print path[i]; total -= size[i]}}' | "
+        "tr '\\n' '\\0' | xargs -0 -r rm -f"
+    )
+    client.containers.run(tag, ["bash", "-c", script], user="root", volumes={name: {"bind": "/cache", "mode": "rw"}}, remove=True)
+    after = volume_size(client, name)
+    return max(before - after, 0), after
+
+
+def report(config):
+    kind, location = cache_location(config)
+    if kind is None:
+        print("The shared pip cache is disabled (pip_cache: false).")
+    elif kind == "dir":
+        print(f"pip cache {location}: {format_size(dir_size(location))}")
+    else:
+        client = get_client()
+        print(f"pip cache volume {location}: {format_size(volume_size(client, location))}")
+
+
+def evict(config, budget):
+    kind, location = cache_location(config)
+    if kind is None:
+        print("The shared pip cache is disabled (pip_cache: false).")
+        return
+    if kind == "dir":
+        freed, total = evict_dir(location, budget)
+    else:
+        client = get_client()
+        tag = config.get("tag", "docki_image")
+        if ":latest" not in tag:
+            tag += ":latest"
+        freed, total = evict_volume(client, location, tag, budget)
+    print(f"pip cache {location}: freed {format_size(freed)}, {format_size(total)} left.")
@@ -0,0 +1,158 @@
+import pathlib, platform, subprocess, sys, tempfile, threading, time
+from collections import deque
+import dockipy.utils as utils
+from dockipy import state, tracing, venv_lock, venv_store
+from dockipy.matrix import PrefixedWriter
+from dockipy.sizes import format_size
+
+# Where the prefetched wheels are mounted inside the container.
+CONTAINER_WHEELHOUSE = "/docki-prefetch"
+# The newest glibc a prefetched wheel may need, pip also takes the older
+# manylinux tags. Images with an older glibc install the rest from the index.
+MANYLINUX = "manylinux_2_28"
+ARCHITECTURES = {"amd64": "x86_64", "arm64": "aarch64"}
+
+
+def wheelhouse_dir():
+    """
+    The wheels downloaded for every project, pip skips the ones already there.
+    """
+    path = state.DOCKI_HOME / "wheelhouse"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def enabled(config, output=False):
+    return config.get("prefetch", True) and "python_dep" in config and not output
+
+
+def target_python(lock):
+    """
+    The python the wheels are for, the one in the image the last time or the
+    one on the host before the image was ever built.
+    """
+    interpreter = lock.get("interpreter") or platform.python_version()
+    return "".join(interpreter.split(".")[:2])
+
+
+def download_command(requirements_file, dest, python_version, machine=None):
+    machine = machine if machine is not None else platform.machine().lower()
+    return [sys.executable, "-m", "pip", "download", "--dest", str(dest),
+            "--only-binary=:all:", "--implementation", "cp", "--python-version", python_version,
+            "--platform", f"{MANYLINUX}_{ARCHITECTURES.get(machine, machine)}",
+            "--progress-bar", "off", "--disable-pip-version-check", "-r", str(requirements_file)]
+
+
+class Prefetch:
+    """
+    Downloads the wheels of python_dep on the host in a thread, while the image
+    builds. Saved wheels are reported as they arrive.
+    """
+    def __init__(self, python_dep, python_version, dest=None, out=None):
+        self.python_dep = venv_lock.normalize(python_dep)
+        self.python_version = python_version
+        self.dest = pathlib.Path(dest) if dest is not None else wheelhouse_dir()
+        self.out = out if out is not None else PrefixedWriter("[prefetch]")
+        self.tail = deque(maxlen=20)
+        self.process = None
+        self.thread = None
+        self.ok = None
+        self.saved = 0
+        self.reused = 0
+        self.size = 0
+        self.duration = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        start = time.time()
+        with tracing.span("prefetch"), tempfile.TemporaryDirectory(prefix="docki-prefetch-") as tmp:
+            requirements = pathlib.Path(tmp) / "requirements.txt"
+            requirements.write_text("\n".join(self.python_dep) + "\n")
+            try:
+                self.process = subprocess.Popen(download_command(requirements, self.dest, self.python_version),
+                                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+            except OSError as e:
+                self.tail.append(str(e))
+                self.ok = False
+                return
+            for line in self.process.stdout:
+                self.feed(line.strip())
+            self.ok = self.process.wait() == 0
+        self.duration = time.time() - start
+
+    def feed(self, line):
+        self.tail.append(line)
+        if line.startswith("Saved "):
+            wheel = pathlib.Path(line[len("Saved "):])
+            size = (self.dest / wheel.name).stat().st_size if (self.dest / wheel.name).exists() else 0
+            self.saved += 1
+            self.size += size
+            self.out.write(f"{wheel.name} ({format_size(size)})\n")
+        elif line.startswith("File was already downloaded"):
+            self.reused += 1
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def wait(self):
+        """
+        Wait for the download and report it. Returns True when every wheel is there.
+        """
+        while self.thread.is_alive():
+            self.thread.join(0.5)
+        if self.ok:
+            self.out.write(f"{self.saved} wheels downloaded ({format_size(self.size)}), {self.reused} already there, in {self.duration:.1f}s\n")
+        else:
+            self.out.write("Could not download every wheel on the host, pip in the container gets the rest:\n")
+            for line in list(self.tail)[-5:]:
+                self.out.write(f"  {line}\n")
+        self.out.close()
+        return self.ok
+
+
+def prefetchable(project_root, config):
+    """
+    The requirement lines to prefetch, or None when there is nothing to gain.
+    """
+    lines = utils.requirement_lines(project_root, config)
+    if lines is None or not venv_store.storable(lines):
+        return None
+    lock = venv_lock.load_lock(pathlib.Path(project_root) / utils.venv_dir(config) / "docki.lock")
+    if lock.get("requirements_hash") == venv_lock.requirements_hash(lines):
+        return None
+    return lines, lock
+
+
+def build_and_setup_venv(project_root, target_root, config, clean=False, output=False):
+    """
+    Build the image and set up the venv, returns the tag.
+
+    The two overlap: pip downloads the wheels of python_dep on the host while
+    the image builds, then the venv is installed from them in the container
+    without going to the index. When the venv is up to date, prefetch is off or
+    the requirements point at local files, the image is built first as before.
+    """
+    plan = prefetchable(project_root, config) if enabled(config, output) else None
+    if plan is None:
+        tag = utils.build_docker_image(target_root, config, clean, output)
+        if "python_dep" in config:
+            utils.setup_venv(project_root, target_root, tag, config, clean, output)
+        return tag
+    lines, lock = plan
+    prefetch = Prefetch(lines, target_python(lock)).start()
+    build_out = PrefixedWriter("[build]")
+    try:
+        tag = utils.build_docker_image(target_root, config, clean, output, out=build_out)
+    except BaseException:
+        prefetch.stop()
+        raise
+    finally:
+        build_out.close()
+    wheelhouse = prefetch.dest if prefetch.wait() else None
+    utils.setup_venv(project_root, target_root, tag, config, clean, output, wheelhouse=wheelhouse)
+    return tag
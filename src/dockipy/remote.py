@@ -0,0 +1,260 @@
+import asyncio, os, pathlib, shlex, signal, sys, time
+from dockipy.state import state_path
+
+# Reuse one ssh connection per host for every command sent to it.
+def multiplex_options():
+    control_dir = state_path("ssh", "control").parent
+    return [
+        "-o", "BatchMode=yes",
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={control_dir}/%C",
+        "-o", "ControlPersist=60",
+    ]
+
+
+class HostResult:
+    def __init__(self, host, exit_code=None, duration=0.0, timed_out=False, error=None):
+        self.host = host
+        self.exit_code = exit_code
+        self.duration = duration
+        self.timed_out = timed_out
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    @property
+    def status(self):
+        if self.timed_out:
+            return "timeout"
+        if self.error is not None:
+            return "error"
+        return str(self.exit_code)
+
+
+class SSHTransport:
+    """
+    Run shell commands on remote hosts with ssh subprocesses.
+
+    The ssh binary can be swapped (remote.ssh in docki.yaml or DOCKI_SSH), any
+    stand-in is called as `ssh [options] host command`.
+    """
+    def __init__(self, ssh=None, options=None):
+        if ssh is None:
+            ssh = os.environ.get("DOCKI_SSH", "ssh")
+        self.ssh = shlex.split(ssh) if isinstance(ssh, str) else list(ssh)
+        self.options = multiplex_options() if options is None else list(options)
+
+    @classmethod
+    def from_config(cls, docki_config):
+        return cls(docki_config.get("remote", {}).get("ssh"))
+
+    def command(self, host, remote_command):
+        return self.ssh + self.options + [host, remote_command]
+
+    async def run(self, host, remote_command, timeout=None, on_output=None, stdin=None):
+        """
+        Run remote_command on host, call on_output(host, line) for every output
+        line and return a HostResult.
+        """
+        start = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command(host, remote_command),
+                stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                limit=1024 * 1024,  # long progress lines without a newline
+                start_new_session=True,
+            )
+        except OSError as e:
+            return HostResult(host, duration=time.monotonic() - start, error=str(e))
+
+        async def feed():
+            try:
+                await stdin(process.stdin)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the remote command exited early, its exit code tells why
+
+        async def read():
+            async for line in process.stdout:
+                if on_output is not None:
+                    on_output(host, line.decode("utf-8", errors="replace").rstrip("\n"))
+
+        async def communicate():
+            await asyncio.gather(feed(), read()) if stdin is not None else await read()
+            return await process.wait()
+
+        try:
+            exit_code = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            kill(process)
+            await process.wait()
+            return HostResult(host, duration=time.monotonic() - start, timed_out=True)
+        return HostResult(host, exit_code, time.monotonic() - start)
+
+
+def kill(process):
+    # children of a local stand-in would keep the output pipe open, kill the whole group
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+def host_command(host, command):
+    if "workspace" in host:
+        return f"cd {host['workspace']} && {command}"
+    return command
+
+
+def prefixed_printer(names, out=None):
+    out = out if out is not None else sys.stdout
+    width = max([len(name) for name in names] + [0])
+
+    def on_output(name, line):
+        out.write(f"[{name:<{width}}] {line}\n")
+        out.flush()
+    return on_output
+
+
+async def run_on_hosts(hosts, command, transport, timeout=None, on_output=None):
+    return await asyncio.gather(*[
+        transport.run(host["name"], host_command(host, command), timeout, on_output)
+        for host in hosts
+    ])
+
+
+def print_summary(results, out=None):
+    out = out if out is not None else sys.stdout
+    width = max([len(result.host) for result in results] + [4])
+    out.write(f"\n{'host':<{width}} {'exit':>7} {'time':>9}\n")
+    for result in results:
+        out.write(f"{result.host:<{width}} {result.status:>7} {result.duration:>8.1f}s\n")
+    failed = sum(not result.ok for result in results)
+    out.write(f"{len(results) - failed}/{len(results)} hosts succeeded\n")
+    out.flush()
+
+
+def docki_run(docki_config, command, timeout=None):
+    """
+    Run command on every host in remote.hosts at once, without tmux.
+    Returns the number of hosts that failed.
+    """
+    hosts = docki_config["remote"]["hosts"]
+    transport = SSHTransport.from_config(docki_config)
+    timeout = timeout if timeout is not None else docki_config["remote"].get("timeout")
+    results = asyncio.run(run_on_hosts(hosts, command, transport, timeout, prefixed_printer([host["name"] for host in hosts])))
+    print_summary(results)
+    return sum(not result.ok for result in results)
+
+
+class Job:
+    def __init__(self, index, command):
+        self.index = index
+        self.command = command
+        self.attempts = 0
+        self.failed_hosts = set()
+        self.result = None
+
+
+def read_jobs(path):
+    jobs = []
+    for line in pathlib.Path(path).read_text().splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        jobs.append(Job(len(jobs), line))
+    return jobs
+
+
+async def run_jobs(hosts, jobs, transport, retries=2, timeout=None, on_output=None, on_done=None):
+    """
+    Spread jobs over hosts with a shared queue, every host runs `slots` jobs at a
+    time and takes the next job as soon as one of its slots frees up. A failed job
+    goes back to the queue to be retried on a host it has not failed on yet.
+    """
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    workers = [(host, slot) for host in hosts for slot in range(int(host.get("slots", 1)))]
+    remaining = len(jobs)
+
+    def finish(job):
+        nonlocal remaining
+        remaining -= 1
+        if on_done is not None:
+            on_done(job, len(jobs) - remaining, len(jobs))
+        if remaining == 0:
+            for _worker in workers:
+                queue.put_nowait(None)
+
+    async def worker(host):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            if host["name"] in job.failed_hosts and len(job.failed_hosts) < len(hosts):
+                # leave it for a host it has not failed on
+                queue.put_nowait(job)
+                await asyncio.sleep(0.05)
+                continue
+            job.attempts += 1
+
+            def output(name, line):
+                if on_output is not None:
+                    on_output(f"{name} #{job.index}", line)
+            job.result = await transport.run(host["name"], host_command(host, job.command), timeout, output)
+            if job.result.ok or job.attempts > retries:
+                finish(job)
+            else:
+                job.failed_hosts.add(host["name"])
+                queue.put_nowait(job)
+
+    if len(jobs) > 0:
+        await asyncio.gather(*[worker(host) for host, _slot in workers])
+    return jobs
+
+
+def print_job_summary(jobs, duration, out=None):
+    out = out if out is not None else sys.stdout
+    hosts = {}
+    for job in jobs:
+        count, busy = hosts.get(job.result.host, (0, 0.0))
+        hosts[job.result.host] = (count + 1, busy + job.result.duration)
+    failed = [job for job in jobs if not job.result.ok]
+    retried = sum(job.attempts - 1 for job in jobs)
+    width = max([len(host) for host in hosts] + [4])
+    out.write(f"\n{'host':<{width}} {'jobs':>6} {'busy':>9}\n")
+    for host, (count, busy) in sorted(hosts.items()):
+        out.write(f"{host:<{width}} {count:>6} {busy:>8.1f}s\n")
+    out.write(f"{len(jobs) - len(failed)}/{len(jobs)} jobs succeeded, {retried} retries, "
+              f"{duration:.1f}s, {len(jobs) / max(duration, 1e-9) * 60:.1f} jobs/min\n")
+    for job in failed:
+        out.write(f"failed #{job.index} on {job.result.host} ({job.result.status}): {job.command}\n")
+    out.flush()
+
+
+def docki_map(docki_config, jobs_file, retries=None, timeout=None):
+    """
+    Run every line of jobs_file once, spread over remote.hosts.
+    Returns the number of jobs that failed.
+    """
+    hosts = docki_config["remote"]["hosts"]
+    transport = SSHTransport.from_config(docki_config)
+    timeout = timeout if timeout is not None else docki_config["remote"].get("timeout")
+    retries = retries if retries is not None else docki_config["remote"].get("retries", 2)
+    jobs = read_jobs(jobs_file)
+    # output is prefixed with "host #job"
+    names = [f"{host['name']} #{len(jobs)}" for host in hosts]
+
+    def on_done(job, done, total):
+        print(f"[{done}/{total}] #{job.index} on {job.result.host}: {job.result.status} in {job.result.duration:.1f}s")
+    start = time.monotonic()
+    jobs = asyncio.run(run_jobs(hosts, jobs, transport, retries, timeout, prefixed_printer(names), on_done))
+    print_job_summary(jobs, time.monotonic() - start)
+    return sum(not job.result.ok for job in jobs)
@@ -0,0 +1,117 @@
+import re, sys, time, threading
+import dockipy.utils as utils
+from dockipy import resources
+from dockipy.matrix import PrefixedWriter
+
+# The last rate the script prints is its throughput, this matches tqdm and most training loops.
+THROUGHPUT = r"([0-9]+(?:\.[0-9]+)?)\s*((?:it|samples|items|img|images|tokens|batches|steps)/s)"
+
+
+class Replica:
+    def __init__(self, rank, limits):
+        self.rank = rank
+        self.limits = limits
+        self.container = None
+        self.exit_code = None
+        self.run_time = 0.0
+        self.output = 0
+        self.throughput = None
+        self.unit = None
+
+
+class ThroughputWriter:
+    """
+    Passes the output of a replica on and keeps the last rate it printed.
+    """
+    def __init__(self, replica, out, pattern):
+        self.replica = replica
+        self.out = out
+        self.pattern = re.compile(pattern)
+        self.tail = ""
+
+    def write(self, text):
+        self.out.write(text)
+        self.replica.output += len(text)
+        # a rate can be split over two chunks, the end of the last one is searched again
+        matches = self.pattern.findall(self.tail + text)
+        if len(matches) > 0:
+            value, unit = matches[-1]
+            self.replica.throughput, self.replica.unit = float(value), unit
+        self.tail = (self.tail + text)[-64:]
+
+    def flush(self):
+        self.out.flush()
+
+    def isatty(self):
+        return False
+
+
+def replica_name(tag, rank):
+    return f"{tag}-r{rank}"
+
+
+def run_replica(replica, pattern):
+    out = PrefixedWriter(f"[r{replica.rank}]")
+    start = time.time()
+    try:
+        replica.exit_code = utils.print_logs(replica.container, ThroughputWriter(replica, out, pattern))
+    finally:
+        out.close()
+        replica.run_time = time.time() - start
+
+
+def run_replicas(tag, command, config, work_dir, project_root, target_root, count):
+    """
+    Start count containers of command, each pinned to its own cpus and NUMA
+    node, with RANK, LOCAL_RANK and WORLD_SIZE set. Returns the replicas once
+    all of them stopped.
+    """
+    replicas = [Replica(rank, limits) for rank, limits in enumerate(resources.plan(config, count))]
+    for replica in replicas:
+        print(f"[r{replica.rank}] {resources.describe(replica.limits)}")
+    threads = []
+    try:
+        for replica in replicas:
+            environment = {"RANK": str(replica.rank), "LOCAL_RANK": str(replica.rank), "WORLD_SIZE": str(count)}
+            replica.container = utils.run_container(tag, command, config, work_dir, project_root, target_root,
+                                                    limits=replica.limits, environment=environment,
+                                                    name=replica_name(config["tag"], replica.rank),
+                                                    labels={utils.REPLICA_LABEL: config["tag"]})
+        pattern = config.get("throughput_pattern", THROUGHPUT)
+        for replica in replicas:
+            thread = threading.Thread(target=run_replica, args=(replica, pattern), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # a timeout keeps ctrl+c working while waiting
+            while thread.is_alive():
+                thread.join(0.5)
+    finally:
+        for replica in replicas:
+            if replica.container is not None:
+                replica.container.remove(force=True)
+    return replicas
+
+
+def exit_code(replicas):
+    codes = [replica.exit_code for replica in replicas]
+    if any(code is None for code in codes):
+        return 1
+    return next((code for code in codes if code != 0), 0)
+
+
+def print_report(replicas, duration, out=None):
+    out = out if out is not None else sys.stdout
+    out.write(f"\n{'replica':<8} {'cpus':<14} {'run':>8} {'throughput':>18}  exit\n")
+    for replica in replicas:
+        throughput = f"{replica.throughput:.2f} {replica.unit}" if replica.throughput is not None else "-"
+        cpus = replica.limits["cpuset_cpus"] or "all"
+        out.write(f"r{replica.rank:<7} {cpus:<14} {replica.run_time:>7.1f}s {throughput:>18}  {replica.exit_code}\n")
+    rated = [replica for replica in replicas if replica.throughput is not None]
+    if len(rated) == len(replicas) and len(set(replica.unit for replica in rated)) == 1:
+        out.write(f"{len(replicas)} replicas: {sum(replica.throughput for replica in rated):.2f} {rated[0].unit} in total, ")
+    else:
+        out.write(f"{len(replicas)} replicas: ")
+    slowest = max(replica.run_time for replica in replicas)
+    out.write(f"slowest {slowest:.1f}s, {len(replicas) / duration * 3600:.1f} runs/hour\n")
+    out.flush()
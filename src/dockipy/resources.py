@@ -0,0 +1,171 @@
+import os, glob
+from dockipy.sizes import parse_size, format_size
+
+# shm_size when docki.yaml does not set one
+DEFAULT_SHM = "16G"
+# Part of the host memory that auto sizing hands out, the rest is left to the host.
+AUTO_MEMORY_SHARE = 0.9
+
+
+def parse_cpulist(text):
+    """
+    Parse a cpuset like 0-3,8,10-11 into a sorted list of cpus.
+    """
+    cpus = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                cpus.update(range(int(first), int(last) + 1))
+            else:
+                cpus.add(int(part))
+        except ValueError:
+            raise ValueError(f"Invalid cpuset: {text}")
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if len(ranges) > 0 and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def allowed_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(root="/sys/devices/system/node"):
+    """
+    The cpus this process may use, grouped by NUMA node. Hosts without NUMA
+    information are one node.
+    """
+    allowed = set(allowed_cpus())
+    nodes = {}
+    for path in sorted(glob.glob(f"{root}/node[0-9]*/cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        if len(cpus) > 0:
+            nodes[node] = cpus
+    return nodes if len(nodes) > 0 else {0: sorted(allowed)}
+
+
+def host_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def split(items, count):
+    """
+    Split items into count contiguous groups whose sizes differ by at most one.
+    """
+    size, extra = divmod(len(items), count)
+    groups, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def pin(nodes, count):
+    """
+    Give each of count replicas its own cpus, as (cpus, nodes) pairs. Replicas
+    are spread evenly over the NUMA nodes and never span two nodes, unless there
+    are fewer replicas than nodes and each gets several whole nodes.
+    """
+    node_ids = sorted(nodes)
+    if count <= len(node_ids):
+        return [(sum((nodes[node] for node in group), []), group) for group in split(node_ids, count)]
+    per_node = [len(group) for group in split(list(range(count)), len(node_ids))]
+    pinned = []
+    for node, replicas in zip(node_ids, per_node):
+        if replicas > len(nodes[node]):
+            raise ValueError(f"Can not pin {count} replicas, NUMA node {node} only has {len(nodes[node])} cpus")
+        pinned += [(cpus, [node]) for cpus in split(nodes[node], replicas)]
+    return pinned
+
+
+def plan(config, replicas=1, nodes=None, memory=None):
+    """
+    The cpuset, memory limit and shm size of every replica from the cpuset,
+    memory and shm_size entries of docki.yaml.
+
+    auto sizes them from the host: the cpus are split over the replicas along
+    NUMA nodes, the memory is split evenly and shm gets half of the memory of
+    a replica. Without a cpuset a single container is not pinned, replicas
+    always are.
+    """
+    cpuset = config.get("cpuset")
+    memory_limit = config.get("memory")
+    shm_size = config.get("shm_size", DEFAULT_SHM)
+    share = None
+    if memory_limit == "auto" or shm_size == "auto":
+        share = int((memory if memory is not None else host_memory()) * AUTO_MEMORY_SHARE / replicas)
+    if memory_limit == "auto":
+        memory_limit = share
+    elif memory_limit is not None:
+        memory_limit = parse_size(memory_limit)
+    if shm_size == "auto":
+        shm_size = (memory_limit if memory_limit is not None else share) // 2
+
+    pinned = [(None, None)] * replicas
+    if cpuset is not None or replicas > 1:
+        nodes = nodes if nodes is not None else numa_nodes()
+        if cpuset not in (None, "auto"):
+            wanted = set(parse_cpulist(cpuset))
+            nodes = {node: [cpu for cpu in cpus if cpu in wanted] for node, cpus in nodes.items()}
+            nodes = {node: cpus for node, cpus in nodes.items() if len(cpus) > 0}
+            if len(nodes) == 0:
+                raise ValueError(f"None of the cpus in cpuset {cpuset} can be used")
+        pinned = pin(nodes, replicas)
+    return [{
+        "cpuset_cpus": format_cpulist(cpus) if cpus is not None else None,
+        "cpuset_mems": format_cpulist(mems) if mems is not None else None,
+        "mem_limit": memory_limit,
+        "shm_size": shm_size,
+    } for cpus, mems in pinned]
+
+
+def run_kwargs(limits):
+    """
+    Keyword arguments of containers.run for one entry of plan.
+    """
+    return {key: value for key, value in limits.items() if value is not None}
+
+
+def cli_flags(limits):
+    flags = [f"--shm-size={limits['shm_size']}"]
+    if limits["cpuset_cpus"] is not None:
+        flags.append(f"--cpuset-cpus={limits['cpuset_cpus']}")
+    if limits["cpuset_mems"] is not None:
+        flags.append(f"--cpuset-mems={limits['cpuset_mems']}")
+    if limits["mem_limit"] is not None:
+        flags.append(f"--memory={limits['mem_limit']}")
+    return " ".join(flags)
+
+
+def describe(limits):
+    parts = []
+    if limits["cpuset_cpus"] is not None:
+        parts.append(f"cpus {limits['cpuset_cpus']} (node {limits['cpuset_mems']})")
+    if limits["mem_limit"] is not None:
+        parts.append(f"memory {format_size(limits['mem_limit'])}")
+    shm_size = limits["shm_size"]
+    parts.append(f"shm {format_size(shm_size) if isinstance(shm_size, int) else shm_size}")
+    return ", ".join(parts)
@@ -0,0 +1,31 @@
+import os, json, pathlib, threading
+
+# Local state shared by all docki commands (caches, indexes, history).
+DOCKI_HOME = pathlib.Path(os.environ.get("DOCKI_HOME", os.path.expanduser("~/.docki")))
+
+
+def state_path(*parts):
+    path = DOCKI_HOME.joinpath(*parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def load_json(path, default=None):
+    path = pathlib.Path(path)
+    if not path.exists():
+        return default
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, content):
+    """
+    Write json atomically so concurrent docki commands never read a half written file.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(content, indent=2, sort_keys=True))
+    os.replace(tmp, path)
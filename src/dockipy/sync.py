@@ -0,0 +1,269 @@
+import asyncio, hashlib, os, pathlib, re, sys, tarfile, time
+from dockipy import remote
+from dockipy.state import state_path, load_json, save_json
+from dockipy.sizes import format_size
+
+SYNC_ID_FILE = ".docki_sync"
+DELETE_FILE = ".docki_delete"
+ALWAYS_IGNORED = [".git/", SYNC_ID_FILE, DELETE_FILE]
+CHUNK_SIZE = 1024 * 1024
+
+
+def glob_to_regex(pattern):
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """
+    The subset of .gitignore / .dockerignore syntax used in practice: globs with
+    *, ** and ?, a leading / or an inner / anchors to the root, a trailing / only
+    matches directories and ! re-includes. The last matching rule wins.
+    """
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            line = line.lstrip("!")
+            dir_only = line.endswith("/")
+            anchored = line.startswith("/") or "/" in line.strip("/")
+            regex = glob_to_regex(line.strip("/"))
+            regex = ("^" if anchored else "^(?:.*/)?") + regex + "$"
+            self.rules.append((negate, dir_only, re.compile(regex)))
+
+    @classmethod
+    def for_project(cls, project_root):
+        lines = list(ALWAYS_IGNORED)
+        for name in [".gitignore", ".dockerignore"]:
+            ignore_file = pathlib.Path(project_root) / name
+            if ignore_file.exists():
+                lines += ignore_file.read_text().splitlines()
+        return cls(lines)
+
+    def ignored(self, path, is_dir=False):
+        ignored = False
+        for negate, dir_only, regex in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negate
+        return ignored
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def build_manifest(project_root, rules=None, previous=None):
+    """
+    Map every synced file to [size, mtime_ns, sha256]. Hashes from previous are
+    reused when size and mtime did not change, so only edited files are read.
+    """
+    project_root = str(project_root)
+    rules = rules if rules is not None else IgnoreRules.for_project(project_root)
+    previous = previous or {}
+    manifest = {}
+    stack = [""]
+    while len(stack) > 0:
+        relative_dir = stack.pop()
+        with os.scandir(os.path.join(project_root, relative_dir)) as entries:
+            for entry in entries:
+                path = f"{relative_dir}/{entry.name}" if relative_dir != "" else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if not rules.ignored(path, is_dir=True):
+                        stack.append(path)
+                    continue
+                if not entry.is_file(follow_symlinks=False) or rules.ignored(path):
+                    continue
+                stat = entry.stat()
+                old = previous.get(path)
+                if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    manifest[path] = old
+                else:
+                    manifest[path] = [stat.st_size, stat.st_mtime_ns, file_hash(entry.path)]
+    return manifest
+
+
+def manifest_id(manifest):
+    sha = hashlib.sha256()
+    for path in sorted(manifest):
+        sha.update(f"{path}\0{manifest[path][2]}\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def diff_manifest(manifest, host_files):
+    changed = sorted(path for path, entry in manifest.items() if host_files.get(path) != entry[2])
+    deleted = sorted(path for path in host_files if path not in manifest)
+    return changed, deleted
+
+
+def tar_padding(size):
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+async def write_tar(writer, project_root, paths, extra_files={}):
+    """
+    Stream a tar of paths to an asyncio writer one chunk at a time.
+    """
+    for name, data in extra_files.items():
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        writer.write(info.tobuf(format=tarfile.PAX_FORMAT) + data + tar_padding(len(data)))
+    for path in paths:
+        full_path = os.path.join(str(project_root), path)
+        try:
+            f = open(full_path, "rb")
+        except OSError:
+            continue
+        with f:
+            stat = os.fstat(f.fileno())
+            info = tarfile.TarInfo(path)
+            info.size = stat.st_size
+            info.mtime = stat.st_mtime
+            info.mode = stat.st_mode & 0o7777
+            writer.write(info.tobuf(format=tarfile.PAX_FORMAT))
+            left = stat.st_size
+            while left > 0:
+                chunk = f.read(min(CHUNK_SIZE, left))
+                if chunk == b"":
+                    # the file shrank while streaming, keep the tar valid
+                    chunk = b"\0" * left
+                writer.write(chunk)
+                left -= len(chunk)
+                await writer.drain()
+            writer.write(tar_padding(stat.st_size))
+    writer.write(b"\0" * tarfile.BLOCKSIZE * 2)
+    await writer.drain()
+    writer.close()
+
+
+class SyncResult:
+    def __init__(self, host, changed=0, deleted=0, sent=0, duration=0.0, error=None, skipped=None):
+        self.host = host
+        self.changed = changed
+        self.deleted = deleted
+        self.sent = sent
+        self.duration = duration
+        self.error = error
+        self.skipped = skipped
+
+
+def host_cache_file(project_root, host):
+    key = hashlib.sha256(f"{project_root}\0{host['name']}\0{host['workspace']}".encode("utf-8")).hexdigest()[:16]
+    return state_path("sync", f"{key}.json")
+
+
+async def sync_host(host, project_root, manifest, transport, timeout=None):
+    start = time.monotonic()
+    if "workspace" not in host:
+        return SyncResult(host["name"], skipped="no workspace")
+    workspace = host["workspace"]
+    cache_file = host_cache_file(project_root, host)
+    cache = load_json(cache_file, {})
+    sync_id = manifest_id(manifest)
+
+    lines = []
+    check = await transport.run(host["name"], f"cat {workspace}/{SYNC_ID_FILE} 2>/dev/null || true", timeout,
+                                lambda _name, line: lines.append(line))
+    if not check.ok:
+        return SyncResult(host["name"], duration=time.monotonic() - start, error=f"check failed ({check.status})")
+    remote_id = lines[0].strip() if len(lines) > 0 else ""
+    if remote_id != cache.get("sync_id"):
+        # the workspace changed behind our back, resend everything
+        cache = {}
+    if remote_id == sync_id:
+        return SyncResult(host["name"], duration=time.monotonic() - start)
+
+    changed, deleted = diff_manifest(manifest, cache.get("files", {}))
+    sent = sum(manifest[path][0] for path in changed)
+    extra_files = {}
+    if len(deleted) > 0:
+        extra_files[DELETE_FILE] = "".join(f"{path}\0" for path in deleted).encode("utf-8")
+    # the sync id is only written once every file arrived, a failed transfer is sent again
+    command = (
+        f"mkdir -p {workspace} && cd {workspace} && tar -xf - && "
+        f"{{ [ ! -f {DELETE_FILE} ] || {{ xargs -0 rm -f -- < {DELETE_FILE} && rm -f {DELETE_FILE}; }}; }} && "
+        f"printf '%s\\n' {sync_id} > {SYNC_ID_FILE}"
+    )
+    output = []
+    result = await transport.run(host["name"], command, timeout, lambda _name, line: output.append(line),
+                                 stdin=lambda writer: write_tar(writer, project_root, changed, extra_files))
+    if not result.ok:
+        return SyncResult(host["name"], duration=time.monotonic() - start, error=f"transfer failed ({result.status}) {' '.join(output[-3:])}")
+    save_json(cache_file, {"sync_id": sync_id, "files": {path: entry[2] for path, entry in manifest.items()}})
+    return SyncResult(host["name"], len(changed), len(deleted), sent, time.monotonic() - start)
+
+
+async def sync_hosts(hosts, project_root, manifest, transport, concurrency=8, timeout=None):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(host):
+        async with semaphore:
+            return await sync_host(host, project_root, manifest, transport, timeout)
+    return await asyncio.gather(*[limited(host) for host in hosts])
+
+
+def local_manifest(project_root):
+    """
+    Manifest of the project, reusing the hashes of the last sync.
+    """
+    cache_file = state_path("sync", hashlib.sha256(str(project_root).encode("utf-8")).hexdigest()[:16] + "-local.json")
+    manifest = build_manifest(project_root, previous=load_json(cache_file, {}))
+    save_json(cache_file, manifest)
+    return manifest
+
+
+def print_sync_summary(results, out=None):
+    out = out if out is not None else sys.stdout
+    width = max([len(result.host) for result in results] + [4])
+    for result in results:
+        if result.skipped is not None:
+            status = f"skipped, {result.skipped}"
+        elif result.error is not None:
+            status = f"failed, {result.error}"
+        elif result.changed == 0 and result.deleted == 0:
+            status = "up to date"
+        else:
+            status = f"{result.changed} changed, {result.deleted} deleted, {format_size(result.sent)} sent"
+        out.write(f"{result.host:<{width}} {result.duration:>6.1f}s {status}\n")
+    out.flush()
+
+
+def docki_sync(docki_config, project_root):
+    """
+    Bring the workspace of every host in remote.hosts up to date with project_root.
+    Returns the number of hosts that failed.
+    """
+    hosts = docki_config["remote"]["hosts"]
+    transport = remote.SSHTransport.from_config(docki_config)
+    concurrency = docki_config["remote"].get("sync_concurrency", 8)
+    manifest = local_manifest(project_root)
+    print(f"Syncing {len(manifest)} files to {len(hosts)} hosts...")
+    results = asyncio.run(sync_hosts(hosts, project_root, manifest, transport, concurrency))
+    print_sync_summary(results)
+    return sum(result.error is not None for result in results)
@@ -0,0 +1,150 @@
+import os, sys, json, time, atexit, threading, functools
+from dockipy.state import state_path
+
+# Spans are only recorded after start(), until then span() hands out a shared
+# no-op context manager and traced functions cost one flag check.
+_enabled = False
+_program = None
+_origin = 0
+_trace_file = None
+# (name, category, start_ns, duration_ns or None for instant events, thread id, args)
+events = []
+_local = threading.local()
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.depth = getattr(_local, "depth", 0)
+        if self.depth > 0 and self.category == "phase":
+            # phases inside a phase are steps, so the summary counts every moment once
+            self.category = "step"
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        add(self.name, self.category, self.start, time.perf_counter_ns() - self.start, **self.args)
+        _local.depth = self.depth
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def requested():
+    return os.environ.get("DOCKI_PROFILE", "") not in ("", "0")
+
+
+def start(program, trace_file=None):
+    """
+    Record spans from now on and report them when the process exits.
+
+    The trace goes to trace_file, to DOCKI_PROFILE when it names a .json file,
+    or to ~/.docki/traces.
+    """
+    global _enabled, _program, _origin, _trace_file
+    if _enabled:
+        return
+    _enabled = True
+    _program = program
+    _origin = time.perf_counter_ns()
+    env = os.environ.get("DOCKI_PROFILE", "")
+    _trace_file = trace_file or (env if env.endswith(".json") else None)
+    atexit.register(finish)
+
+
+def span(name, category="phase", **args):
+    if not _enabled:
+        return NO_SPAN
+    return Span(name, category, args)
+
+
+def traced(name):
+    """
+    Decorator recording every call of the function as a span called name.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name, "phase", {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add(name, category, start_ns, duration_ns, **args):
+    events.append((name, category, start_ns, duration_ns, threading.get_ident(), args))
+
+
+def instant(name, **args):
+    if _enabled:
+        add(name, "mark", time.perf_counter_ns(), None, **args)
+
+
+def chrome_trace():
+    """
+    The events in the Chrome trace format, open it in chrome://tracing or ui.perfetto.dev.
+    """
+    trace_events = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": _program}}]
+    for name, category, start_ns, duration_ns, thread, args in events:
+        event = {"name": name, "cat": category, "ts": (start_ns - _origin) / 1000, "pid": os.getpid(), "tid": thread, "args": args}
+        if duration_ns is None:
+            event.update({"ph": "i", "s": "t"})
+        else:
+            event.update({"ph": "X", "dur": duration_ns / 1000})
+        trace_events.append(event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def summary(total_ns):
+    phases, marks = {}, {}
+    docker_calls, docker_ns = 0, 0
+    for name, category, start_ns, duration_ns, _thread, _args in events:
+        if category == "phase":
+            phases[name] = phases.get(name, 0) + duration_ns
+        elif category == "docker":
+            docker_calls += 1
+            docker_ns += duration_ns
+        elif category == "mark":
+            marks.setdefault(name, start_ns - _origin)
+    parts = [f"{name} {format_seconds(duration / 1e9)}" for name, duration in phases.items()]
+    parts += [f"{name} at {format_seconds(offset / 1e9)}" for name, offset in marks.items()]
+    parts.append(f"docker {docker_calls} calls {format_seconds(docker_ns / 1e9)}")
+    return f"{_program} {format_seconds(total_ns / 1e9)}: " + ", ".join(parts)
+
+
+def finish(out=None):
+    out = out if out is not None else sys.stderr
+    total = time.perf_counter_ns() - _origin
+    add(_program, "process", _origin, total)
+    trace_file = _trace_file or state_path("traces", f"{_program}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+    try:
+        with open(trace_file, "w") as f:
+            json.dump(chrome_trace(), f)
+    except OSError as e:
+        trace_file = f"not written ({e})"
+    out.write(f"profile {summary(total)}; trace {trace_file}\n")
+    out.flush()
@@ -1,46 +1,136 @@
-import sys, pathlib, argparse, time, docker, yaml, platform, os, copy, subprocess, atexit, readline
+import sys, pathlib, argparse, time, platform, os, copy, subprocess, codecs
 from io import BytesIO
 from dockipy.__about__ import __version__ as dockipy_version
-import libtmux
+from dockipy import image_cache, buildlog, pip_cache, venv_lock, venv_store, tracing, resources
+from dockipy.sizes import parse_size, format_size
+from dockipy.client import get_client
+from dockipy.config import find_project_root, load_config, ConfigError
 
-class HostManager:
-    def __init__(self, tmux_session, host, id):
+def send_keys(pane, keys):
+    return ["send-keys", "-t", pane, keys, "Enter"]
+
+class TmuxFleet:
+    def __init__(self, session_name, hosts, connect="ssh {host}", server=None):
         """
-        Initialize a HostManager for a specific host.
+        One tmux pane per host in a single window. Creating the panes and typing
+        into all of them are each done in one tmux invocation instead of a round
+        trip per pane.
 
         Args:
-            server (libtmux.Server): The tmux server instance.
-            tmux_session (str): The tmux session name.
-            host (str): The hostname or IP of the target machine.
+            session_name (str): The tmux session to create.
+            hosts (list): The remote.hosts entries of docki.yaml.
+            connect (str): Command typed into every pane, {host} is the host name.
+            server (libtmux.Server): The tmux server, the default server if None.
+        """
+        if server is None:
+            import libtmux
+            server = libtmux.Server()
+        self.server = server
+        self.session_name = session_name
+        self.hosts = hosts
+        self.panes = self._create_panes(connect)
+
+    def batch(self, commands):
+        """
+        Run tmux commands in one tmux call, separated by ';'. Returns the output lines.
         """
-        self.host = host
-        self.id = id
-        self.session = tmux_session
-        self.pane = self._get_or_create_pane()
+        args = []
+        for command in commands:
+            if len(args) > 0:
+                args.append(";")
+            # tmux ends a command at an argument ending in ';', a trailing \; is a literal ';'
+            args += [arg[:-1] + "\\;" if arg.endswith(";") else arg for arg in command]
+        result = self.server.cmd(*args)
+        if result.returncode != 0:
+            raise RuntimeError(f"tmux failed: {' '.join(result.stderr)}")
+        return result.stdout
+
+    def _create_panes(self, connect):
+        # a large detached window so that 64 tiled panes still fit, it shrinks on attach
+        commands = [["new-session", "-d", "-s", self.session_name, "-x", "400", "-y", "200", "-P", "-F", "#{pane_id}"]]
+        for _host in self.hosts[1:]:
+            commands.append(["split-window", "-t", self.session_name, "-P", "-F", "#{pane_id}"])
+            commands.append(["select-layout", "-t", self.session_name, "tiled"])
+        panes = self.batch(commands)
+        keys = []
+        for pane, host in zip(panes, self.hosts):
+            keys.append(send_keys(pane, connect.format(host=host["name"])))
+            if "workspace" in host:
+                keys.append(send_keys(pane, f"cd {host['workspace']}"))
+        self.batch(keys)
+        return panes
+
+    def broadcast(self, command):
+        self.batch([send_keys(pane, command) for pane in self.panes])
 
-    def _get_or_create_pane(self):
+    def close(self):
+        self.batch([["kill-session", "-t", self.session_name]])
 
-        # Create a new pane for the host
-        if len(self.session.windows) == 0:
-            window = self.session.new_window(attach=False)
-        else:
-            window = self.session.active_window
-        
-        if self.id == 0:
-            pane = window.panes[self.id]
-        else:
-            pane = window.split()
 
-        window.select_layout("tiled")
-        pane.send_keys(f"ssh {self.host}")
-        return pane
 
-    def send_command(self, command):
-        self.pane.send_keys(command)
+APT_CACHE_MOUNTS = "--mount=type=cache,target=/var/cache/apt,sharing=locked \\\n    --mount=type=cache,target=/var/lib/apt/lists,sharing=locked"
 
-    def close(self):
-        self.pane.kill()
 
+def apt_layers(system_dep, layer_size=8):
+    """
+    Group system dependencies into install layers.
+
+    Plain entries are chunked in the order they appear in docki.yaml, so appending
+    a package only rebuilds the last layer. A nested list is always its own layer,
+    use it to pin rarely changing groups (e.g. the python toolchain) up front.
+    """
+    layers, chunk = [], []
+    for dep in system_dep:
+        if isinstance(dep, list):
+            if len(chunk) > 0:
+                layers.append(chunk)
+                chunk = []
+            layers.append(list(dep))
+            continue
+        chunk.append(dep)
+        if len(chunk) == layer_size:
+            layers.append(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        layers.append(chunk)
+    return [sorted(layer) for layer in layers]
+
+
+def flat_apt_str(system_dep):
+    packages = []
+    for dep in system_dep:
+        packages.extend(dep if isinstance(dep, list) else [dep])
+    return f'''RUN apt-get update && \
+    apt-get install -y --no-install-recommends software-properties-common && \
+    add-apt-repository -y universe && \
+    add-apt-repository -y ppa:deadsnakes/ppa 
+
+RUN apt-get update && \
+    apt-get install -y --no-install-recommends \
+    sudo {' '.join(packages)} && \
+    apt-get clean && \
+    rm -rf /var/lib/apt/lists/*
+'''
+
+
+def layered_apt_str(system_dep, layer_size=8):
+    # keep downloaded packages, the cache mounts are not part of the image
+    apt_str = f'''RUN rm -f /etc/apt/apt.conf.d/docker-clean && \
+    echo 'Binary::apt::APT::Keep-Downloaded-Packages "true";' > /etc/apt/apt.conf.d/keep-cache
+
+RUN {APT_CACHE_MOUNTS} \
+    apt-get update && \
+    apt-get install -y --no-install-recommends software-properties-common sudo && \
+    add-apt-repository -y universe && \
+    add-apt-repository -y ppa:deadsnakes/ppa
+'''
+    for layer in apt_layers(system_dep, layer_size):
+        apt_str += f'''
+RUN {APT_CACHE_MOUNTS} \
+    apt-get update && \
+    apt-get install -y --no-install-recommends {' '.join(layer)}
+'''
+    return apt_str
 
 
 def build_dockerfile(
@@ -50,26 +140,25 @@ def build_dockerfile(
     project_root: str = "/",
     user_id: int = 1000,
     group_id: int = 1000,
+    layered: bool = False,
+    layer_size: int = 8,
 ):  
     system_commands_str = ""
     if len(system_commands) > 0:
         system_commands_str = "RUN " + " && ".join(system_commands)
-    return f'''FROM {base_image}
+    syntax_str = ""
+    if layered:
+        # RUN --mount needs the BuildKit dockerfile frontend
+        syntax_str = "# syntax=docker/dockerfile:1\n"
+        apt_str = layered_apt_str(system_dep, layer_size)
+    else:
+        apt_str = flat_apt_str(system_dep)
+    return f'''{syntax_str}FROM {base_image}
 
 # Avoid interactive prompts
 ENV DEBIAN_FRONTEND=noninteractive LANG=C.UTF-8 LC_ALL=C.UTF-8
 
-RUN apt-get update && \
-    apt-get install -y --no-install-recommends software-properties-common && \
-    add-apt-repository -y universe && \
-    add-apt-repository -y ppa:deadsnakes/ppa 
-
-RUN apt-get update && \
-    apt-get install -y --no-install-recommends \
-    sudo {' '.join(system_dep)} && \
-    apt-get clean && \
-    rm -rf /var/lib/apt/lists/*
-
+{apt_str}
 # Add system commands
 {system_commands_str}
 # if needed to add user and group
@@ -157,13 +246,82 @@ def docki():
         )
     argparser.add_argument("--init", action="store_true", help="Create a docki.yaml file in the project root")
     argparser.add_argument("--remote", action="store_true", help="Opens a one to many remote connection on hosts specified in the docki.yaml file")
+    argparser.add_argument("--sync", action="store_true", help="With --remote, copy the files of the project that changed since the last sync to the workspace of every host (runs before --run or --map)")
+    argparser.add_argument("--push-image", action="store_true", help="With --remote, build the image locally and load it on every host, sending only the layers a host does not have yet")
+    argparser.add_argument("--run", metavar="COMMAND", help="With --remote, run COMMAND on all hosts at once without tmux and report the exit codes")
+    argparser.add_argument("--map", metavar="JOBS_FILE", help="With --remote, spread the commands in JOBS_FILE (one per line) over the hosts, using the slots of every host")
+    argparser.add_argument("--retries", type=int, help="With --map, how often a failed job is retried on another host (default 2)")
+    argparser.add_argument("--timeout", type=float, help="With --run or --map, seconds before a command is given up")
+    argparser.add_argument("--cache-report", action="store_true", help="Show how often docki images were reused instead of rebuilt")
+    argparser.add_argument("--pip-cache", action="store_true", help="Show the size of the pip cache shared by all docki projects")
+    argparser.add_argument("--pip-cache-evict", metavar="SIZE", help="Remove the least recently used files from the shared pip cache until it is at most SIZE (e.g. 10G, 0 clears it)")
+    argparser.add_argument("--venv-store", action="store_true", help="Show the venvs in the store shared by envipy and envibook (venv_store: true) and the projects linked to them")
+    argparser.add_argument("--venv-store-gc", action="store_true", help="Remove the venvs in the store that no project links to anymore")
+    argparser.add_argument("--export-bundle", metavar="PATH", help="Build the image and write it, a wheelhouse of python_dep and a manifest with hashes to a bundle at PATH for hosts without internet")
+    argparser.add_argument("--import-bundle", metavar="PATH", help="Verify and load a bundle from --export-bundle without network access, skipping what is already there")
     args = argparser.parse_args()
     project_root = pathlib.Path(".").resolve()
     if args.init:
         docki_init(project_root)
+    if args.cache_report:
+        image_cache.cache_report()
+    if args.pip_cache or args.pip_cache_evict is not None:
+        budget = None
+        if args.pip_cache_evict is not None:
+            try:
+                budget = parse_size(args.pip_cache_evict)
+            except ValueError:
+                print(f"Invalid size {args.pip_cache_evict!r}, use e.g. --pip-cache-evict 10G, 512M or 0 to clear the cache.")
+                sys.exit(1)
+        work_dir, config_root, target_root = find_project_root()
+        docki_config = {}
+        if config_root is not None and (pathlib.Path(config_root) / "docki.yaml").exists():
+            docki_config = get_docki_config(config_root)
+        if budget is not None:
+            pip_cache.evict(docki_config, budget)
+        else:
+            pip_cache.report(docki_config)
+    if args.venv_store_gc:
+        entries, objects, freed = venv_store.collect()
+        print(f"venv store: removed {entries} venvs and {objects} files, freed {format_size(freed)}.")
+    if args.venv_store:
+        venv_store.report()
+    if args.export_bundle is not None or args.import_bundle is not None:
+        from dockipy import bundle
+        work_dir, config_root, target_root = find_project_root()
+        docki_config = get_docki_config(config_root)
+        try:
+            if args.export_bundle is not None:
+                bundle.export_bundle(args.export_bundle, docki_config, config_root, target_root)
+            else:
+                bundle.import_bundle(args.import_bundle, docki_config, config_root, target_root)
+        except (ValueError, RuntimeError) as e:
+            print(e)
+            exit(1)
     if args.remote:
+        # asyncio is only needed for the remote commands
+        from dockipy import remote, sync, image_push
         work_dir, project_root, target_root = find_project_root()
         docki_config = get_docki_config(project_root, remote=True)
+        if args.sync:
+            failed = sync.docki_sync(docki_config, project_root)
+            if failed > 0 or (not args.push_image and args.run is None and args.map is None):
+                exit(1 if failed > 0 else 0)
+        if args.push_image:
+            if "base_image" not in docki_config:
+                print("--push-image needs base_image in docki.yaml to build the image.")
+                exit(1)
+            tag = build_docker_image(target_root, docki_config)
+            diff_ids = get_client().images.get(tag).attrs["RootFS"]["Layers"]
+            failed = image_push.docki_push(docki_config, tag, diff_ids)
+            if failed > 0 or (args.run is None and args.map is None):
+                exit(1 if failed > 0 else 0)
+        if args.run is not None:
+            failed = remote.docki_run(docki_config, args.run, args.timeout)
+            exit(1 if failed > 0 else 0)
+        if args.map is not None:
+            failed = remote.docki_map(docki_config, args.map, args.retries, args.timeout)
+            exit(1 if failed > 0 else 0)
         docki_remote(docki_config)
 
 def launch_terminal_with_tmux(session_name):
@@ -193,6 +351,7 @@ def setup_readline():
     """
     Set up readline for command history and advanced input support.
     """
+    import readline, atexit
     # Load command history if available
     if os.path.exists(HISTORY_FILE):
         readline.read_history_file(HISTORY_FILE)
@@ -203,59 +362,45 @@ def setup_readline():
     # Enable tab completion (optional)
     readline.parse_and_bind("tab: complete")
 
-def create_session(tmux_session):
-    server = libtmux.Server()
+def unique_session_name(tmux_session, server=None):
+    if server is None:
+        import libtmux
+        server = libtmux.Server()
+    # fails without a running tmux server, then there are no sessions
+    existing = set(server.cmd("list-sessions", "-F", "#{session_name}").stdout)
     session_name = tmux_session
     found = 1
-    for session in server.sessions:
-        if session.session_name == session_name:
-            session_name = f"{tmux_session}_{found}"
-            found += 1
-    return server.new_session(session_name=session_name), session_name
+    while session_name in existing:
+        session_name = f"{tmux_session}_{found}"
+        found += 1
+    return session_name
 
 
 def docki_remote(docki_config):
     
     setup_readline()
 
-    
-    tmux_session, session_name = create_session(docki_config["tag"])
-    host_managers = []
-    for id, host in enumerate(docki_config["remote"]["hosts"]):
-        host_manager = HostManager(tmux_session, host["name"], id)
-        if "workspace" in host:
-            host_manager.send_command(f"cd {host['workspace']}")
-        host_managers.append(host_manager)
+    session_name = unique_session_name(docki_config["tag"])
+    fleet = TmuxFleet(session_name, docki_config["remote"]["hosts"])
     print("Connected to remote hosts.")
     launch_terminal_with_tmux(session_name)
-    while True:
-        try:
-            command = input(f"(remote) {session_name}> ")
-            if command == "exit":
-                break
-            for manager in host_managers:
-                manager.send_command(command)
-        except KeyboardInterrupt:
-            # send ctrl+c to all panes
-            for manager in host_managers:
-                manager.send_command("C-c")
-    for manager in host_managers:
-        manager.close()
+    try:
+        while True:
+            try:
+                command = input(f"(remote) {session_name}> ")
+                if command == "exit":
+                    break
+                fleet.broadcast(command)
+            except KeyboardInterrupt:
+                # send ctrl+c to all panes
+                fleet.broadcast("C-c")
+            except RuntimeError as e:
+                print(e)
+    finally:
+        fleet.close()
     print("Disconnected from remote hosts.")
 
 
-def find_project_root():
-    files_to_find = ["docki.yaml", "requirements.txt", "pyproject.toml", ".git"]
-    current_dir = pathlib.Path(".").resolve()
-    path = []
-    while current_dir != current_dir.parent:
-        path.insert(0, current_dir.name)
-        for file in files_to_find:
-            if (current_dir / file).exists():
-                return "/"+"/".join(path), str(current_dir), f"/{current_dir.name}"
-        current_dir = current_dir.parent
-    return None, None, None
-
 def get_runtime(base_image):
     if "cuda" in base_image:
         return "nvidia"
@@ -263,22 +408,69 @@ def get_runtime(base_image):
         return "nvidia"
     return None
 
-def print_logs(container):
-    first = True
-    while container.status == "running" or first:
-        first = False
-        for line in container.logs(stream=True):
-            try:
-                print(line.decode('utf-8'), end="") 
-            except KeyboardInterrupt:
-                return
-            except:
-                pass
-        time.sleep(0.1)
-        try:
-            container.reload()
-        except:
-            return
+def log_chunks(container, chunk_size=64 * 1024, since=None):
+    """
+    Follow the output of a container with a single attach, from since (a unix
+    time) when it is given.
+
+    docker-py reads tty logs one byte at a time, large chunks are requested
+    through its internals while they are there. Without them the public API
+    is used and its bytes are joined into lines.
+    """
+    since_kwargs = {"since": since} if since is not None else {}
+    if not container.attrs.get("Config", {}).get("Tty", False):
+        return container.logs(stream=True, follow=True, **since_kwargs)
+    api = container.client.api
+    if not all(hasattr(api, name) for name in ("_get", "_url", "_stream_raw_result")):
+        return joined_lines(container.logs(stream=True, follow=True, **since_kwargs), chunk_size)
+    response = api._get(api._url("/containers/{0}/logs", container.id), params={"stdout": 1, "stderr": 1, "follow": 1, **since_kwargs}, stream=True)
+    try:
+        return api._stream_raw_result(response, chunk_size=chunk_size)
+    except TypeError:
+        # a docker-py release that changed the signature
+        response.close()
+        return joined_lines(container.logs(stream=True, follow=True, **since_kwargs), chunk_size)
+
+def joined_lines(chunks, chunk_size=64 * 1024):
+    """
+    Join single bytes into lines, or chunks of chunk_size, so each does not cost
+    a decode, write and flush. A line without an end is held until it ends.
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        if len(pending) >= chunk_size or b"\n" in chunk or b"\r" in chunk:
+            yield bytes(pending)
+            pending.clear()
+    if len(pending) > 0:
+        yield bytes(pending)
+
+def write_chunks(chunks, out, first_output=False):
+    # characters split across two chunks are joined by the incremental decoder
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    written = 0
+    for chunk in chunks:
+        if written == 0 and first_output:
+            tracing.instant("first output")
+        out.write(decoder.decode(chunk))
+        out.flush()
+        written += len(chunk)
+    out.write(decoder.decode(b"", final=True))
+    out.flush()
+    return written
+
+@tracing.traced("logs")
+def print_logs(container, out=None, since=None, first_output=False):
+    """
+    Print the container output until it stops and return its exit code.
+    first_output marks the first output of the script in the --profile trace.
+    """
+    import docker
+    write_chunks(log_chunks(container, since=since), out if out is not None else sys.stdout, first_output)
+    try:
+        return container.wait().get("StatusCode")
+    except docker.errors.NotFound:
+        return None
 
 def get_docki_config(project_root, remote=False):
     if project_root is None:
@@ -291,8 +483,15 @@ def get_docki_config(project_root, remote=False):
         docki_init(project_root)
         print("Please verify the docki.yaml file and run the script again.")
         exit(1)
-    docki_content = docki_file.read_text()
-    docki_config = yaml.safe_load(docki_content)
+    try:
+        docki_config, warnings = load_config(docki_file)
+    except ConfigError as e:
+        print("Invalid docki.yaml:")
+        for error in e.errors:
+            print(f"  {error}")
+        exit(1)
+    for warning in warnings:
+        print(f"Warning: {warning}")
     missing_values = []
     if remote:
         if "remote" not in docki_config:
@@ -327,15 +526,67 @@ def get_user():
         return "1000:1000" 
 
 
-def build_docker_image(project_root, config, clean=False, output=False):
-    base_image = config.get("base_image")
-    system_dep = config.get("system_dep")
+def build_with_cli(dockerfile, tag, labels, clean, progress):
+    cmd = ["docker", "builder", "build", "--progress=plain", "-t", tag]
+    for key, value in labels.items():
+        cmd += ["--label", f"{key}={value}"]
+    cmd.append("-")
+    if clean:
+        cmd.insert(3, "--no-cache")
+    print(f"Running the command: {' '.join(cmd)}")
+    process = subprocess.Popen(
+      cmd,
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT,  # BuildKit reports progress on stderr.
+      text=True,
+      encoding="utf-8",
+      errors="replace",
+      )
+    try:
+        process.stdin.write(dockerfile)
+        process.stdin.close()
+        for line in process.stdout:
+            progress.feed(line)
+        return process.wait() == 0
+    except KeyboardInterrupt:
+        process.kill()
+        process.wait()
+        raise
+
+def build_with_api(client, dockerfile, tag, labels, clean, progress):
+    import docker
+    print(f"Building {tag} through the docker API...")
+    try:
+        for chunk in client.api.build(fileobj=BytesIO(dockerfile.encode("utf-8")), tag=tag, labels=labels,
+                                      nocache=clean, rm=True, forcerm=True, decode=True):
+            for line in chunk.get("stream", "").splitlines():
+                progress.feed(line)
+            if "error" in chunk:
+                progress.feed(chunk["error"])
+                return False
+    except docker.errors.APIError as e:
+        progress.feed(str(e))
+        return False
+    return True
+
+def image_dockerfile(project_root, config):
+    """
+    The tag of the image and the Dockerfile it is built from.
+    """
     tag = config.get("tag", "docki_image")
     uid, gid = get_user().split(":")
     if ":latest" not in tag:
         tag += ":latest"
-    system_commands = config.get("system_commands", [])
-    dockerfile = build_dockerfile(base_image, system_dep, system_commands, project_root, uid, gid)
+    dockerfile = build_dockerfile(config.get("base_image"), config.get("system_dep"), config.get("system_commands", []),
+                                  project_root, uid, gid, config.get("layered", False), config.get("layer_size", 8))
+    return tag, dockerfile
+
+@tracing.traced("build")
+def build_docker_image(project_root, config, clean=False, output=False, out=None):
+    base_image = config.get("base_image")
+    layered = config.get("layered", False)
+    tag, dockerfile = image_dockerfile(project_root, config)
     if output:
         with open("Dockerfile", "w") as f:
             f.write(dockerfile)
@@ -345,37 +596,43 @@ def build_docker_image(project_root, config, clean=False, output=False):
             else:
                 f.write(f"docker bulder build -t {tag} - < Dockerfile")
         return None, None
+    client = get_client()
+    fingerprint = image_cache.image_fingerprint(dockerfile, image_cache.base_image_digest(client, base_image))
+    if not clean and image_cache.find_cached_image(client, tag, fingerprint) is not None:
+        image_cache.record_build(tag, fingerprint, hit=True)
+        print(f"Image {tag} is up to date.")
+        return tag
     print(f"Building the Docker image based on {base_image}...")
     # pathlib.Path("/tmp/docki").mkdir(parents=True, exist_ok=True)
-    cmd = ["docker", "builder", "build", "-t", tag, "-"]
-    if clean:
-        cmd.insert(3, "--no-cache")
-    print(f"Running the command: {' '.join(cmd)}")
-    result = subprocess.run(
-      cmd,
-      input=dockerfile,
-      text=True,          # Treat input and output as text.
-      capture_output=True,  # Capture the output.
-      )
-    if result.returncode != 0:
+    labels = {image_cache.FINGERPRINT_LABEL: fingerprint}
+    # BuildKit, and the build cache it keeps, is only reachable through the CLI,
+    # the API builder is the legacy one and is opt-in
+    builder = config.get("builder", "cli")
+    if builder == "api" and layered:
+        print("Warning: layered builds need BuildKit cache mounts, building with the docker CLI.")
+        builder = "cli"
+    start = time.time()
+    progress = buildlog.BuildProgress(out=out)
+    if builder == "api":
+        success = build_with_api(client, dockerfile, tag, labels, clean, progress)
+    else:
+        success = build_with_cli(dockerfile, tag, labels, clean, progress)
+    progress.finish()
+    if not success:
         print("An error occurred while building the image:")
-        print(result.stdout)
-        print("Error message:")
-        print(result.stderr)
+        progress.print_tail()
         exit(1)
+    image_cache.record_build(tag, fingerprint, hit=False, build_time=time.time() - start)
     print(f"Image {tag} has been built.")
 
     return tag
 
-def run_container(tag, command, config, work_dir, project_root, target_root, output=False):
-    shm_size = config.get("shm_size", "16G")
-    base_image = config["base_image"]
-    tag = config.get("tag")
-    init_commands = config.get("init_commands", [])
+def venv_dir(config):
+    # matrix variants each get their own venv next to the default one
+    return config.get("venv_dir", "venv")
 
-    volumes = get_volumes(project_root, target_root)
-    user = get_user()
-    runtime = get_runtime(base_image)
+def shell_command(command, config, target_root):
+    init_commands = config.get("init_commands", [])
     if len(init_commands) > 0:
         init_commands_str = " && ".join(init_commands) + " && " 
     else:
@@ -384,9 +641,23 @@ def run_container(tag, command, config, work_dir, project_root, target_root, out
     command = ' '.join(command)
     env = ""
     if "python_dep" in config:
-        env = f'export PATH={target_root}/venv/bin:$PATH && '
-    command = f'{env} {init_commands_str} {command}'
-    command = f'bash -c "{command}"'
+        env = f'export PATH={target_root}/{venv_dir(config)}/bin:$PATH && '
+    return f'{env} {init_commands_str} {command}'
+
+@tracing.traced("container")
+def run_container(tag, command, config, work_dir, project_root, target_root, output=False, limits=None, environment=None, name=None, labels=None):
+    """
+    Start command in a container of the image. limits is one entry of
+    resources.plan, by default the cpuset, memory and shm_size of docki.yaml.
+    """
+    limits = limits if limits is not None else resources.plan(config)[0]
+    base_image = config["base_image"]
+    name = name if name is not None else config.get("tag")
+
+    volumes = get_volumes(project_root, target_root)
+    user = get_user()
+    runtime = get_runtime(base_image)
+    command = f'bash -c "{shell_command(command, config, target_root)}"'
     if output:
         with open("run.sh", "w") as f:
             work_dir = f"cd {work_dir}"
@@ -394,13 +665,13 @@ def run_container(tag, command, config, work_dir, project_root, target_root, out
         volume_str = " ".join([f"-v {key}:{value['bind']}" for key, value in volumes.items()])
         if volume_str != "":
             volume_str += "-v "
-        start_docker = f"docker run -it --rm --shm-size={shm_size} --network=host --user {user} {volume_str} -w {target_root} --runtime={runtime} {tag} /bin/bash"
+        start_docker = f"docker run -it --rm {resources.cli_flags(limits)} --network=host --user {user} {volume_str} -w {target_root} --runtime={runtime} {config.get('tag')} /bin/bash"
         with open("start.sh", "w") as f:
             f.write(start_docker)
 
         return None
     # Run a container from the image
-    client = docker.from_env()
+    client = get_client()
 
     print(f"Running the command: {command}")
 
@@ -411,18 +682,39 @@ def run_container(tag, command, config, work_dir, project_root, target_root, out
                                         stderr=True,
                                         tty=True,
                                         # remove=True,
-                                        shm_size=shm_size,
                                         network_mode="host",
                                         detach = True,
                                         user=user,
                                         volumes=volumes,
                                         working_dir=work_dir,
                                         runtime=runtime,
-                                        name=tag,
+                                        name=name,
+                                        environment=environment,
+                                        labels=labels,
+                                        **resources.run_kwargs(limits),
                                         )
     return container
 
-def setup_venv(project_root, target_root, tag, config, clean=False, output=False):
+def requirement_lines(project_root, config):
+    """
+    The lines of python_dep, read from the requirements file when it names one.
+    None when the file does not exist.
+    """
+    python_dep = config.get("python_dep")
+    if isinstance(python_dep, dict):
+        requirements = pathlib.Path(project_root) / python_dep["file"]
+        if not requirements.exists():
+            return None
+        return requirements.read_text().split("\n")
+    return python_dep
+
+@tracing.traced("venv")
+def setup_venv(project_root, target_root, tag, config, clean=False, output=False, out=None, wheelhouse=None):
+    """
+    Create or update the venv of the project in a container of the image.
+    wheelhouse is a host directory of wheels that are installed without the
+    index when they cover the requirements.
+    """
     python_dep = config.get("python_dep")
     base_image = config.get("base_image")
     tag = config.get("tag")
@@ -436,40 +728,112 @@ def setup_venv(project_root, target_root, tag, config, clean=False, output=False
             python_dep = requirements.read_text().split("\n")
     else:
         requirements_cmd = " ".join(python_dep)
-    docki_lock_file = pathlib.Path(f"{project_root}/venv/docki.lock")
-    locked_python_dep = []
-    if docki_lock_file.exists():
-        locked_python_dep = yaml.safe_load(docki_lock_file.read_text()).get("python_dep")
-    if set(locked_python_dep) != set(python_dep) or output:
-        volumes = get_volumes(project_root, target_root)
-        user = get_user()
-        runtime = get_runtime(base_image)
-        if output:
-            with open("seup_venv.sh", "w") as f:
-                f.write(f'python3 -m venv {target_root}/venv; {target_root}/venv/bin/pip install {requirements_cmd}')
-            return
-        print("Building the virtual environment and installing the requirements...")
-        client = docker.from_env()
-
-        container = client.containers.run(tag,
-                                            f'bash -c "python3 -m venv {target_root}/venv; {target_root}/venv/bin/pip install {requirements_cmd}"',
-                                            stdout=True,
-                                            stderr=True,
-                                            tty = True,
-                                            remove=True,
-                                            detach = True,
-                                            user=user,
-                                            volumes=volumes,
-                                            working_dir=target_root,
-                                            runtime=runtime,
-                                            name=tag,
-                                            )
-        print_logs(container)
-        docki_lock_content = copy.deepcopy(config)
-        docki_lock_content["python_dep"] = python_dep
-        docki_lock_file.write_text(yaml.safe_dump(docki_lock_content))
+    venv = venv_dir(config)
+    docki_lock_file = pathlib.Path(f"{project_root}/{venv}/docki.lock")
+    if output:
+        with open("seup_venv.sh", "w") as f:
+            f.write(f'python3 -m venv {target_root}/{venv}; {target_root}/{venv}/bin/pip install {requirements_cmd}')
+        return
+    client = get_client()
+    lock = venv_lock.load_lock(docki_lock_file)
+    base_digest = image_cache.base_image_digest(client, base_image)
+    image_id = client.images.get(tag).id
+    if lock.get("image_id") == image_id and lock.get("interpreter") is not None:
+        interpreter = lock["interpreter"]
     else:
+        # the image changed, ask it which python it ships
+        interpreter = client.containers.run(tag, ["python3", "-c", "import platform; print(platform.python_version())"], remove=True).decode().strip()
+    action, install, uninstall = venv_lock.plan_update(lock, python_dep, interpreter, base_digest)
+    if action == "none":
         print("Requirements already installed.")
+        return
+    volumes = get_volumes(project_root, target_root)
+    user = get_user()
+    runtime = get_runtime(base_image)
+    if action == "full":
+        print("Building the virtual environment and installing the requirements...")
+    else:
+        print(f"Updating the virtual environment: {len(install)} to install, {len(uninstall)} to remove...")
+    find_links = None
+    if wheelhouse is not None:
+        from dockipy.prefetch import CONTAINER_WHEELHOUSE
+        find_links = CONTAINER_WHEELHOUSE
+        volumes[str(wheelhouse)] = {"bind": find_links, "mode": "ro"}
+    commands = venv_lock.update_commands(f"{target_root}/{venv}/bin/pip", action, install, uninstall,
+                                         f"python3 -m venv --clear {target_root}/{venv}", requirements_cmd, find_links)
+    cache_volumes, environment = pip_cache.cache_mount(client, config, tag)
+    volumes.update(cache_volumes)
+
+    container = client.containers.run(tag,
+                                        ["bash", "-c", "; ".join(commands)],
+                                        stdout=True,
+                                        stderr=True,
+                                        tty = True,
+                                        detach = True,
+                                        user=user,
+                                        volumes=volumes,
+                                        environment=environment,
+                                        working_dir=target_root,
+                                        runtime=runtime,
+                                        name=tag,
+                                        )
+    try:
+        exit_code = print_logs(container, out)
+    finally:
+        container.remove(force=True)
+    if exit_code != 0:
+        print(f"Installing the requirements failed with exit code {exit_code}.")
+        exit(1)
+    venv_lock.write_lock(docki_lock_file, config, python_dep, interpreter, base_digest, image_id)
+
+
+@tracing.traced("venv")
+def setup_local_venv(project_root, config):
+    """
+    Create or update {project_root}/venv on the host for envipy and envibook.
+    Returns False when the requirements can not be found or installed.
+    """
+    python_dep = config.get("python_dep")
+    if "file" in python_dep:
+        requirements = project_root / python_dep.get("file")
+        if not requirements.exists():
+            print(f"Requirements file {requirements} not found")
+            return False
+        else:
+            requirements_cmd = f"-r {requirements}"
+            python_dep = requirements.read_text().split("\n")
+    else:
+        requirements_cmd = " ".join(python_dep)
+    if platform.system() == "Windows":
+        python, pip = "python", f"{project_root}/venv/Scripts/pip"
+    else:
+        python, pip = "python3", f"{project_root}/venv/bin/pip"
+    docki_lock_file = project_root / "venv/docki.lock"
+    probe = subprocess.run([python, "-c", "import platform, sys; print(platform.python_version()); print(sys.executable)"], capture_output=True, text=True).stdout.split("\n")
+    interpreter, executable = probe[0].strip(), probe[1].strip() if len(probe) > 1 else python
+    lock = venv_lock.load_lock(docki_lock_file)
+    if venv_store.enabled(config) and venv_store.storable(python_dep):
+        key = venv_store.setup(project_root / "venv", python, lock, python_dep, requirements_cmd, interpreter, executable)
+        if key is None:
+            return False
+        if lock.get("store_key") != key:
+            venv_lock.write_lock(docki_lock_file, config, python_dep, interpreter, store_key=key)
+        return True
+    action, install, uninstall = venv_lock.plan_update(lock, python_dep, interpreter)
+    if action == "none":
+        return True
+    if action == "full":
+        print("Building the virtual environment and installing the requirements...")
+    else:
+        print(f"Updating the virtual environment: {len(install)} to install, {len(uninstall)} to remove...")
+    for command in venv_lock.update_commands(pip, action, install, uninstall, f"{python} -m venv --clear {project_root}/venv", requirements_cmd):
+        exit_code = subprocess.run(command, shell=True).returncode
+        if exit_code != 0:
+            # without a new lock the next run tries again
+            print(f"Installing the requirements failed with exit code {exit_code}.")
+            return False
+    venv_lock.write_lock(docki_lock_file, config, python_dep, interpreter)
+    return True
 
 help = f"""dockipy version {dockipy_version} 
 Replace python with dockipy to run your python script in a Docker container.
@@ -486,12 +850,20 @@ usage:
         --remote    Opens a one to many remote connection on hosts specified in the docki.yaml file.
         --clean     Remove the Docker container after it has been stopped.
         --output    Output the Dockerfile, build.sh, run.sh, setup_venv.sh, and start.sh files.
+        --profile   Print the time spent in every phase and write a Chrome trace (or set DOCKI_PROFILE=1).
+        --replicas N  Start N containers of the command, each pinned to its own cpus with RANK and WORLD_SIZE set (dockipy, dockishell).
 
     commands:
         COMMAND     The command to run in the Docker container.
 """
+
 def argsparse():
+    """
+    Returns (command, remote, clean, output, replicas), replicas is the number
+    of containers dockipy and dockishell start.
+    """
     remote = False
+    replicas = 1
     clean = False
     output = False
     args = sys.argv
@@ -504,93 +876,125 @@ def argsparse():
     if args[1] == "--init":
         docki()
         exit(0)
-    if args[1] == "--remote":
-        remote = True
-        args = args[1:]
-    if args[1] == "--clean":
-        clean = True
-        args = args[1:]
-    if args[1] == "--output":
-        output = True
+    profile = tracing.requested()
+    # leading flags in any order, everything after them is the command
+    while len(args) > 1 and (args[1] in ("--remote", "--clean", "--output", "--profile", "--replicas") or args[1].startswith("--replicas=")):
+        if args[1].startswith("--replicas"):
+            value = args[1].split("=", 1)[1] if "=" in args[1] else (args[2] if len(args) > 2 else "")
+            if not value.isdigit() or int(value) < 1:
+                print(f"--replicas needs a number of containers, got {value!r}")
+                exit(1)
+            replicas = int(value)
+            args = args[1:] if "=" in args[1] else args[2:]
+            continue
+        remote = remote or args[1] == "--remote"
+        clean = clean or args[1] == "--clean"
+        output = output or args[1] == "--output"
+        profile = profile or args[1] == "--profile"
         args = args[1:]
+    if profile:
+        tracing.start(os.path.basename(sys.argv[0]))
     command = args[1:]
-    return command, remote, clean, output
+    return command, remote, clean, output, replicas
+
+def warm_name(tag):
+    return f"{tag}-warm"
+
+def notebook_name(tag):
+    return f"{tag}-notebook"
+
+def docki_containers(tag):
+    return [tag, warm_name(tag), notebook_name(tag)]
+
+# Set on the containers of dockipy --replicas, the value is the tag of the project.
+REPLICA_LABEL = "docki.replica_of"
+
+def docki_replicas(client, tag):
+    return client.containers.list(all=True, filters={"label": f"{REPLICA_LABEL}={tag}"})
 
 def dockikill():
+    import docker
     work_dir, project_root, target_root = find_project_root()
 
     docki_config = get_docki_config(project_root)
     tag = docki_config["tag"]
 
-    client = docker.from_env()
+    client = get_client()
 
-     # Try to get the container by its name
-    try:
-        container = client.containers.get(tag)
-        print(f"Found container {tag} with ID: {container.id}")
-        container.kill()
-        container.remove()
-        print(f"Container {tag} has been removed.")
-    except docker.errors.NotFound:
-        print(f"No container with the name {tag} found.")
-    except docker.errors.APIError as e:
-        print(f"An error occurred: {str(e)}")
+    for name in docki_containers(tag):
+        # Try to get the container by its name
+        try:
+            container = client.containers.get(name)
+            print(f"Found container {name} with ID: {container.id}")
+            container.kill()
+            container.remove()
+            print(f"Container {name} has been removed.")
+        except docker.errors.NotFound:
+            print(f"No container with the name {name} found.")
+        except docker.errors.APIError as e:
+            print(f"An error occurred: {str(e)}")
+    for container in docki_replicas(client, tag):
+        try:
+            container.kill()
+            container.remove()
+            print(f"Replica {container.name} has been removed.")
+        except docker.errors.APIError as e:
+            print(f"An error occurred: {str(e)}")
 
 
 def dockistop():
+    import docker
     work_dir, project_root, target_root = find_project_root()
 
     docki_config = get_docki_config(project_root)
     tag = docki_config["tag"]
 
-    client = docker.from_env()
+    client = get_client()
 
-    # Try to get the container by its name
-    try:
-        container = client.containers.get(tag)
-        print(f"Found container {tag} with ID: {container.id}")
-        container.stop()
-        container.remove()
-        print(f"Container {tag} has been removed.")
-    except docker.errors.NotFound:
-        print(f"No container with the name {tag} found.")
-    except docker.errors.APIError as e:
-        print(f"An error occurred: {str(e)}")
+    for name in docki_containers(tag):
+        # Try to get the container by its name
+        try:
+            container = client.containers.get(name)
+            print(f"Found container {name} with ID: {container.id}")
+            container.stop()
+            container.remove()
+            print(f"Container {name} has been removed.")
+        except docker.errors.NotFound:
+            print(f"No container with the name {name} found.")
+        except docker.errors.APIError as e:
+            print(f"An error occurred: {str(e)}")
+    for container in docki_replicas(client, tag):
+        try:
+            container.stop()
+            container.remove()
+            print(f"Replica {container.name} has been removed.")
+        except docker.errors.APIError as e:
+            print(f"An error occurred: {str(e)}")
 
 
 def dockiprune():
     # Prune the Docker system images, volumes, networks, and containers
-    freed_space = 0
-    client = docker.from_env()
-    # Prune the containers
+    from concurrent.futures import ThreadPoolExecutor
+    client = get_client()
     to_gb = 1024**3
-    containers = client.containers.prune()
-    freed_space_containers = containers.get("SpaceReclaimed", 0) / to_gb
-    print(f"Containers: Freed {freed_space_containers:.2f} GB of disk space.")
-    freed_space += freed_space_containers
-
-    # Prune the images
-    images = client.images.prune()
-    freed_space_images = images.get("SpaceReclaimed", 0) / to_gb
-    print(f"Images: Freed {freed_space_images:.2f} GB of disk space.")
-    freed_space += freed_space_images
-
-    # Prune the volumes
-    volumes = client.volumes.prune()
-    freed_space_volumes = volumes.get("SpaceReclaimed", 0)  / to_gb
-    print(f"Volumes: Freed {freed_space_volumes:.2f} GB of disk space.")
-    freed_space += freed_space_volumes
-
-    # Prune the networks
-    networks = client.networks.prune()
-    freed_space_networks = networks.get("SpaceReclaimed", 0) / to_gb
-    print(f"Networks: Freed {freed_space_networks:.2f} GB of disk space.")
-    freed_space += freed_space_networks
-
-    # Prune the build cache
-    build_cache = client.api.prune_builds()
-    freed_space_build_cache = build_cache.get("SpaceReclaimed", 0) / to_gb
-    print(f"Build cache: Freed {freed_space_build_cache:.2f} GB of disk space.")
-    freed_space += freed_space_build_cache
-
-    print(f"Total: Freed {freed_space:.2f} GB of disk space. (hopefully nobody was using it!)")
\ No newline at end of file
+
+    # the build cache does not depend on anything, images, volumes and networks
+    # are only unused once the stopped containers that use them are gone
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        build_cache = pool.submit(client.api.prune_builds)
+        results = [("Containers", client.containers.prune())]
+        futures = [
+            ("Images", pool.submit(client.images.prune)),
+            ("Volumes", pool.submit(client.volumes.prune)),
+            ("Networks", pool.submit(client.networks.prune)),
+            ("Build cache", build_cache),
+        ]
+        results += [(name, future.result()) for name, future in futures]
+    freed_space = 0
+    for name, result in results:
+        freed = (result.get("SpaceReclaimed") or 0) / to_gb
+        print(f"{name}: Freed {freed:.2f} GB of disk space.")
+        freed_space += freed
+
+    print(f"Total: Freed {freed_space:.2f} GB of disk space. (hopefully nobody was using it!)")
+    print("Use dockigc to only remove the least recently used docki images, venvs and build cache.")
\ No newline at end of file
@@ -0,0 +1,98 @@
+import copy, hashlib, re, shlex, pathlib
+
+REQUIREMENT_NAME = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def normalize(python_dep):
+    """
+    Requirement lines without comments, blanks and duplicates, in a stable order.
+    """
+    lines = set()
+    for line in python_dep:
+        line = str(line).split(" #", 1)[0].strip()
+        if line == "" or line.startswith("#"):
+            continue
+        lines.add(line)
+    return sorted(lines)
+
+
+def requirements_hash(python_dep):
+    return hashlib.sha256("\n".join(normalize(python_dep)).encode("utf-8")).hexdigest()
+
+
+def requirement_name(line):
+    match = REQUIREMENT_NAME.match(line)
+    if match is None:
+        return None
+    return match.group(1).lower().replace("_", "-")
+
+
+def load_lock(lock_file):
+    import yaml
+    lock_file = pathlib.Path(lock_file)
+    if not lock_file.exists():
+        return {}
+    return yaml.safe_load(lock_file.read_text()) or {}
+
+
+def write_lock(lock_file, config, python_dep, interpreter, base_digest=None, image_id=None, store_key=None):
+    import yaml
+    lock = copy.deepcopy(config)
+    lock["python_dep"] = python_dep
+    lock["requirements_hash"] = requirements_hash(python_dep)
+    lock["interpreter"] = interpreter
+    lock["base_image_digest"] = base_digest
+    lock["image_id"] = image_id
+    if store_key is not None:
+        lock["store_key"] = store_key
+    pathlib.Path(lock_file).write_text(yaml.safe_dump(lock))
+
+
+def plan_update(lock, python_dep, interpreter, base_digest=None):
+    """
+    Decide how to bring a venv from the lock to python_dep.
+
+    Returns (action, install, uninstall) where action is "none", "update" or
+    "full". A full rebuild only happens without a lock, when the interpreter or
+    the base image changed, or when pip options (-r, -e, --index-url...) changed.
+    Locks written by older versions have no interpreter or base image recorded
+    and are treated as matching.
+    """
+    if len(lock) == 0:
+        return "full", [], []
+    if lock.get("interpreter") not in (None, interpreter):
+        return "full", [], []
+    if base_digest is not None and lock.get("base_image_digest") not in (None, base_digest):
+        return "full", [], []
+    old = normalize(lock.get("python_dep") or [])
+    new = normalize(python_dep)
+    if lock.get("requirements_hash", requirements_hash(old)) == requirements_hash(new):
+        return "none", [], []
+    added = [line for line in new if line not in old]
+    removed = [line for line in old if line not in new]
+    if any(requirement_name(line) is None for line in added + removed):
+        return "full", [], []
+    kept = {requirement_name(line) for line in new}
+    uninstall = sorted({requirement_name(line) for line in removed} - kept)
+    return "update", added, uninstall
+
+
+def install_command(pip, requirements, find_links=None):
+    if find_links is None:
+        return f"{pip} install {requirements}"
+    # only the wheels in find_links, the index is only asked when they are not enough
+    return f"{{ {pip} install --no-index --find-links {find_links} {requirements} || {pip} install --find-links {find_links} {requirements}; }}"
+
+
+def update_commands(pip, action, install, uninstall, venv_cmd, requirements_cmd, find_links=None):
+    """
+    Shell commands that apply a plan from plan_update.
+    """
+    if action == "full":
+        return [venv_cmd, install_command(pip, requirements_cmd, find_links)]
+    commands = []
+    if len(uninstall) > 0:
+        commands.append(f"{pip} uninstall -y {' '.join(shlex.quote(name) for name in uninstall)}")
+    if len(install) > 0:
+        commands.append(install_command(pip, ' '.join(shlex.quote(line) for line in install), find_links))
+    return commands
@@ -0,0 +1,294 @@
+import os, json, time, shutil, hashlib, pathlib, platform, subprocess
+from dockipy import state, venv_lock
+from dockipy.sizes import format_size
+
+# Written into every stored venv, records where it was built and who links to it.
+STORE_FILE = "docki-store.json"
+# Requirements that depend on the project itself can not be shared.
+LOCAL_PREFIXES = ("-e", "--editable", "-r", "--requirement", "-c", "--constraint", ".", "/", "~", "file:")
+CHUNK_SIZE = 1024 * 1024
+
+
+def store_root():
+    return state.DOCKI_HOME / "venvs"
+
+
+def enabled(config):
+    if not config.get("venv_store", False):
+        return False
+    if platform.system() == "Windows":
+        print("venv_store is not supported on Windows, the venv is installed in the project.")
+        return False
+    return True
+
+
+def storable(python_dep):
+    return all(not line.startswith(LOCAL_PREFIXES) and " @ file:" not in line for line in venv_lock.normalize(python_dep))
+
+
+def store_key(python_dep, interpreter, executable):
+    content = json.dumps([venv_lock.normalize(python_dep), interpreter, executable, platform.machine()])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def env_path(key):
+    return store_root() / "envs" / key
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rewritten(relative):
+    # scripts and pyvenv.cfg contain the absolute path of the venv
+    parts = pathlib.PurePath(relative).parts
+    return len(parts) == 1 or parts[0] in ("bin", "Scripts")
+
+
+def dedupe(env):
+    """
+    Replace every file of env that is not rewritten by a hardlink to an object
+    in the store named by its content hash. Files that are already there cost no
+    extra space. Objects are read-only so a venv can not change them in place.
+
+    Returns (files, bytes) of the files that were already in the store.
+    """
+    env = pathlib.Path(env)
+    objects = store_root() / "objects"
+    shared, shared_bytes = 0, 0
+    for root, _dirs, names in os.walk(env):
+        for name in names:
+            file = os.path.join(root, name)
+            if os.path.islink(file) or rewritten(os.path.relpath(file, env)):
+                continue
+            stat = os.stat(file)
+            if stat.st_nlink > 1:
+                # linked from the previous entry, already an object
+                continue
+            digest = file_digest(file)
+            target = objects / digest[:2] / digest[2:]
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.chmod(file, stat.st_mode & 0o555)
+                os.link(file, target)
+            except FileExistsError:
+                tmp = f"{file}.docki-link"
+                os.link(target, tmp)
+                os.replace(tmp, file)
+                shared += 1
+                shared_bytes += os.path.getsize(file)
+    return shared, shared_bytes
+
+
+def link_tree(source, target, old_prefix, new_prefix):
+    """
+    Recreate the venv source at target with hardlinks. Files that mention
+    old_prefix are copied with it replaced by new_prefix. Files are copied when
+    the store and target are on different file systems.
+
+    Returns the number of (linked, copied) files.
+    """
+    source, target = pathlib.Path(source), pathlib.Path(target)
+    old, new = str(old_prefix).encode("utf-8"), str(new_prefix).encode("utf-8")
+    linked, copied = 0, 0
+    for root, dirs, names in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        os.makedirs(target / relative_root, exist_ok=True)
+        for name in dirs + names:
+            file = os.path.join(root, name)
+            relative = os.path.normpath(os.path.join(relative_root, name))
+            if relative == STORE_FILE:
+                continue
+            destination = target / relative
+            if os.path.islink(file):
+                os.symlink(os.readlink(file), destination)
+                continue
+            if name in dirs:
+                continue
+            if rewritten(relative):
+                content = pathlib.Path(file).read_bytes()
+                if old in content:
+                    destination.write_bytes(content.replace(old, new))
+                    shutil.copymode(file, destination)
+                    copied += 1
+                    continue
+            try:
+                os.link(file, destination)
+                linked += 1
+            except OSError:
+                shutil.copy2(file, destination)
+                copied += 1
+    return linked, copied
+
+
+def load_meta(env):
+    return state.load_json(pathlib.Path(env) / STORE_FILE, {})
+
+
+def references(env):
+    """
+    The project venvs that are still linked to env, a project that moved to
+    other requirements or deleted its venv no longer counts.
+    """
+    key = pathlib.Path(env).name
+    live = []
+    for venv in load_meta(env).get("projects", []):
+        lock = venv_lock.load_lock(pathlib.Path(venv) / "docki.lock") if os.path.exists(venv) else {}
+        if lock.get("store_key") == key:
+            live.append(venv)
+    return live
+
+
+def build_env(key, python, lock, python_dep, requirements_cmd, interpreter):
+    """
+    Install the requirements into a new store entry. When the requirements of
+    the previous store entry of the project are close, that entry is linked
+    and only the difference is installed.
+    """
+    env = env_path(key)
+    tmp = env.with_name(f".{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    base = env_path(lock["store_key"]) if lock.get("store_key") else None
+    action, install, uninstall = "full", [], []
+    if base is not None and base.exists():
+        action, install, uninstall = venv_lock.plan_update(lock, python_dep, interpreter)
+    if action == "update":
+        print(f"Building the virtual environment in the store from the previous one: {len(install)} to install, {len(uninstall)} to remove...")
+        link_tree(base, tmp, load_meta(base)["prefix"], tmp)
+    else:
+        print("Building the virtual environment in the store and installing the requirements...")
+    commands = venv_lock.update_commands(f"{tmp}/bin/pip", action, install, uninstall, f"{python} -m venv --clear {tmp}", requirements_cmd)
+    for command in commands:
+        if subprocess.run(command, shell=True).returncode != 0:
+            shutil.rmtree(tmp, ignore_errors=True)
+            print("Installing the requirements failed, nothing was added to the venv store.")
+            return False
+    shared, shared_bytes = dedupe(tmp)
+    if shared > 0:
+        print(f"{shared} files ({format_size(shared_bytes)}) were already in the venv store.")
+    state.save_json(tmp / STORE_FILE, {
+        "prefix": str(tmp), "requirements": venv_lock.normalize(python_dep), "interpreter": interpreter,
+        "created": time.time(), "projects": [],
+    })
+    try:
+        os.rename(tmp, env)
+    except OSError:
+        # another project built the same entry at the same time
+        shutil.rmtree(tmp, ignore_errors=True)
+    return True
+
+
+def setup(venv, python, lock, python_dep, requirements_cmd, interpreter, executable):
+    """
+    Make venv a linked copy of the store entry for python_dep, building the entry
+    when it does not exist yet.
+
+    Returns the store key, or None when the requirements could not be installed.
+    """
+    venv = pathlib.Path(venv).absolute()
+    key = store_key(python_dep, interpreter, executable)
+    if lock.get("store_key") == key and venv.exists():
+        return key
+    env = env_path(key)
+    if not env.exists() and not build_env(key, python, lock, python_dep, requirements_cmd, interpreter):
+        return None
+    start = time.time()
+    shutil.rmtree(venv, ignore_errors=True)
+    meta = load_meta(env)
+    linked, copied = link_tree(env, venv, meta["prefix"], venv)
+    meta["projects"] = sorted(set(meta.get("projects", [])) | {str(venv)})
+    meta["last_used"] = time.time()
+    state.save_json(env / STORE_FILE, meta)
+    print(f"Linked the virtual environment from the venv store in {time.time() - start:.1f}s ({linked} linked, {copied} copied).")
+    return key
+
+
+def tree_size(path):
+    """
+    Bytes of the files below path, a file with several links in path counts once.
+    """
+    seen, total = set(), 0
+    for root, _dirs, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+def entries():
+    envs = store_root() / "envs"
+    if not envs.exists():
+        return []
+    return sorted(path for path in envs.iterdir() if path.is_dir() and not path.name.startswith("."))
+
+
+def collect(dry_run=False, only=None):
+    """
+    Remove the store entries no project venv links to, then the objects that
+    nothing links to anymore. only limits the entries that may be removed.
+    Returns the (entries, objects, bytes) removed.
+    """
+    unused, removed_links, freed = [], {}, 0
+    for env in entries():
+        live = references(env)
+        if len(live) == 0 and (only is None or env in only):
+            unused.append(env)
+            for file in walk_files(env):
+                stat = os.lstat(file)
+                removed_links[stat.st_ino] = removed_links.get(stat.st_ino, 0) + 1
+                # files that are not objects, counted before removing the objects
+                # leaves the object files with a single link as well
+                if stat.st_nlink == 1:
+                    freed += stat.st_size
+        elif not dry_run:
+            meta = load_meta(env)
+            if meta.get("projects") != live:
+                meta["projects"] = live
+                state.save_json(env / STORE_FILE, meta)
+    removed_objects = 0
+    for file in walk_files(store_root() / "objects"):
+        stat = os.stat(file)
+        # the link count is the object itself plus every venv that uses the file
+        if stat.st_nlink - removed_links.get(stat.st_ino, 0) <= 1:
+            removed_objects += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.remove(file)
+    if not dry_run:
+        for env in unused:
+            shutil.rmtree(env, ignore_errors=True)
+    return len(unused), removed_objects, freed
+
+
+def walk_files(path):
+    for root, _dirs, names in os.walk(path):
+        for name in names:
+            yield os.path.join(root, name)
+
+
+def report():
+    root = store_root()
+    all_entries = entries()
+    if len(all_entries) == 0:
+        print(f"The venv store {root} is empty.")
+        return
+    on_disk = tree_size(root)
+    linked = 0
+    print(f"{'entry':<12} {'packages':>8} {'size':>9} {'projects':>8}  last used")
+    for env in all_entries:
+        meta = load_meta(env)
+        live = references(env)
+        size = tree_size(env)
+        linked += size * len(live)
+        last_used = time.strftime("%Y-%m-%d", time.localtime(meta.get("last_used", meta.get("created", 0))))
+        print(f"{env.name[:12]:<12} {len(meta.get('requirements', [])):>8} {format_size(size):>9} {len(live):>8}  {last_used}")
+    print(f"venv store {root}: {format_size(on_disk)} on disk, the linked project venvs would take {format_size(linked)} as copies.")
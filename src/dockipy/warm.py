@@ -0,0 +1,105 @@
+import hashlib, json, shlex, sys, uuid
+import dockipy.utils as utils
+from dockipy import resources
+from dockipy.image_cache import FINGERPRINT_LABEL
+from dockipy.client import get_client
+from dockipy.tracing import traced
+
+# Every exec registers itself in a busy file named after a token holding its pid,
+# the watchdog only exits when no exec is alive and nothing ran for idle_timeout.
+WATCHDOG = """
+touch /tmp/docki-last-used
+while true; do
+    sleep 5
+    busy=0
+    for file in /tmp/docki-busy-*; do
+        [ -e "$file" ] || continue
+        if kill -0 "$(cat "$file")" 2>/dev/null; then busy=1; else rm -f "$file"; fi
+    done
+    idle=$(( $(date +%s) - $(stat -c %Y /tmp/docki-last-used) ))
+    if [ "$busy" = "0" ] && [ "$idle" -ge {idle_timeout} ]; then exit 0; fi
+done
+"""
+
+
+def is_persistent(config, output=False):
+    return config.get("persistent", False) and not output
+
+
+def container_fingerprint(image_id, config, project_root, target_root):
+    """
+    Everything that is fixed when the warm container is created.
+    """
+    run_config = {
+        "image": image_id,
+        "volumes": utils.get_volumes(project_root, target_root),
+        "user": utils.get_user(),
+        "runtime": utils.get_runtime(config["base_image"]),
+        "limits": resources.plan(config)[0],
+        "idle_timeout": config.get("idle_timeout", 600),
+    }
+    return hashlib.sha256(json.dumps(run_config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_or_start(client, tag, config, project_root, target_root):
+    """
+    Return the running warm container of the project, (re)creating it when the
+    image or the run configuration changed.
+    """
+    import docker
+    name = utils.warm_name(config.get("tag"))
+    fingerprint = container_fingerprint(client.images.get(tag).id, config, project_root, target_root)
+    try:
+        container = client.containers.get(name)
+        if container.status == "running" and container.labels.get(FINGERPRINT_LABEL) == fingerprint:
+            # reset the idle time so the watchdog does not exit before the exec starts
+            try:
+                if container.exec_run(["touch", "/tmp/docki-last-used"], user=utils.get_user()).exit_code == 0:
+                    return container
+            except docker.errors.APIError:
+                pass
+        print(f"Replacing the warm container {name}...")
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    print(f"Starting the warm container {name}...")
+    watchdog = WATCHDOG.replace("{idle_timeout}", str(int(config.get("idle_timeout", 600))))
+    return client.containers.run(tag,
+                                 ["bash", "-c", watchdog],
+                                 detach=True,
+                                 network_mode="host",
+                                 user=utils.get_user(),
+                                 volumes=utils.get_volumes(project_root, target_root),
+                                 working_dir=target_root,
+                                 runtime=utils.get_runtime(config["base_image"]),
+                                 name=name,
+                                 labels={FINGERPRINT_LABEL: fingerprint, "docki.role": "warm", "docki.project": str(project_root)},
+                                 **resources.run_kwargs(resources.plan(config)[0]),
+                                 )
+
+
+@traced("exec")
+def exec_command(tag, command, config, work_dir, project_root, target_root, out=None):
+    """
+    Run command in the warm container of the project, print its output to out
+    and return its exit code.
+    """
+    client = get_client()
+    container = get_or_start(client, tag, config, project_root, target_root)
+    token = uuid.uuid4().hex
+    busy = f"/tmp/docki-busy-{token}"
+    script = (
+        f"echo $$ > {busy}; trap 'rm -f {busy}; touch /tmp/docki-last-used' EXIT; "
+        f"cd {shlex.quote(work_dir)} && {utils.shell_command(command, config, target_root)}"
+    )
+    exec_id = client.api.exec_create(container.id, ["bash", "-c", script], tty=True, user=utils.get_user())["Id"]
+    try:
+        utils.write_chunks(client.api.exec_start(exec_id, stream=True, tty=True), out if out is not None else sys.stdout,
+                           first_output=True)
+    except KeyboardInterrupt:
+        # the exec is its own process group on the tty, interrupt all of it
+        client.api.exec_start(client.api.exec_create(
+            container.id, ["bash", "-c", f"kill -INT -- -$(cat {busy}) 2>/dev/null"], user=utils.get_user())["Id"])
+        print("Interrupted the command, the warm container keeps running.")
+        return 130
+    return client.api.exec_inspect(exec_id)["ExitCode"]
@@ -0,0 +1,43 @@
+import unittest, io
+from dockipy.buildlog import BuildProgress
+
+BUILDKIT_OUTPUT = """#0 building with "default" instance using docker driver
+#1 [internal] load build definition from Dockerfile
+#1 transferring dockerfile: 1.23kB done
+#1 DONE 0.0s
+#5 [1/3] FROM docker.io/library/ubuntu:latest
+#5 CACHED
+#6 [2/3] RUN apt-get update
+#6 0.512 Get:1 http://archive.ubuntu.com/ubuntu jammy InRelease [270 kB]
+#6 DONE 3.2s
+#7 [3/3] RUN false
+#7 ERROR: process "/bin/sh -c false" did not complete successfully: exit code: 1
+"""
+
+
+class TestBuildProgress(unittest.TestCase):
+    def test_buildkit_steps(self):
+        out = io.StringIO()
+        progress = BuildProgress(out=out, live=False)
+        for line in BUILDKIT_OUTPUT.splitlines(keepends=True):
+            progress.feed(line)
+        progress.finish()
+        names = [step.name for step in progress.order]
+        self.assertEqual(names, ["internal", "1/3", "2/3", "3/3"])
+        self.assertTrue(progress.steps["5"].cached)
+        self.assertFalse(progress.steps["6"].cached)
+        self.assertIn("exit code: 1", progress.steps["7"].error)
+        self.assertTrue(all(step.end is not None for step in progress.order))
+
+    def test_classic_steps(self):
+        progress = BuildProgress(out=io.StringIO(), live=False)
+        for line in ["Step 1/2 : FROM ubuntu", " ---> 1234", "Step 2/2 : RUN true", " ---> Using cache"]:
+            progress.feed(line)
+        self.assertIsNotNone(progress.steps["1/2"].end)
+        self.assertTrue(progress.steps["2/2"].cached)
+
+    def test_tail_is_bounded(self):
+        progress = BuildProgress(tail_size=3, out=io.StringIO(), live=False)
+        for i in range(100):
+            progress.feed(f"#6 {i}.000 line {i}\n")
+        self.assertEqual(list(progress.tail), ["#6 97.000 line 97", "#6 98.000 line 98", "#6 99.000 line 99"])
@@ -0,0 +1,56 @@
+import unittest, gzip, os, pathlib, tarfile, tempfile
+from dockipy import bundle
+
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.path = self.root / "project.docki"
+        self.image = os.urandom(300 * 1024) + b"layer" * 50000
+        wheel = self.root / "numpy-2.0.0-cp311-none-any.whl"
+        wheel.write_bytes(b"wheel" * 1000)
+        requirements = self.root / "requirements.txt"
+        requirements.write_text("numpy==2.0.0\n")
+        with open(self.path, "wb") as out:
+            sha, size = bundle.write_streamed_member(out, bundle.IMAGE_MEMBER, (self.image[i:i + 65536] for i in range(0, len(self.image), 65536)))
+        files = [(bundle.REQUIREMENTS, requirements), (f"{bundle.WHEELHOUSE}/{wheel.name}", wheel)]
+        self.manifest = bundle.append_files(self.path, files, {"version": bundle.BUNDLE_VERSION, "tag": "proj:latest"},
+                                            {bundle.IMAGE_MEMBER: {"sha256": sha, "size": size}})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_streamed_image_and_files_read_back_as_one_tar(self):
+        with tarfile.open(self.path) as tar:
+            self.assertEqual(tar.getnames(), [bundle.IMAGE_MEMBER, bundle.REQUIREMENTS, "wheels/numpy-2.0.0-cp311-none-any.whl", bundle.MANIFEST])
+            self.assertEqual(bundle.read_manifest(tar), self.manifest)
+            reader = bundle.HashingReader(tar, bundle.IMAGE_MEMBER)
+            self.assertEqual(gzip.decompress(b"".join(reader)), self.image)
+            self.assertEqual(reader.sha.hexdigest(), self.manifest["files"][bundle.IMAGE_MEMBER]["sha256"])
+
+    def test_extract_verifies_hashes(self):
+        with tarfile.open(self.path) as tar:
+            bundle.extract_verified(tar, self.manifest, [bundle.REQUIREMENTS], self.root / "out")
+            self.assertEqual((self.root / "out" / bundle.REQUIREMENTS).read_text(), "numpy==2.0.0\n")
+            self.manifest["files"][bundle.REQUIREMENTS]["sha256"] = "0" * 64
+            with self.assertRaises(ValueError):
+                bundle.extract_verified(tar, self.manifest, [bundle.REQUIREMENTS], self.root / "out")
+
+    def test_names_outside_of_dest_and_missing_files_are_refused(self):
+        with tarfile.open(self.path) as tar:
+            for name in ["wheels/../../x", "/etc/x"]:
+                self.manifest["files"][name] = {"sha256": "0" * 64, "size": 1}
+                with self.assertRaisesRegex(ValueError, "not a valid file name"):
+                    bundle.extract_verified(tar, self.manifest, [name], self.root / "out")
+            self.assertFalse((self.root / "x").exists())
+            self.manifest["files"]["wheels/gone.whl"] = {"sha256": "0" * 64, "size": 1}
+            with self.assertRaisesRegex(ValueError, "missing from the bundle"):
+                bundle.extract_verified(tar, self.manifest, ["wheels/gone.whl"], self.root / "out")
+
+    def test_other_tars_are_not_bundles(self):
+        other = self.root / "other.tar"
+        with tarfile.open(other, "w") as tar:
+            tar.add(self.root / "requirements.txt", arcname="requirements.txt")
+        with tarfile.open(other) as tar, self.assertRaises(ValueError):
+            bundle.read_manifest(tar)
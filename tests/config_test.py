@@ -0,0 +1,80 @@
+import unittest, os, tempfile, pathlib
+from unittest import mock
+from dockipy import config, state
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        self.home = mock.patch.object(state, "DOCKI_HOME", self.dir / "home")
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        file = self.dir / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(text)
+        return file
+
+    def test_errors_point_at_the_value(self):
+        file = self.write("docki.yaml", "tag: demo\nshm_size: [16G]\nremote:\n  hosts:\n    - workspace: /tmp\n")
+        with self.assertRaises(config.ConfigError) as error:
+            config.load_config(file)
+        errors = error.exception.errors
+        self.assertIn(f"{file}:2:11: shm_size: expected a string or an integer, got a list", errors)
+        self.assertIn(f"{file}:5:7: remote.hosts[0]: missing name", errors)
+
+    def test_unknown_keys_are_warnings(self):
+        file = self.write("docki.yaml", "tag: demo\nbase_imag: ubuntu\n")
+        content, warnings = config.load_config(file)
+        self.assertEqual(content, {"tag": "demo", "base_imag": "ubuntu"})
+        self.assertEqual(warnings, [f"{file}:2:12: base_imag: unknown key, it is ignored"])
+
+    def test_extends_merges_mappings_and_replaces_lists(self):
+        self.write("shared/base.yaml", "base_image: ubuntu\nsystem_dep: [git]\nremote:\n  hosts: [{name: a}]\n  timeout: 10\n")
+        file = self.write("project/docki.yaml", "extends: ../shared/base.yaml\ntag: demo\nsystem_dep: [curl]\nremote:\n  timeout: 20\n")
+        content, _warnings = config.load_config(file)
+        self.assertEqual(content, {
+            "base_image": "ubuntu", "tag": "demo", "system_dep": ["curl"],
+            "remote": {"hosts": [{"name": "a"}], "timeout": 20},
+        })
+
+    def test_errors_in_extended_files_point_at_that_file(self):
+        base = self.write("base.yaml", "layered: yes please\n")
+        file = self.write("docki.yaml", "extends: base.yaml\n")
+        with self.assertRaises(config.ConfigError) as error:
+            config.load_config(file)
+        self.assertEqual(error.exception.errors, [f"{base}:1:10: layered: expected true or false, got a string"])
+
+    def test_extends_cycle(self):
+        self.write("a.yaml", "extends: b.yaml\n")
+        self.write("b.yaml", "extends: a.yaml\n")
+        with self.assertRaises(config.ConfigError):
+            config.load_config(self.dir / "a.yaml")
+
+    def test_cache_skips_parsing_until_a_file_changes(self):
+        base = self.write("base.yaml", "base_image: ubuntu\n")
+        file = self.write("docki.yaml", "extends: base.yaml\ntag: demo\n")
+        config.load_config(file)
+        with mock.patch.object(config, "parse_file", side_effect=AssertionError("parsed")):
+            self.assertEqual(config.load_config(file)[0], {"base_image": "ubuntu", "tag": "demo"})
+        base.write_text("base_image: debian\n")
+        os.utime(base, ns=(0, 0))
+        self.assertEqual(config.load_config(file)[0], {"base_image": "debian", "tag": "demo"})
+
+    def test_find_project_root(self):
+        self.write("project/pyproject.toml", "")
+        (self.dir / "project" / "src" / "pkg").mkdir(parents=True)
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.dir / "project" / "src" / "pkg")
+            work_dir, project_root, target_root = config.find_project_root()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(project_root, os.path.realpath(self.dir / "project"))
+        self.assertEqual(target_root, "/project")
+        self.assertEqual(work_dir, "/project/src/pkg")
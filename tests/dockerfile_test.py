@@ -0,0 +1,48 @@
+import unittest
+from dockipy import utils
+
+
+class TestAptLayers(unittest.TestCase):
+    def test_packages_are_grouped_by_layer_size(self):
+        packages = [f"pkg{i}" for i in range(7)]
+        self.assertEqual(utils.apt_layers(packages, layer_size=3),
+                         [["pkg0", "pkg1", "pkg2"], ["pkg3", "pkg4", "pkg5"], ["pkg6"]])
+        self.assertEqual(utils.apt_layers(packages[:6], layer_size=3), [["pkg0", "pkg1", "pkg2"], ["pkg3", "pkg4", "pkg5"]])
+        self.assertEqual(utils.apt_layers([]), [])
+
+    def test_nested_lists_are_their_own_layer(self):
+        system_dep = [["python3-venv", "python3"], "git", "curl", ["ffmpeg"], "wget"]
+        self.assertEqual(utils.apt_layers(system_dep, layer_size=8),
+                         [["python3", "python3-venv"], ["curl", "git"], ["ffmpeg"], ["wget"]])
+
+    def test_appending_a_package_only_changes_the_last_layer(self):
+        system_dep = ["git", "curl", "wget", "htop", "tmux"]
+        before = utils.apt_layers(system_dep, layer_size=2)
+        after = utils.apt_layers(system_dep + ["vim"], layer_size=2)
+        self.assertEqual(after[:-1], before[:-1])
+        self.assertEqual(after[-1], ["tmux", "vim"])
+
+
+class TestDockerfile(unittest.TestCase):
+    def dockerfile(self, system_dep, layered=True):
+        return utils.build_dockerfile("ubuntu:22.04", system_dep, ["echo done"], "/demo", layered=layered, layer_size=2)
+
+    def test_dockerfile_text_is_stable(self):
+        # the image cache fingerprints this text, any change rebuilds every image
+        dockerfile = self.dockerfile(["git", "curl", "wget"])
+        self.assertEqual(dockerfile, self.dockerfile(["git", "curl", "wget"]))
+        self.assertEqual(dockerfile, self.dockerfile(["curl", "git", "wget"]))
+        self.assertTrue(dockerfile.startswith("# syntax=docker/dockerfile:1\nFROM ubuntu:22.04\n"))
+        self.assertIn(f"\nRUN {utils.APT_CACHE_MOUNTS}     apt-get update &&     apt-get install -y --no-install-recommends curl git\n", dockerfile)
+        self.assertIn(f"\nRUN {utils.APT_CACHE_MOUNTS}     apt-get update &&     apt-get install -y --no-install-recommends wget\n", dockerfile)
+
+    def test_appending_a_package_keeps_the_earlier_layers(self):
+        before = utils.layered_apt_str(["git", "curl", "wget"], layer_size=2)
+        after = utils.layered_apt_str(["git", "curl", "wget", "vim"], layer_size=2)
+        self.assertEqual(after.rsplit("\nRUN ", 1)[0], before.rsplit("\nRUN ", 1)[0])
+
+    def test_flat_dockerfile_installs_everything_at_once(self):
+        dockerfile = self.dockerfile(["git", ["python3"], "curl"], layered=False)
+        self.assertNotIn("# syntax", dockerfile)
+        self.assertNotIn("--mount", dockerfile)
+        self.assertIn("apt-get install -y --no-install-recommends     sudo git python3 curl && ", dockerfile)
@@ -0,0 +1,111 @@
+import unittest, io
+from unittest import mock
+from dockipy import dockigc, image_cache
+
+GB = 1024**3
+
+DF = {
+    "Images": [
+        {"Id": "sha256:" + "a" * 64, "RepoTags": ["old:latest"], "Labels": {image_cache.FINGERPRINT_LABEL: "1"},
+         "Created": 100, "Size": 5 * GB, "SharedSize": 2 * GB, "Containers": 0},
+        {"Id": "sha256:" + "b" * 64, "RepoTags": ["<none>:<none>"], "Labels": {image_cache.FINGERPRINT_LABEL: "2"},
+         "Created": 200, "Size": 4 * GB, "SharedSize": 2 * GB, "Containers": 0},
+        {"Id": "sha256:" + "c" * 64, "RepoTags": ["running:latest"], "Labels": {image_cache.FINGERPRINT_LABEL: "3"},
+         "Created": 50, "Size": 6 * GB, "SharedSize": 2 * GB, "Containers": 1},
+        {"Id": "sha256:" + "d" * 64, "RepoTags": ["ubuntu:22.04"], "Labels": None,
+         "Created": 10, "Size": 1 * GB, "SharedSize": 0, "Containers": 0},
+    ],
+    "BuildCache": [
+        {"ID": "x" * 25, "Type": "regular", "Description": "pip install", "InUse": False, "Size": 3 * GB,
+         "LastUsedAt": "1970-01-01T00:05:00.123456789Z"},
+        {"ID": "y" * 25, "Type": "regular", "Description": "apt-get", "InUse": True, "Size": 1 * GB,
+         "LastUsedAt": "1970-01-01T00:00:01Z"},
+    ],
+}
+INDEX = {"images": {"old:latest": {"last_used": 400}}}
+
+
+class TestPlan(unittest.TestCase):
+    def items(self):
+        return dockigc.image_items(DF, INDEX) + dockigc.build_cache_items(DF)
+
+    def test_only_docki_images_are_tracked_by_last_use(self):
+        images = dockigc.image_items(DF, INDEX)
+        self.assertEqual([(item.name, item.size // GB, item.last_used, item.in_use) for item in images],
+                         [("old:latest", 3, 400, False), ("bbbbbbbbbbbb", 2, 200, False), ("running:latest", 4, 50, True)])
+        self.assertEqual(dockigc.parse_time("1970-01-01T00:05:00.123456789Z"), 300.0)
+
+    def test_least_recently_used_go_first_until_under_budget(self):
+        items = self.items()
+        # 3 + 2 + 4 images and 3 + 1 build cache
+        victims, usage = dockigc.plan_eviction(items, 10 * GB)
+        self.assertEqual([item.name for item in victims], ["bbbbbbbbbbbb", "xxxxxxxxxxxx pip install"])
+        self.assertEqual(usage, 8 * GB)
+        victims, _usage = dockigc.plan_eviction(items, 20 * GB)
+        self.assertEqual(victims, [])
+        # items in use stay even when the budget can not be met
+        victims, usage = dockigc.plan_eviction(items, 0)
+        self.assertEqual(len(victims), 3)
+        self.assertEqual(usage, 5 * GB)
+
+    def test_dry_run_report_lists_reclaimable_bytes(self):
+        items = self.items()
+        victims, _usage = dockigc.plan_eviction(items, 10 * GB)
+        out = io.StringIO()
+        dockigc.print_plan(items, victims, 10 * GB, out)
+        report = out.getvalue()
+        self.assertIn("bbbbbbbbbbbb", report)
+        self.assertIn("image: 3 using 9.0G, 1 to remove freeing 2.0G", report)
+        self.assertIn("build cache: 2 using 4.0G, 1 to remove freeing 3.0G", report)
+        self.assertIn("removing 5.0G leaves 8.0G", report)
+
+    def test_evict_removes_images_and_prunes_build_cache_to_what_is_kept(self):
+        items = self.items()
+        victims, _usage = dockigc.plan_eviction(items, 10 * GB)
+        client = mock.MagicMock()
+        client.api.prune_builds.return_value = {"SpaceReclaimed": 3 * GB}
+        freed = dockigc.evict(client, items, victims)
+        client.images.remove.assert_called_once_with("sha256:" + "b" * 64, noprune=False)
+        client.api.prune_builds.assert_called_once_with(keep_storage=1 * GB, all=True)
+        self.assertEqual(freed, {"image": 2 * GB, "build cache": 3 * GB})
+
+    def test_build_cache_is_only_counted_when_asked_for(self):
+        from contextlib import redirect_stdout
+        client = mock.MagicMock()
+        client.df.return_value = DF
+        for argv, counted in [(["dockigc", "--budget", "1G", "--dry-run"], False),
+                              (["dockigc", "--budget", "1G", "--dry-run", "--build-cache"], True)]:
+            out = io.StringIO()
+            with mock.patch.object(dockigc, "get_client", return_value=client), \
+                 mock.patch.object(dockigc, "load_json", return_value=INDEX), \
+                 mock.patch.object(dockigc, "venv_items", return_value=[]), \
+                 mock.patch.object(dockigc, "wheel_items", return_value=[]), \
+                 mock.patch("sys.argv", argv), redirect_stdout(out):
+                dockigc.dockigc()
+            self.assertEqual("pip install" in out.getvalue(), counted)
+            self.assertIn("whole docker daemon" if counted else "--build-cache adds", out.getvalue())
+        client.api.prune_builds.assert_not_called()
+
+
+class TestDockiprune(unittest.TestCase):
+    def test_containers_are_pruned_before_what_they_use(self):
+        from contextlib import redirect_stdout
+        from dockipy import utils
+        pruned = []
+        client = mock.Mock()
+
+        def prune(name):
+            def run(*args, **kwargs):
+                if name not in ("containers", "build cache"):
+                    self.assertIn("containers", pruned, name)
+                pruned.append(name)
+                return {"SpaceReclaimed": GB}
+            return run
+        for name in ["containers", "images", "volumes", "networks"]:
+            getattr(client, name).prune.side_effect = prune(name)
+        client.api.prune_builds.side_effect = prune("build cache")
+        out = io.StringIO()
+        with mock.patch.object(utils, "get_client", return_value=client), redirect_stdout(out):
+            utils.dockiprune()
+        self.assertEqual(sorted(pruned), ["build cache", "containers", "images", "networks", "volumes"])
+        self.assertIn("Total: Freed 5.00 GB", out.getvalue())
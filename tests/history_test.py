@@ -0,0 +1,68 @@
+import unittest, io, pathlib, tempfile
+from unittest import mock
+from dockipy import history, state
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.home = mock.patch.object(state, "DOCKI_HOME", pathlib.Path(self.tmp.name))
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def test_log_rotates_and_keeps_the_first_and_newest_segments(self):
+        out = io.StringIO()
+        writer = history.LogWriter(history.run_dir(1), out, segment_size=1000, keep=3, tail_lines=5)
+        for i in range(400):
+            writer.write(f"step {i}\n")
+        writer.write("epoch 10%\repoch 100%")
+        writer.close()
+        self.assertEqual(out.getvalue().count("\n"), 400)
+        names = [path.name for path in history.segments(history.run_dir(1))]
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names[0], history.segment_name(0))
+        lines = list(history.log_lines(1))
+        self.assertEqual(lines[0], "step 0")
+        self.assertRegex(next(line for line in lines if not line.startswith("step")), r"^\[dockilog: \d+ rotated log segments removed\]$")
+        self.assertEqual(lines[-2:], ["step 399", "epoch 100%"])
+        self.assertEqual(list(writer.tail), ["step 396", "step 397", "step 398", "step 399", "epoch 100%"])
+        self.assertEqual(writer.lines, 401)
+
+    def test_recorded_run_is_listed_tailed_and_grepped(self):
+        container = mock.Mock()
+        container.stats.side_effect = lambda **kwargs: iter([
+            {"memory_stats": {"usage": 300, "stats": {"inactive_file": 44}}, "precpu_stats": {}},
+            {"memory_stats": {"usage": 200},
+             "cpu_stats": {"cpu_usage": {"total_usage": 3e9}, "system_cpu_usage": 8e9, "online_cpus": 4},
+             "precpu_stats": {"cpu_usage": {"total_usage": 1.5e9}, "system_cpu_usage": 4e9}},
+        ])
+        out = io.StringIO()
+        config = {"tag": "proj", "history_runs": 2}
+        for exit_code in (0, 1, 3):
+            run = history.start("/proj", config, ["train.py", "--lr", "3e-4"], container, out=out)
+            for i in range(150):
+                run.out.write(f"loss {i} of run {run.id}\n")
+            run.finish(exit_code)
+        with history.connect() as connection:
+            runs = history.find_runs(connection, "/proj")
+        # the first run was removed with its log
+        self.assertEqual([(run["id"], run["exit_code"]) for run in runs], [(3, 3), (2, 1)])
+        self.assertFalse(history.run_dir(1).exists())
+        self.assertEqual((runs[0]["peak_memory"], runs[0]["peak_cpu"], runs[0]["log_lines"]), (256, 150.0, 150))
+        self.assertEqual(runs[0]["command"], "train.py --lr 3e-4")
+        self.assertEqual(history.tail_lines(runs[0], 2), ["loss 148 of run 3", "loss 149 of run 3"])
+        self.assertEqual(len(history.tail_lines(runs[0], 120)), 120)
+        self.assertEqual(history.tail_lines(runs[0], 1000)[0], "loss 0 of run 3")
+        found = io.StringIO()
+        self.assertEqual(history.grep(reversed(runs), history.re.compile(r"loss 14[89] "), found), 4)
+        self.assertEqual(found.getvalue().splitlines()[0], "2:149:loss 148 of run 2")
+
+    def test_unfinished_log_reads_as_far_as_it_was_flushed(self):
+        writer = history.LogWriter(history.run_dir(7), io.StringIO(), segment_size=1 << 20)
+        writer.write("first\nsecond\n")
+        writer.file.flush()
+        self.assertEqual(list(history.log_lines(7)), ["first", "second"])
+        writer.close()
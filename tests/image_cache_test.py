@@ -0,0 +1,37 @@
+import unittest, tempfile, pathlib
+from unittest import mock
+from dockipy import image_cache, state
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.home = mock.patch.object(state, "DOCKI_HOME", pathlib.Path(self.tmp.name))
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def test_fingerprint_depends_on_dockerfile_and_base(self):
+        fingerprint = image_cache.image_fingerprint("FROM ubuntu", "sha256:a")
+        self.assertEqual(fingerprint, image_cache.image_fingerprint("FROM ubuntu", "sha256:a"))
+        self.assertNotEqual(fingerprint, image_cache.image_fingerprint("FROM ubuntu", "sha256:b"))
+        self.assertNotEqual(fingerprint, image_cache.image_fingerprint("FROM debian", "sha256:a"))
+
+    def test_record_build_counts_hits_and_misses(self):
+        image_cache.record_build("docki:latest", "abc", hit=False, build_time=2.0)
+        image_cache.record_build("docki:latest", "abc", hit=True)
+        image_cache.record_build("docki:latest", "abc", hit=True)
+        index = state.load_json(image_cache.index_file())
+        self.assertEqual(index["images"]["docki:latest"]["fingerprint"], "abc")
+        self.assertEqual(index["stats"]["docki:latest"], {"hits": 2, "misses": 1, "build_time": 2.0})
+
+    def test_find_cached_image_requires_matching_label(self):
+        image_cache.record_build("docki:latest", "abc", hit=False)
+        client = mock.Mock()
+        client.images.get.return_value = mock.Mock(labels={image_cache.FINGERPRINT_LABEL: "abc"})
+        self.assertIsNotNone(image_cache.find_cached_image(client, "docki:latest", "abc"))
+        self.assertIsNone(image_cache.find_cached_image(client, "docki:latest", "other"))
+        client.images.get.return_value = mock.Mock(labels={})
+        self.assertIsNone(image_cache.find_cached_image(client, "docki:latest", "abc"))
@@ -0,0 +1,110 @@
+import unittest, asyncio, hashlib, io, json, sys, tarfile, tempfile, pathlib
+from dockipy import remote, image_push
+
+# Stand-in for ssh: runs the command locally with the host name in DOCKI_TEST_HOST.
+FAKE_SSH = """
+import os, subprocess, sys
+os.environ["DOCKI_TEST_HOST"] = sys.argv[-2]
+sys.exit(subprocess.call(sys.argv[-1], shell=True))
+"""
+
+
+def add_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def diff_id(data):
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def save_tar(path, layers, legacy=False):
+    """
+    A docker save archive with the given layer contents.
+    """
+    with tarfile.open(path, "w", format=tarfile.PAX_FORMAT) as tar:
+        names = []
+        for i, data in enumerate(layers):
+            name = f"layer{i}/layer.tar" if legacy else f"blobs/sha256/{diff_id(data)[7:]}"
+            add_file(tar, name, data)
+            names.append(name)
+        config = json.dumps({"rootfs": {"diff_ids": [diff_id(data) for data in layers]}}).encode("utf-8")
+        add_file(tar, f"blobs/sha256/{hashlib.sha256(config).hexdigest()}", config)
+        add_file(tar, "manifest.json", json.dumps([{"Layers": names}]).encode("utf-8"))
+
+
+class TestImagePush(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        (self.dir / "fake_ssh.py").write_text(FAKE_SSH)
+        self.transport = remote.SSHTransport([sys.executable, str(self.dir / "fake_ssh.py")], options=[])
+        self.layers = [b"base" * 1000, b"apt" * 1000, b"code" * 1000]
+        self.diff_ids = [diff_id(data) for data in self.layers]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def push(self, hosts, inventories, legacy=False, load_command=None, timeout=None):
+        for host, diff_ids in inventories.items():
+            (self.dir / f"{host}.inventory").write_text(" ".join(diff_ids) + "\n")
+        save_tar(self.dir / "image.tar", self.layers, legacy)
+        return asyncio.run(image_push.push_hosts(
+            [{"name": host} for host in hosts], ["cat", str(self.dir / "image.tar")], self.diff_ids, self.transport,
+            load_command=load_command or f"cat > {self.dir}/$DOCKI_TEST_HOST.tar",
+            inventory_command=f"cat {self.dir}/$DOCKI_TEST_HOST.inventory 2>/dev/null || true",
+            timeout=timeout,
+        ))
+
+    def received(self, host):
+        with tarfile.open(self.dir / f"{host}.tar") as tar:
+            return [member.name for member in tar.getmembers()]
+
+    def test_only_missing_layers_are_sent(self):
+        results = self.push(["empty", "base", "other"], {
+            "base": self.diff_ids[:2],
+            # the same layer on another base is a different chain
+            "other": ["sha256:" + "0" * 64, self.diff_ids[1]],
+        })
+        results = {result.host: result for result in results}
+        self.assertTrue(all(result.error is None for result in results.values()))
+        self.assertEqual(len(self.received("empty")), 5)
+        self.assertEqual((results["empty"].layers_sent, results["empty"].layers_skipped), (3, 0))
+        self.assertEqual(len(self.received("base")), 3)
+        self.assertEqual(results["base"].saved, len(self.layers[0]) + len(self.layers[1]))
+        self.assertEqual((results["other"].layers_sent, results["other"].layers_skipped), (3, 0))
+        self.assertLess(results["base"].sent, results["empty"].sent)
+
+    def test_legacy_layers_are_hashed(self):
+        results = self.push(["base"], {"base": self.diff_ids[:1]}, legacy=True)
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[0].layers_skipped, 1)
+        self.assertNotIn("layer0/layer.tar", self.received("base"))
+        self.assertIn("layer1/layer.tar", self.received("base"))
+
+    def test_failed_load_does_not_block_other_hosts(self):
+        (self.dir / "bad.tar").mkdir()
+        results = self.push(["bad", "good"], {})
+        results = {result.host: result for result in results}
+        self.assertIsNotNone(results["bad"].error)
+        self.assertIsNone(results["good"].error)
+        self.assertEqual(len(self.received("good")), 5)
+
+    def test_host_that_times_out_does_not_block_other_hosts(self):
+        # more chunks than a host queue holds
+        self.layers = [bytes([i]) * (12 * image_push.CHUNK_SIZE) for i in range(3)]
+        self.diff_ids = [diff_id(data) for data in self.layers]
+        load = f'if [ "$DOCKI_TEST_HOST" = slow ]; then sleep 100; else cat > {self.dir}/$DOCKI_TEST_HOST.tar; fi'
+        transport = self.transport
+
+        class SlowTimesOut(remote.SSHTransport):
+            async def run(self, host, remote_command, timeout=None, on_output=None, stdin=None):
+                timeout = 2 if host == "slow" and stdin is not None else timeout
+                return await transport.run(host, remote_command, timeout, on_output, stdin)
+        self.transport = SlowTimesOut(transport.ssh, options=[])
+        results = self.push(["slow", "good"], {}, load_command=load, timeout=60)
+        results = {result.host: result for result in results}
+        self.assertIsNotNone(results["slow"].error)
+        self.assertIsNone(results["good"].error)
+        self.assertEqual(len(self.received("good")), 5)
@@ -0,0 +1,11 @@
+import unittest, subprocess, sys
+
+ENTRY_MODULES = ["dockipy.dockipy", "dockipy.dockishell", "dockipy.dockibook", "dockipy.envipy", "dockipy.envibook", "dockipy.utils", "dockipy.matrix"]
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_entry_points_do_not_import_docker_tmux_or_yaml(self):
+        for module in ENTRY_MODULES:
+            code = f"import {module}, sys; print(' '.join(m for m in ['docker', 'libtmux', 'readline', 'yaml'] if m in sys.modules))"
+            result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.strip(), "", module)
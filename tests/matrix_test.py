@@ -0,0 +1,65 @@
+import unittest, io, threading, time
+from unittest import mock
+from dockipy import matrix
+
+
+class TestMatrix(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            "base_image": "ubuntu:22.04", "tag": "demo", "system_dep": ["git"],
+            "matrix": {
+                "Ubuntu 22": {},
+                "cuda11": {"base_image": "nvidia/cuda:11.8.0-devel-ubuntu22.04"},
+                "cuda11-py": {"base_image": "nvidia/cuda:11.8.0-devel-ubuntu22.04", "system_dep": ["python3"]},
+            },
+        }
+
+    def test_variants_override_the_config(self):
+        variants = matrix.variants(self.config)
+        self.assertEqual([variant.config["tag"] for variant in variants], ["demo-ubuntu-22", "demo-cuda11", "demo-cuda11-py"])
+        self.assertEqual([variant.config["venv_dir"] for variant in variants], ["venv-ubuntu-22", "venv-cuda11", "venv-cuda11-py"])
+        self.assertEqual(variants[2].config["system_dep"], ["python3"])
+        self.assertNotIn("matrix", variants[0].config)
+        self.assertEqual([variant.name for variant in matrix.variants(self.config, only=["cuda11"])], ["cuda11"])
+
+    def test_variants_wait_for_the_first_build_of_their_base(self):
+        events = []
+        lock = threading.Lock()
+
+        def build(variant, target_root, clean):
+            with lock:
+                events.append(("start", variant.name))
+            time.sleep(0.05)
+            with lock:
+                events.append(("built", variant.name))
+            variant.tag = variant.config["tag"]
+
+        def run(variant, *args):
+            variant.exit_code = 1 if variant.name == "cuda11-py" else 0
+        with mock.patch.object(matrix, "build", build), mock.patch.object(matrix, "run", run):
+            variants = matrix.run_matrix(matrix.variants(self.config), ["train.py"], "/demo", "/tmp/demo", "/demo", jobs=3)
+        self.assertLess(events.index(("built", "cuda11")), events.index(("start", "cuda11-py")))
+        # different bases build at the same time
+        self.assertLess(events.index(("start", "cuda11")), events.index(("built", "Ubuntu 22")))
+        self.assertEqual([variant.status for variant in variants], ["pass", "pass", "fail (1)"])
+
+    def test_build_error_fails_only_its_variant(self):
+        def build_docker_image(target_root, config, clean, out=None):
+            if config["tag"] == "demo-cuda11":
+                raise ConnectionError("daemon went away")
+            return config["tag"]
+
+        def run(variant, *args):
+            variant.exit_code = 0
+        with mock.patch.object(matrix.utils, "build_docker_image", build_docker_image), \
+             mock.patch.object(matrix, "run", run), mock.patch("sys.stdout", io.StringIO()):
+            variants = matrix.run_matrix(matrix.variants(self.config), ["train.py"], "/demo", "/tmp/demo", "/demo", jobs=3)
+        self.assertEqual([variant.status for variant in variants], ["pass", "build failed: daemon went away", "pass"])
+
+    def test_prefixed_writer_keeps_lines_whole(self):
+        out = io.StringIO()
+        writer = matrix.PrefixedWriter("[a]", out)
+        writer.write("one\ntw")
+        writer.write("o\r\nthree")
+        writer.close()
+        self.assertEqual(out.getvalue(), "[a] one\n[a] two\n[a] three\n")
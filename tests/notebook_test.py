@@ -0,0 +1,83 @@
+import unittest, io, json, pathlib, tempfile, threading
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from dockipy import notebook, utils
+from dockipy.image_cache import FINGERPRINT_LABEL
+
+
+class FakeJupyter(BaseHTTPRequestHandler):
+    kernels = []
+
+    def answer(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200 if self.headers.get("Authorization") == "token docki" else 403)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.answer(self.kernels if self.path == "/api/kernels" else {"started": "now"})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        kernel = {"id": str(len(self.kernels)), "name": request.get("name", "python3")}
+        self.kernels.append(kernel)
+        self.answer(kernel)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNotebook(unittest.TestCase):
+    def setUp(self):
+        FakeJupyter.kernels = []
+        self.server = ThreadingHTTPServer(("localhost", 0), FakeJupyter)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config = {"tag": "proj", "base_image": "ubuntu", "notebook_port": self.server.server_address[1]}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_health_and_prewarm_start_one_kernel(self):
+        self.assertTrue(notebook.healthy(self.config))
+        self.assertFalse(notebook.healthy(dict(self.config, notebook_token="wrong")))
+        with redirect_stdout(io.StringIO()):
+            notebook.prewarm(dict(self.config, notebook_prewarm="python3"))
+            notebook.prewarm(dict(self.config, notebook_prewarm="python3"))
+        self.assertEqual(FakeJupyter.kernels, [{"id": "0", "name": "python3"}])
+
+    def test_running_container_with_same_config_is_reused_without_building(self):
+        command = notebook.notebook_command(self.config, "/proj", "/proj", [])
+        fingerprint = notebook.config_fingerprint(self.config, command, "/home/proj", "/proj")
+        container = mock.Mock(status="running", labels={FINGERPRINT_LABEL: fingerprint})
+        client = mock.Mock()
+        client.containers.get.return_value = container
+        build = mock.Mock()
+        out = io.StringIO()
+        with mock.patch.object(notebook, "get_client", return_value=client), \
+             mock.patch.object(utils, "print_logs", return_value=0) as print_logs, redirect_stdout(out):
+            self.assertEqual(notebook.run_notebook([], self.config, "/proj", "/home/proj", "/proj", build), 0)
+        build.assert_not_called()
+        container.remove.assert_not_called()
+        self.assertIn(f"Notebook: http://localhost:{self.config['notebook_port']}/?token=docki", out.getvalue())
+        self.assertIsNotNone(print_logs.call_args.kwargs["since"])
+
+    def test_changed_requirements_file_changes_the_fingerprint(self):
+        with tempfile.TemporaryDirectory() as project:
+            requirements = pathlib.Path(project) / "requirements.txt"
+            requirements.write_text("numpy\n")
+            config = dict(self.config, python_dep={"file": "requirements.txt"})
+            before = notebook.config_fingerprint(config, [], project, "/proj")
+            self.assertEqual(notebook.config_fingerprint(config, [], project, "/proj"), before)
+            requirements.write_text("numpy\nscipy\n")
+            self.assertNotEqual(notebook.config_fingerprint(config, [], project, "/proj"), before)
+
+    def test_container_from_another_config_is_replaced(self):
+        container = mock.Mock(status="running", labels={FINGERPRINT_LABEL: "old"})
+        client = mock.Mock()
+        client.containers.get.return_value = container
+        with redirect_stdout(io.StringIO()):
+            self.assertIsNone(notebook.find_running(client, "proj-notebook", "new", self.config))
+        container.remove.assert_called_once_with(force=True)
@@ -0,0 +1,52 @@
+import unittest, tempfile, pathlib, os, io, sys
+from contextlib import redirect_stdout
+from unittest import mock
+from dockipy import pip_cache, state, utils
+
+
+class TestPipCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.home = mock.patch.object(state, "DOCKI_HOME", self.root / "home")
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def test_cache_location(self):
+        self.assertEqual(pip_cache.cache_location({}), ("dir", self.root / "home" / "pip-cache"))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": True}), ("dir", self.root / "home" / "pip-cache"))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": False}), (None, None))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": None}), (None, None))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": {"volume": "pip"}}), ("volume", "pip"))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": {"dir": "/data/pip"}}), ("dir", pathlib.Path("/data/pip")))
+        self.assertEqual(pip_cache.cache_location({"pip_cache": "~/pip"}), ("dir", pathlib.Path(os.path.expanduser("~/pip"))))
+
+    def write(self, name, size, used):
+        file = self.root / "cache" / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(b"x" * size)
+        os.utime(file, (used, used))
+        return file
+
+    def test_least_recently_used_files_are_evicted_first(self):
+        old = self.write("http/old.whl", 300, 1000)
+        middle = self.write("wheels/middle.whl", 200, 2000)
+        new = self.write("http/new.whl", 100, 3000)
+        self.assertEqual(pip_cache.evict_dir(self.root / "cache", 350), (300, 300))
+        self.assertEqual([old.exists(), middle.exists(), new.exists()], [False, True, True])
+        self.assertEqual(pip_cache.evict_dir(self.root / "cache", 1000), (0, 300))
+        self.assertEqual(pip_cache.evict_dir(self.root / "cache", 0), (300, 0))
+        self.assertFalse(new.exists())
+
+    def test_invalid_evict_size_is_a_usage_error(self):
+        out = io.StringIO()
+        with mock.patch.object(sys, "argv", ["docki", "--pip-cache-evict", "lots"]), \
+             mock.patch.object(pip_cache, "evict") as evict, redirect_stdout(out):
+            with self.assertRaises(SystemExit) as exit:
+                utils.docki()
+        self.assertEqual(exit.exception.code, 1)
+        self.assertIn("--pip-cache-evict 10G", out.getvalue())
+        evict.assert_not_called()
@@ -0,0 +1,41 @@
+import unittest, io, pathlib, tempfile
+from unittest import mock
+from dockipy import prefetch, state, venv_lock
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.home = mock.patch.object(state, "DOCKI_HOME", self.root / "home")
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def test_wheels_are_for_the_python_and_machine_of_the_image(self):
+        self.assertEqual(prefetch.target_python({"interpreter": "3.10.12"}), "310")
+        command = prefetch.download_command("req.txt", "/wheels", "310", machine="arm64")
+        self.assertEqual(command[command.index("--python-version") + 1], "310")
+        self.assertEqual(command[command.index("--platform") + 1], "manylinux_2_28_aarch64")
+        self.assertIn("--only-binary=:all:", command)
+
+    def test_saved_wheels_are_reported(self):
+        out = io.StringIO()
+        fetch = prefetch.Prefetch(["numpy"], "311", dest=self.root, out=out)
+        (self.root / "numpy-2.0.0-cp311-cp311-manylinux_2_17_x86_64.whl").write_bytes(b"x" * 2048)
+        fetch.feed(f"Saved {self.root}/numpy-2.0.0-cp311-cp311-manylinux_2_17_x86_64.whl")
+        fetch.feed("File was already downloaded /wheels/six-1.17.0-py2.py3-none-any.whl")
+        self.assertEqual((fetch.saved, fetch.reused, fetch.size), (1, 1, 2048))
+        self.assertEqual(out.getvalue(), "numpy-2.0.0-cp311-cp311-manylinux_2_17_x86_64.whl (2.0K)\n")
+
+    def test_nothing_is_prefetched_for_an_up_to_date_venv_or_local_requirements(self):
+        config = {"python_dep": ["numpy", "scipy"]}
+        plan = prefetch.prefetchable(self.root, config)
+        self.assertEqual(plan, (["numpy", "scipy"], {}))
+        (self.root / "venv").mkdir()
+        venv_lock.write_lock(self.root / "venv" / "docki.lock", config, ["scipy", "numpy"], "3.11.7")
+        self.assertIsNone(prefetch.prefetchable(self.root, config))
+        self.assertIsNone(prefetch.prefetchable(self.root, {"python_dep": ["-e ."]}))
+        self.assertIsNone(prefetch.prefetchable(self.root, {"python_dep": {"file": "missing.txt"}}))
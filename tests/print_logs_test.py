@@ -0,0 +1,39 @@
+import unittest, io
+from unittest import mock
+from dockipy import utils
+
+
+class TestPrintLogs(unittest.TestCase):
+    def test_split_multibyte_characters_are_kept(self):
+        data = "loss ✓ ümlaut\n".encode("utf-8")
+        out = io.StringIO()
+        written = utils.write_chunks((data[i:i + 1] for i in range(len(data))), out)
+        self.assertEqual(out.getvalue(), "loss ✓ ümlaut\n")
+        self.assertEqual(written, len(data))
+
+    def test_returns_exit_code_after_single_attach(self):
+        container = mock.Mock(attrs={"Config": {"Tty": False}})
+        container.logs.return_value = iter([b"hello ", b"world\n"])
+        container.wait.return_value = {"StatusCode": 3}
+        out = io.StringIO()
+        self.assertEqual(utils.print_logs(container, out), 3)
+        self.assertEqual(out.getvalue(), "hello world\n")
+        container.logs.assert_called_once_with(stream=True, follow=True)
+
+    def test_tty_logs_without_docker_py_internals_use_the_public_api(self):
+        container = mock.Mock(attrs={"Config": {"Tty": True}})
+        container.client.api = mock.Mock(spec=["logs"])
+        data = "step 1\rstep 2\nloss ✓\n".encode("utf-8")
+        container.logs.return_value = iter([data[i:i + 1] for i in range(len(data))])
+        container.wait.return_value = {"StatusCode": 0}
+        out = mock.Mock()
+        self.assertEqual(utils.print_logs(container, out), 0)
+        container.logs.assert_called_once_with(stream=True, follow=True)
+        # the single bytes are written a line at a time
+        self.assertEqual([call.args[0] for call in out.write.call_args_list if call.args[0] != ""], ["step 1\r", "step 2\n", "loss ✓\n"])
+
+    def test_partial_lines_are_printed_as_they_arrive(self):
+        out = mock.Mock()
+        utils.write_chunks(iter([b"Name: ", b"docki\n"]), out)
+        self.assertEqual(out.write.call_args_list[0].args[0], "Name: ")
+        self.assertEqual(out.flush.call_count, 3)
@@ -0,0 +1,68 @@
+import unittest, asyncio, io, sys, tempfile, pathlib
+from dockipy import remote
+
+# Stand-in for ssh: ignores the options and runs the command locally with the
+# host name in DOCKI_TEST_HOST.
+FAKE_SSH = """
+import os, subprocess, sys
+os.environ["DOCKI_TEST_HOST"] = sys.argv[-2]
+sys.exit(subprocess.call(sys.argv[-1], shell=True))
+"""
+
+
+def fake_transport(tmp):
+    ssh = pathlib.Path(tmp) / "fake_ssh.py"
+    ssh.write_text(FAKE_SSH)
+    return remote.SSHTransport([sys.executable, str(ssh)], options=["-o", "BatchMode=yes"])
+
+
+class TestRemoteRun(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.transport = fake_transport(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_exit_codes_and_prefixed_output(self):
+        hosts = [{"name": "a"}, {"name": "bb", "workspace": self.tmp.name}]
+        out = io.StringIO()
+        results = asyncio.run(remote.run_on_hosts(hosts, 'echo "on $DOCKI_TEST_HOST"; test "$DOCKI_TEST_HOST" = a', self.transport, on_output=remote.prefixed_printer([host["name"] for host in hosts], out)))
+        self.assertEqual([result.exit_code for result in results], [0, 1])
+        self.assertIn("[a ] on a\n", out.getvalue())
+        self.assertIn("[bb] on bb\n", out.getvalue())
+
+    def test_timeout(self):
+        results = asyncio.run(remote.run_on_hosts([{"name": "slow"}], "sleep 5", self.transport, timeout=0.5))
+        self.assertTrue(results[0].timed_out)
+        self.assertFalse(results[0].ok)
+        self.assertLess(results[0].duration, 4)
+
+
+class TestRemoteMap(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.transport = fake_transport(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_jobs_run_once_within_slots(self):
+        log = pathlib.Path(self.tmp.name) / "log"
+        jobs = [remote.Job(i, f"echo {i} >> {log}") for i in range(10)]
+        hosts = [{"name": "a", "slots": 2}, {"name": "b"}]
+        jobs = asyncio.run(remote.run_jobs(hosts, jobs, self.transport))
+        self.assertTrue(all(job.result.ok for job in jobs))
+        self.assertEqual(sorted(int(line) for line in log.read_text().split()), list(range(10)))
+
+    def test_failed_jobs_are_retried_on_another_host(self):
+        jobs = [remote.Job(i, 'test "$DOCKI_TEST_HOST" != bad') for i in range(6)]
+        hosts = [{"name": "bad"}, {"name": "good"}]
+        jobs = asyncio.run(remote.run_jobs(hosts, jobs, self.transport, retries=1))
+        self.assertTrue(all(job.result.ok for job in jobs))
+        self.assertTrue(all(job.result.host == "good" for job in jobs))
+
+    def test_retries_are_bounded(self):
+        jobs = asyncio.run(remote.run_jobs([{"name": "a"}], [remote.Job(0, "exit 1")], self.transport, retries=2))
+        self.assertEqual(jobs[0].attempts, 3)
+        self.assertFalse(jobs[0].result.ok)
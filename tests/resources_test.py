@@ -0,0 +1,50 @@
+import unittest, io
+from dockipy import resources, replicas
+
+NODES = {0: [0, 1, 2, 3, 4, 5, 6, 7], 1: [8, 9, 10, 11, 12, 13, 14, 15]}
+GB = 1024**3
+
+
+class TestPlan(unittest.TestCase):
+    def test_cpulist_round_trip(self):
+        self.assertEqual(resources.parse_cpulist("0-3,8,10-11"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(resources.format_cpulist([11, 0, 1, 2, 3, 8, 10]), "0-3,8,10-11")
+        with self.assertRaises(ValueError):
+            resources.parse_cpulist("0-x")
+
+    def test_default_is_unpinned_with_16g_shm(self):
+        self.assertEqual(resources.plan({}, nodes=NODES), [{"cpuset_cpus": None, "cpuset_mems": None, "mem_limit": None, "shm_size": "16G"}])
+
+    def test_replicas_are_spread_over_numa_nodes(self):
+        plan = resources.plan({}, replicas=4, nodes=NODES)
+        self.assertEqual([limits["cpuset_cpus"] for limits in plan], ["0-3", "4-7", "8-11", "12-15"])
+        self.assertEqual([limits["cpuset_mems"] for limits in plan], ["0", "0", "1", "1"])
+
+    def test_fewer_replicas_than_nodes_get_whole_nodes(self):
+        plan = resources.plan({"cpuset": "auto"}, replicas=1, nodes=NODES)
+        self.assertEqual((plan[0]["cpuset_cpus"], plan[0]["cpuset_mems"]), ("0-15", "0-1"))
+
+    def test_explicit_cpuset_is_split(self):
+        plan = resources.plan({"cpuset": "4-11"}, replicas=2, nodes=NODES)
+        self.assertEqual([(limits["cpuset_cpus"], limits["cpuset_mems"]) for limits in plan], [("4-7", "0"), ("8-11", "1")])
+        with self.assertRaises(ValueError):
+            resources.plan({"cpuset": "0-1"}, replicas=3, nodes=NODES)
+
+    def test_auto_memory_and_shm(self):
+        plan = resources.plan({"memory": "auto", "shm_size": "auto"}, replicas=2, nodes=NODES, memory=100 * GB)
+        self.assertEqual(plan[0]["mem_limit"], int(100 * GB * 0.9 / 2))
+        self.assertEqual(plan[0]["shm_size"], plan[0]["mem_limit"] // 2)
+        plan = resources.plan({"memory": "32G", "shm_size": "auto"}, nodes=NODES, memory=100 * GB)
+        self.assertEqual((plan[0]["mem_limit"], plan[0]["shm_size"]), (32 * GB, 16 * GB))
+        self.assertEqual(resources.run_kwargs(plan[0]), {"mem_limit": 32 * GB, "shm_size": 16 * GB})
+
+
+class TestThroughput(unittest.TestCase):
+    def test_last_rate_is_kept_across_chunks(self):
+        replica = replicas.Replica(0, resources.plan({}, nodes=NODES)[0])
+        out = io.StringIO()
+        writer = replicas.ThroughputWriter(replica, out, replicas.THROUGHPUT)
+        for chunk in ["epoch 1: 10.5 samples/s\n", "epoch 2: 12.", "25 samples/s\n", "done\n"]:
+            writer.write(chunk)
+        self.assertEqual((replica.throughput, replica.unit), (12.25, "samples/s"))
+        self.assertEqual(out.getvalue(), "epoch 1: 10.5 samples/s\nepoch 2: 12.25 samples/s\ndone\n")
@@ -0,0 +1,99 @@
+import unittest, asyncio, sys, tempfile, pathlib
+from unittest import mock
+from dockipy import remote, sync, state
+
+# Stand-in for ssh: ignores the options and host and runs the command locally,
+# so every host workspace is a local directory.
+FAKE_SSH = """
+import subprocess, sys
+sys.exit(subprocess.call(sys.argv[-1], shell=True))
+"""
+
+
+def fake_transport(tmp):
+    ssh = pathlib.Path(tmp) / "fake_ssh.py"
+    ssh.write_text(FAKE_SSH)
+    return remote.SSHTransport([sys.executable, str(ssh)], options=[])
+
+
+class TestIgnoreRules(unittest.TestCase):
+    def test_gitignore_patterns(self):
+        rules = sync.IgnoreRules(["*.pyc", "/build/", "venv/", "docs/**/*.png", "!keep.pyc"])
+        self.assertTrue(rules.ignored("a/b/c.pyc"))
+        self.assertFalse(rules.ignored("keep.pyc"))
+        self.assertTrue(rules.ignored("build", is_dir=True))
+        self.assertFalse(rules.ignored("src/build", is_dir=True))
+        self.assertFalse(rules.ignored("build"))
+        self.assertTrue(rules.ignored("src/venv", is_dir=True))
+        self.assertTrue(rules.ignored("docs/a/b/x.png"))
+        self.assertFalse(rules.ignored("x.png"))
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.home = mock.patch.object(state, "DOCKI_HOME", pathlib.Path(self.tmp.name) / "home")
+        self.home.start()
+        self.transport = fake_transport(self.tmp.name)
+        self.project = pathlib.Path(self.tmp.name) / "project"
+        (self.project / "src").mkdir(parents=True)
+        (self.project / "venv").mkdir()
+        (self.project / ".gitignore").write_text("venv/\n*.log\n")
+        (self.project / "src" / "main.py").write_text("print('hi')\n")
+        (self.project / "README.md").write_text("# project\n")
+        (self.project / "src" / "run.log").write_text("noise\n")
+        (self.project / "venv" / "big").write_bytes(b"x" * 1000)
+        self.hosts = [{"name": f"host{i}", "workspace": str(pathlib.Path(self.tmp.name) / f"ws{i}")} for i in range(2)]
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def sync(self):
+        manifest = sync.local_manifest(self.project)
+        return asyncio.run(sync.sync_hosts(self.hosts, self.project, manifest, self.transport, concurrency=1))
+
+    def test_only_changes_are_sent(self):
+        results = self.sync()
+        self.assertTrue(all(result.error is None for result in results))
+        self.assertEqual([result.changed for result in results], [3, 3])
+        workspace = pathlib.Path(self.hosts[0]["workspace"])
+        self.assertEqual((workspace / "src" / "main.py").read_text(), "print('hi')\n")
+        self.assertFalse((workspace / "venv").exists())
+        self.assertFalse((workspace / "src" / "run.log").exists())
+
+        results = self.sync()
+        self.assertEqual([(result.changed, result.deleted) for result in results], [(0, 0), (0, 0)])
+
+        (self.project / "src" / "main.py").write_text("print('bye')\n")
+        (self.project / "README.md").unlink()
+        (self.project / "venv" / "big").unlink()
+        results = self.sync()
+        self.assertEqual([(result.changed, result.deleted) for result in results], [(1, 1), (1, 1)])
+        self.assertEqual((workspace / "src" / "main.py").read_text(), "print('bye')\n")
+        self.assertFalse((workspace / "README.md").exists())
+
+    def test_workspace_changed_remotely_is_resent(self):
+        self.sync()
+        (pathlib.Path(self.hosts[1]["workspace"]) / sync.SYNC_ID_FILE).unlink()
+        results = self.sync()
+        self.assertEqual([result.changed for result in results], [0, 3])
+
+    def test_failed_transfer_is_sent_again(self):
+        # a file where the project has a directory makes tar fail halfway
+        workspace = pathlib.Path(self.hosts[0]["workspace"])
+        workspace.mkdir()
+        (workspace / "src").write_text("in the way\n")
+        results = self.sync()
+        self.assertIsNotNone(results[0].error)
+        self.assertFalse((workspace / sync.SYNC_ID_FILE).exists())
+        (workspace / "src").unlink()
+        results = self.sync()
+        self.assertEqual([(result.error, result.changed) for result in results], [(None, 3), (None, 0)])
+        self.assertEqual((workspace / "src" / "main.py").read_text(), "print('hi')\n")
+
+    def test_failed_host_is_reported(self):
+        self.hosts[0]["workspace"] = "/proc/docki-missing"
+        results = self.sync()
+        self.assertIsNotNone(results[0].error)
+        self.assertIsNone(results[1].error)
@@ -0,0 +1,26 @@
+import unittest, shutil, time, uuid
+from dockipy import utils
+
+
+@unittest.skipIf(shutil.which("tmux") is None, "needs tmux")
+class TestTmuxFleet(unittest.TestCase):
+    def setUp(self):
+        import libtmux
+        self.server = libtmux.Server(socket_name=f"docki-test-{uuid.uuid4().hex[:8]}")
+        self.fleet = utils.TmuxFleet("docki_test", [{"name": "a"}, {"name": "b"}], connect="true", server=self.server)
+
+    def tearDown(self):
+        self.server.kill()
+
+    def test_commands_ending_in_a_semicolon_are_typed_as_is(self):
+        self.fleet.broadcast("echo one;")
+        self.fleet.broadcast(r"echo two \;")
+        for pane in self.fleet.panes:
+            screen = ""
+            for _ in range(50):
+                screen = "\n".join(self.server.cmd("capture-pane", "-p", "-t", pane).stdout)
+                if "two" in screen:
+                    break
+                time.sleep(0.1)
+            self.assertIn("echo one;", screen)
+            self.assertIn("echo two \\;", screen)
@@ -0,0 +1,81 @@
+import unittest, io, json, sys, tempfile, pathlib, datetime
+from unittest import mock
+from dockipy import tracing, client, utils
+
+
+class FakeResponse:
+    def __init__(self, method, path_url, seconds):
+        self.request = mock.Mock(method=method, path_url=path_url)
+        self.elapsed = datetime.timedelta(seconds=seconds)
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = mock.patch.multiple(tracing, _enabled=False, events=[])
+        self.state.start()
+
+    def tearDown(self):
+        self.state.stop()
+        self.tmp.cleanup()
+
+    def test_nothing_is_recorded_when_disabled(self):
+        traced = tracing.traced("build")(lambda: 42)
+        self.assertEqual(traced(), 42)
+        self.assertIs(tracing.span("teardown"), tracing.NO_SPAN)
+        tracing.instant("first output")
+        self.assertEqual(tracing.events, [])
+
+    def test_spans_and_docker_calls_are_exported(self):
+        trace_file = pathlib.Path(self.tmp.name) / "trace.json"
+        with mock.patch("atexit.register"):
+            tracing.start("dockipy", str(trace_file))
+
+        @tracing.traced("build")
+        def build():
+            with tracing.span("logs"):
+                client.record_api_call(FakeResponse("GET", "/v1.45/containers/abc/json", 0.002))
+                tracing.instant("first output")
+        build()
+        with tracing.span("teardown"):
+            pass
+        out = io.StringIO()
+        tracing.finish(out)
+
+        summary = out.getvalue()
+        self.assertTrue(summary.startswith("profile dockipy "), summary)
+        self.assertIn("build ", summary)
+        self.assertIn("teardown ", summary)
+        self.assertNotIn("logs ", summary)
+        self.assertIn("first output at ", summary)
+        self.assertIn("docker 1 calls 2ms", summary)
+        events = {event["name"]: event for event in json.loads(trace_file.read_text())["traceEvents"]}
+        self.assertEqual(events["build"]["ph"], "X")
+        self.assertEqual(events["logs"]["cat"], "step")
+        self.assertEqual(events["GET /containers/{id}/json"]["cat"], "docker")
+        self.assertEqual(events["first output"]["ph"], "i")
+        self.assertLessEqual(events["build"]["ts"], events["logs"]["ts"])
+
+    def test_first_output_is_only_marked_for_the_script(self):
+        with mock.patch("atexit.register"):
+            tracing.start("dockipy", str(pathlib.Path(self.tmp.name) / "trace.json"))
+        # pip output while the venv is set up
+        utils.write_chunks([b"Collecting numpy\n"], io.StringIO())
+        self.assertEqual(tracing.events, [])
+        utils.write_chunks([b"epoch 1\n", b"epoch 2\n"], io.StringIO(), first_output=True)
+        self.assertEqual([event[0] for event in tracing.events], ["first output"])
+
+
+class TestArgsparse(unittest.TestCase):
+    def test_leading_flags_in_any_order(self):
+        argv = ["dockipy", "--clean", "--profile", "--remote", "train.py", "--clean"]
+        with mock.patch.object(sys, "argv", argv), mock.patch.object(tracing, "start") as start:
+            command, remote, clean, output, replicas = utils.argsparse()
+        self.assertEqual(command, ["train.py", "--clean"])
+        self.assertEqual((remote, clean, output, replicas), (True, True, False, 1))
+        start.assert_called_once_with("dockipy")
+
+    def test_replicas_are_returned(self):
+        for argv in (["dockipy", "--replicas", "4", "train.py"], ["dockipy", "--replicas=4", "train.py"]):
+            with mock.patch.object(sys, "argv", argv):
+                self.assertEqual(utils.argsparse(), (["train.py"], False, False, False, 4))
@@ -0,0 +1,69 @@
+import pathlib, subprocess, tempfile, unittest
+from unittest import mock
+from dockipy import utils, venv_lock
+
+
+def lock_for(python_dep, interpreter="3.10.12", base_digest="sha256:a"):
+    return {
+        "python_dep": python_dep,
+        "requirements_hash": venv_lock.requirements_hash(python_dep),
+        "interpreter": interpreter,
+        "base_image_digest": base_digest,
+    }
+
+
+class TestPlanUpdate(unittest.TestCase):
+    def test_without_lock_is_full(self):
+        self.assertEqual(venv_lock.plan_update({}, ["numpy"], "3.10.12")[0], "full")
+
+    def test_unchanged_ignores_order_comments_and_blanks(self):
+        lock = lock_for(["numpy", "torch==2.1.0"])
+        plan = venv_lock.plan_update(lock, ["# deps", "torch==2.1.0", "", "numpy"], "3.10.12", "sha256:a")
+        self.assertEqual(plan, ("none", [], []))
+
+    def test_changed_packages_are_updated_incrementally(self):
+        lock = lock_for(["numpy", "torch==2.1.0", "tqdm"])
+        plan = venv_lock.plan_update(lock, ["numpy", "torch==2.2.0", "Pillow"], "3.10.12", "sha256:a")
+        self.assertEqual(plan, ("update", ["Pillow", "torch==2.2.0"], ["tqdm"]))
+
+    def test_interpreter_or_base_image_change_is_full(self):
+        lock = lock_for(["numpy"])
+        self.assertEqual(venv_lock.plan_update(lock, ["numpy"], "3.11.4", "sha256:a")[0], "full")
+        self.assertEqual(venv_lock.plan_update(lock, ["numpy"], "3.10.12", "sha256:b")[0], "full")
+
+    def test_legacy_lock_is_updated_incrementally(self):
+        plan = venv_lock.plan_update({"python_dep": ["numpy"]}, ["numpy", "scipy"], "3.10.12", "sha256:a")
+        self.assertEqual(plan, ("update", ["scipy"], []))
+
+    def test_pip_options_change_is_full(self):
+        lock = lock_for(["numpy"])
+        plan = venv_lock.plan_update(lock, ["numpy", "--extra-index-url https://example.com"], "3.10.12", "sha256:a")
+        self.assertEqual(plan[0], "full")
+
+    def test_prefetched_wheels_are_installed_without_index_first(self):
+        commands = venv_lock.update_commands("pip", "update", ["scipy"], [], "python3 -m venv venv", "-r req.txt", "/wheels")
+        self.assertEqual(commands, ["{ pip install --no-index --find-links /wheels scipy || pip install --find-links /wheels scipy; }"])
+        self.assertEqual(venv_lock.update_commands("pip", "full", [], [], "python3 -m venv venv", "-r req.txt"),
+                         ["python3 -m venv venv", "pip install -r req.txt"])
+
+
+class TestSetupLocalVenv(unittest.TestCase):
+    def install(self, returncode):
+        with tempfile.TemporaryDirectory() as tmp:
+            probe = subprocess.CompletedProcess([], 0, stdout="3.10.12\n/usr/bin/python3\n")
+            install = subprocess.CompletedProcess([], returncode)
+            with mock.patch.object(utils.subprocess, "run", side_effect=[probe, install, install]), \
+                 mock.patch.object(venv_lock, "write_lock") as write_lock, \
+                 mock.patch("builtins.print"):
+                ok = utils.setup_local_venv(pathlib.Path(tmp), {"python_dep": ["numpy"]})
+        return ok, write_lock
+
+    def test_failed_install_is_not_locked(self):
+        ok, write_lock = self.install(1)
+        self.assertFalse(ok)
+        write_lock.assert_not_called()
+
+    def test_install_is_locked(self):
+        ok, write_lock = self.install(0)
+        self.assertTrue(ok)
+        write_lock.assert_called_once()
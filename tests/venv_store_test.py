@@ -0,0 +1,86 @@
+import unittest, os, shutil, tempfile, pathlib
+from unittest import mock
+from dockipy import state, venv_lock, venv_store
+
+
+def fake_env(key, files):
+    """
+    A store entry built at a temporary prefix, like build_env leaves it.
+    """
+    env = venv_store.env_path(key)
+    prefix = env.with_name(f".{key}.1.tmp")
+    (env / "bin").mkdir(parents=True)
+    (env / "bin" / "pip").write_text(f"#!{prefix}/bin/python\nimport pip\n")
+    os.symlink("/usr/bin/python3", env / "bin" / "python")
+    (env / "pyvenv.cfg").write_text(f"command = python3 -m venv {prefix}\n")
+    for name, content in files.items():
+        (env / "lib" / name).parent.mkdir(parents=True, exist_ok=True)
+        (env / "lib" / name).write_text(content)
+    venv_store.dedupe(env)
+    state.save_json(env / venv_store.STORE_FILE, {"prefix": str(prefix), "requirements": sorted(files), "projects": []})
+    return env
+
+
+def link_project(env, venv):
+    venv.mkdir(parents=True)
+    venv_store.link_tree(env, venv, venv_store.load_meta(env)["prefix"], venv)
+    venv_lock.write_lock(venv / "docki.lock", {}, [], "3.11.7", store_key=env.name)
+    meta = venv_store.load_meta(env)
+    meta["projects"].append(str(venv))
+    state.save_json(env / venv_store.STORE_FILE, meta)
+
+
+class TestVenvStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.home = mock.patch.object(state, "DOCKI_HOME", self.root / "home")
+        self.home.start()
+
+    def tearDown(self):
+        self.home.stop()
+        self.tmp.cleanup()
+
+    def test_key_ignores_order_and_local_requirements_are_not_stored(self):
+        self.assertEqual(venv_store.store_key(["numpy", "torch"], "3.11.7", "/usr/bin/python3"),
+                         venv_store.store_key(["torch", "# ml", "numpy"], "3.11.7", "/usr/bin/python3"))
+        self.assertNotEqual(venv_store.store_key(["numpy"], "3.11.7", "/usr/bin/python3"),
+                            venv_store.store_key(["numpy"], "3.12.1", "/usr/bin/python3"))
+        self.assertTrue(venv_store.storable(["numpy==2.0.0", "--extra-index-url https://example.com"]))
+        self.assertFalse(venv_store.storable(["numpy", "-e ."]))
+        self.assertFalse(venv_store.storable(["mypkg @ file:///src/mypkg"]))
+
+    def test_project_venv_is_linked_and_paths_are_rewritten(self):
+        env = fake_env("a" * 32, {"numpy/__init__.py": "big = 1\n"})
+        venv = self.root / "project" / "venv"
+        link_project(env, venv)
+        source, linked = env / "lib" / "numpy" / "__init__.py", venv / "lib" / "numpy" / "__init__.py"
+        self.assertTrue(os.path.samefile(source, linked))
+        self.assertEqual((venv / "bin" / "pip").read_text(), f"#!{venv}/bin/python\nimport pip\n")
+        self.assertIn(str(venv), (venv / "pyvenv.cfg").read_text())
+        self.assertEqual(os.readlink(venv / "bin" / "python"), "/usr/bin/python3")
+        self.assertFalse((venv / venv_store.STORE_FILE).exists())
+        # shared files are read-only so a project can not change the others in place
+        self.assertEqual(os.stat(linked).st_mode & 0o222, 0)
+
+    def test_identical_files_of_different_entries_are_stored_once(self):
+        first = fake_env("a" * 32, {"numpy/__init__.py": "big = 1\n"})
+        second = fake_env("b" * 32, {"numpy/__init__.py": "big = 1\n", "torch/__init__.py": "big = 2\n"})
+        self.assertTrue(os.path.samefile(first / "lib" / "numpy" / "__init__.py", second / "lib" / "numpy" / "__init__.py"))
+        self.assertEqual(len(list(venv_store.walk_files(venv_store.store_root() / "objects"))), 2)
+
+    def test_collect_removes_unreferenced_entries_and_their_objects(self):
+        kept = fake_env("a" * 32, {"numpy/__init__.py": "big = 1\n"})
+        unused = fake_env("b" * 32, {"numpy/__init__.py": "big = 1\n", "torch/__init__.py": "big = 2\n"})
+        link_project(kept, self.root / "project" / "venv")
+        planned = venv_store.collect(dry_run=True)
+        self.assertEqual(planned[:2], (1, 1))
+        self.assertTrue(unused.exists())
+        # a real run frees what the dry run said it would
+        self.assertEqual(venv_store.collect(), planned)
+        self.assertEqual(venv_store.entries(), [kept])
+        self.assertEqual(len(list(venv_store.walk_files(venv_store.store_root() / "objects"))), 1)
+        # once the project venv is gone, its entry is no longer referenced
+        shutil.rmtree(self.root / "project" / "venv")
+        self.assertEqual(venv_store.collect()[:2], (1, 1))
+        self.assertEqual(venv_store.entries(), [])
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+import docker
+from dockipy import warm
+from dockipy.image_cache import FINGERPRINT_LABEL
+
+
+class TestWarm(unittest.TestCase):
+    def setUp(self):
+        self.config = {"base_image": "ubuntu:22.04", "tag": "demo"}
+
+    def test_fingerprint_follows_the_run_configuration(self):
+        fingerprint = warm.container_fingerprint("sha256:a", self.config, "/home/demo", "/demo")
+        self.assertEqual(fingerprint, warm.container_fingerprint("sha256:a", dict(self.config), "/home/demo", "/demo"))
+        self.assertNotEqual(fingerprint, warm.container_fingerprint("sha256:b", self.config, "/home/demo", "/demo"))
+        self.assertNotEqual(fingerprint, warm.container_fingerprint("sha256:a", self.config, "/home/other", "/demo"))
+        self.assertNotEqual(fingerprint, warm.container_fingerprint("sha256:a", dict(self.config, idle_timeout=60), "/home/demo", "/demo"))
+        self.assertNotEqual(fingerprint, warm.container_fingerprint("sha256:a", dict(self.config, base_image="nvidia/cuda:11.8.0"), "/home/demo", "/demo"))
+
+    def get_or_start(self, container):
+        client = mock.Mock()
+        client.images.get.return_value.id = "sha256:a"
+        if container is None:
+            client.containers.get.side_effect = docker.errors.NotFound("gone")
+        else:
+            client.containers.get.return_value = container
+        with mock.patch.object(warm, "container_fingerprint", return_value="abc"), mock.patch("builtins.print"):
+            result = warm.get_or_start(client, "demo", self.config, "/home/demo", "/demo")
+        return client, result
+
+    def warm_container(self, fingerprint="abc", status="running"):
+        container = mock.Mock(status=status, labels={FINGERPRINT_LABEL: fingerprint})
+        container.exec_run.return_value.exit_code = 0
+        return container
+
+    def test_matching_container_is_reused_and_touched(self):
+        container = self.warm_container()
+        client, result = self.get_or_start(container)
+        self.assertIs(result, container)
+        self.assertIn("/tmp/docki-last-used", container.exec_run.call_args[0][0])
+        container.remove.assert_not_called()
+        client.containers.run.assert_not_called()
+
+    def test_changed_or_stopped_container_is_replaced(self):
+        for container in [self.warm_container(fingerprint="old"), self.warm_container(status="exited")]:
+            client, result = self.get_or_start(container)
+            container.remove.assert_called_once_with(force=True)
+            self.assertIs(result, client.containers.run.return_value)
+            self.assertEqual(client.containers.run.call_args[1]["labels"][FINGERPRINT_LABEL], "abc")
+
+    def test_container_that_exits_while_reused_is_replaced(self):
+        container = self.warm_container()
+        container.exec_run.side_effect = docker.errors.APIError("container is not running")
+        client, result = self.get_or_start(container)
+        container.remove.assert_called_once_with(force=True)
+        self.assertIs(result, client.containers.run.return_value)
+
+    def test_missing_container_is_started(self):
+        client, result = self.get_or_start(None)
+        self.assertIs(result, client.containers.run.return_value)
+        self.assertEqual(client.containers.run.call_args[1]["name"], "demo-warm")